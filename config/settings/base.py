@@ -5,6 +5,7 @@ from pathlib import Path
 
 import environ
 from redis import Redis
+from redis.cluster import RedisCluster
 
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent.parent
 # blog/
@@ -314,9 +315,136 @@ SPECTACULAR_SETTINGS = {
 # Your stuff...
 # ------------------------------------------------------------------------------
 
-redis = Redis(
-    host=env.str("REDIS_HOST", "localhost"),
-    port=env.int("REDIS_PORT", 6379),
-    db=env.int("REDIS_DB", 0),
-    decode_responses=env.bool("REDIS_DECORE_RESPONSE", True),
+# with REDIS_CLUSTER the other nodes are discovered from REDIS_HOST:REDIS_PORT,
+# a cluster has no databases other than 0
+REDIS_CLUSTER = env.bool("REDIS_CLUSTER", False)
+if REDIS_CLUSTER:
+    redis = RedisCluster(
+        host=env.str("REDIS_HOST", "localhost"),
+        port=env.int("REDIS_PORT", 6379),
+        decode_responses=env.bool("REDIS_DECORE_RESPONSE", True),
+    )
+else:
+    redis = Redis(
+        host=env.str("REDIS_HOST", "localhost"),
+        port=env.int("REDIS_PORT", 6379),
+        db=env.int("REDIS_DB", 0),
+        decode_responses=env.bool("REDIS_DECORE_RESPONSE", True),
+    )
+
+# in-process cache in front of redis for the content list,
+# ttl is the staleness bound in seconds if an invalidation message is lost
+CONTENT_CACHE_LOCAL_ENABLED = env.bool("CONTENT_CACHE_LOCAL_ENABLED", False)
+CONTENT_CACHE_LOCAL_MAX_SIZE = env.int("CONTENT_CACHE_LOCAL_MAX_SIZE", 1000)
+CONTENT_CACHE_LOCAL_TTL = env.float("CONTENT_CACHE_LOCAL_TTL", 1.0)
+
+# storage layout of the content cache, "hash" keeps one hash per content and
+# "bucket" groups contents in compact hashes of CONTENT_CACHE_BUCKET_SIZE ids
+CONTENT_CACHE_LAYOUT = env.str("CONTENT_CACHE_LAYOUT", "hash")
+CONTENT_CACHE_BUCKET_SIZE = env.int("CONTENT_CACHE_BUCKET_SIZE", 32)
+
+# encoding of the single reply which returns a whole page of the content cache,
+# "json" or "msgpack", it is empty to read each content with its own command
+CONTENT_CACHE_CODEC = env.str("CONTENT_CACHE_CODEC", "")
+
+# number of consecutive content ids whose keys share a cluster hash tag,
+# a page is then read from one or two slots, 0 disables the tags
+CONTENT_CACHE_HASH_TAG_SIZE = env.int("CONTENT_CACHE_HASH_TAG_SIZE", 0)
+
+# "host:port" of replicas of the primary, content reads are sent to replicas
+# which are at most REDIS_REPLICA_MAX_LAG seconds behind, replicas are checked
+# every REDIS_REPLICA_CHECK_INTERVAL seconds, reads fall back to the primary.
+# Scripts of reads are sent to replicas as EVAL_RO, they must run redis 7
+REDIS_REPLICAS = env.list("REDIS_REPLICAS", default=[])
+REDIS_REPLICA_MAX_LAG = env.float("REDIS_REPLICA_MAX_LAG", 1.0)
+REDIS_REPLICA_CHECK_INTERVAL = env.float("REDIS_REPLICA_CHECK_INTERVAL", 1.0)
+REDIS_REPLICA_SOCKET_TIMEOUT = env.float("REDIS_REPLICA_SOCKET_TIMEOUT", 0.5)
+
+# contents missed in the content cache are loaded from database and written
+# back, a request waits at most CONTENT_CACHE_FILL_TIMEOUT seconds for another
+# request which fills the same contents, with read through CONTENT_CACHE_TTL
+# seconds can be set so redis may run with an eviction policy, 0 means no ttl
+CONTENT_CACHE_READ_THROUGH = env.bool("CONTENT_CACHE_READ_THROUGH", False)
+CONTENT_CACHE_FILL_TIMEOUT = env.float("CONTENT_CACHE_FILL_TIMEOUT", 1.0)
+CONTENT_CACHE_TTL = env.int("CONTENT_CACHE_TTL", 0)
+
+# a page of the content list has at most CONTENT_PAGE_MAX_SIZE live contents,
+# the next page of a longer range starts after the last one
+CONTENT_PAGE_MAX_SIZE = env.int("CONTENT_PAGE_MAX_SIZE", 100)
+
+# a full build writes contents to a new generation of keys and switches readers
+# to it, workers keep the current generation for CONTENT_CACHE_GENERATION_TTL
+# seconds, so they may read the previous generation as long after a switch
+CONTENT_CACHE_GENERATION_TTL = env.float("CONTENT_CACHE_GENERATION_TTL", 1.0)
+
+# workers lease up to RATE_LIMITER_LEASE_MAX_TOKENS tokens of a like rate limit
+# and admit from them locally for RATE_LIMITER_LEASE_TTL seconds, so each worker
+# may be that many tokens off a limit. Leases are taken per limit of the rules
+# of RATE_LIMITER_LEASED_RULES, which are shared by many requests, the other
+# limits are decided in redis for each request
+RATE_LIMITER_LEASING = env.bool("RATE_LIMITER_LEASING", False)
+RATE_LIMITER_LEASE_MAX_TOKENS = env.int("RATE_LIMITER_LEASE_MAX_TOKENS", 10)
+RATE_LIMITER_LEASE_TTL = env.float("RATE_LIMITER_LEASE_TTL", 1.0)
+RATE_LIMITER_LEASED_RULES = env.list(
+    "RATE_LIMITER_LEASED_RULES",
+    default=["content", "global"],
 )
+
+# likes are counted in the cache and appended to a redis stream, flush_likes
+# workers write them to database in batches, so a like costs no query
+LIKE_WRITE_BEHIND = env.bool("LIKE_WRITE_BEHIND", False)
+# maximum number of likes sent in one request to the bulk like endpoint
+LIKE_BULK_MAX_SIZE = env.int("LIKE_BULK_MAX_SIZE", 500)
+
+# algorithm of the rate limiter of each use case,
+# "token_bucket", "gcra" or "sliding_window"
+RATE_LIMITER_ALGORITHMS = {
+    "like": env.str("LIKE_RATE_LIMITER_ALGORITHM", "token_bucket"),
+}
+
+# limits of each use case decided together, a request is admitted only if every
+# limit admits it. Keys are formatted with the values of the request, a limit
+# is skipped if one of them is missing, limit_period is in seconds.
+# Rate limit rules of the admin override them by name, a disabled one is skipped.
+# The user limit admits a whole bulk replay of queued likes and refills in
+# limit_period. The ip limit is off by default, clients behind one proxy or NAT
+# share it, and so is the global one, which caps the likes of the whole site
+RATE_LIMITS = {
+    "like": [
+        {
+            "name": "content",
+            "key": "content_id:{content_id}",
+            "limit_count": env.int("LIKE_RATE_LIMIT_PER_CONTENT", 100),
+            "limit_period": 60,
+        },
+        {
+            "name": "user",
+            "key": "user_id:{user_id}",
+            "limit_count": env.int("LIKE_RATE_LIMIT_PER_USER", LIKE_BULK_MAX_SIZE),
+            "limit_period": env.int("LIKE_RATE_LIMIT_PER_USER_PERIOD", 600),
+        },
+        {
+            "name": "ip",
+            "key": "ip:{ip}",
+            "limit_count": env.int("LIKE_RATE_LIMIT_PER_IP", 60),
+            "limit_period": 60,
+            "enabled": env.bool("LIKE_RATE_LIMIT_PER_IP_ENABLED", False),
+        },
+        {
+            "name": "global",
+            "key": "global",
+            "limit_count": env.int("LIKE_RATE_LIMIT_GLOBAL", 10_000),
+            "limit_period": 60,
+            "enabled": env.bool("LIKE_RATE_LIMIT_GLOBAL_ENABLED", False),
+        },
+    ],
+}
+
+# header of the client address set by the trusted proxy in front of the app,
+# e.g. HTTP_X_REAL_IP. Without it the last address of X-Forwarded-For, which
+# the proxy appends, is taken, and REMOTE_ADDR if there is no such header
+CLIENT_IP_HEADER = env.str("CLIENT_IP_HEADER", "")
+
+# workers keep the rate limit rules of the admin for RATE_LIMIT_RULES_TTL seconds
+# if a change notification is lost, changes are applied when it arrives otherwise
+RATE_LIMIT_RULES_TTL = env.float("RATE_LIMIT_RULES_TTL", 60.0)
@@ -36,3 +36,7 @@ TEMPLATES[0]["OPTIONS"]["debug"] = True  # type: ignore[index]
 MEDIA_URL = "http://media.testserver"
 # Your stuff...
 # ------------------------------------------------------------------------------
+# redis is flushed between tests, the generation of cache keys must not outlive it
+CONTENT_CACHE_GENERATION_TTL = 0
+# and so are the rate limit rules
+RATE_LIMIT_RULES_TTL = 0
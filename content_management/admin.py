@@ -1,3 +1,31 @@
+import functools
+
 from django.contrib import admin
+from django.db import transaction
+
+from content_management.models import RateLimitRule
+
+
+@admin.register(RateLimitRule)
+class RateLimitRuleAdmin(admin.ModelAdmin):
+    list_display = [
+        "use_case",
+        "name",
+        "key",
+        "conditions",
+        "limit_count",
+        "limit_period",
+        "enabled",
+        "updated_at",
+    ]
+    list_editable = ["limit_count", "enabled"]
+    list_filter = ["use_case", "enabled"]
+    search_fields = ["name", "key"]
 
-# Register your models here.
+    def delete_queryset(self, request, queryset):
+        # bulk deletes skip the hooks of rules, so the use cases are published
+        # here, once the delete is committed as by the hooks
+        use_cases = set(queryset.values_list("use_case", flat=True))
+        super().delete_queryset(request, queryset)
+        for use_case in use_cases:
+            transaction.on_commit(functools.partial(RateLimitRule.publish, use_case))
@@ -1,6 +1,12 @@
+import contextlib
+
 from django.apps import AppConfig
 
 
 class ContentManagementConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "content_management"
+
+    def ready(self):
+        with contextlib.suppress(ImportError):
+            import content_management.signals  # noqa: F401
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import itertools
+import operator
+import random
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from content_management.cluster import load_scripts
+from content_management.cluster import queue_script
+from content_management.models import Content
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from content_management.caches import ContentCache
+
+# values are written only if the hash still has the observed aggregates,
+# so likes which arrived after the audit read are not overwritten
+# KEYS[1]: content key
+# ARGV: likes count field, likes sum field, observed likes count,
+# observed likes sum, field, value, ...
+REPAIR_SCRIPT = """
+local count = redis.call('HGET', KEYS[1], ARGV[1]) or ''
+local likes_sum = redis.call('HGET', KEYS[1], ARGV[2]) or ''
+if count ~= ARGV[3] or likes_sum ~= ARGV[4] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], 'likes_avg')
+redis.call('HSET', KEYS[1], unpack(ARGV, 5))
+return 1
+"""
+
+
+@dataclass
+class AuditReport:
+    checked: int = 0
+    # contents in database without a cached hash
+    missing: int = 0
+    # cached hashes of contents which are not in database anymore
+    orphaned: int = 0
+    # cached hashes with a different title, likes count or likes sum
+    drifted: int = 0
+    repaired: int = 0
+    max_count_drift: int = 0
+    max_avg_drift: float = 0.0
+    total_avg_drift: float = 0.0
+
+    @property
+    def mean_avg_drift(self) -> float:
+        return self.total_avg_drift / self.drifted if self.drifted else 0.0
+
+    def __str__(self):
+        return (
+            f"checked: {self.checked}, missing: {self.missing}, "
+            f"orphaned: {self.orphaned}, drifted: {self.drifted}, "
+            f"repaired: {self.repaired}, "
+            f"max count drift: {self.max_count_drift}, "
+            f"max avg drift: {self.max_avg_drift:.4f}, "
+            f"mean avg drift: {self.mean_avg_drift:.4f}"
+        )
+
+
+def _get_cached_aggregates(value: dict) -> tuple[int, int]:
+    """Likes count and sum of a cached hash, old likes_avg hashes included"""
+    likes_count = int(value.get("likes_count") or 0)
+    if "likes_sum" in value:
+        return likes_count, int(value["likes_sum"])
+    return likes_count, round(float(value.get("likes_avg") or 0) * likes_count)
+
+
+def _get_avg(likes_count: int, likes_sum: int) -> float:
+    return likes_sum / likes_count if likes_count else 0.0
+
+
+class ContentCacheAuditor:
+    """Compare cached content aggregates with fresh database aggregates,
+    cache and database are read in batches of ids
+    """
+
+    def __init__(self, cache: ContentCache, batch_size: int = 1000):
+        self.cache = cache
+        self.batch_size = batch_size
+        self._repair_script = cache.conn.register_script(REPAIR_SCRIPT)
+
+    def get_all_ids(self) -> Iterable[int]:
+        """Ids of the database contents, the range is extended to the cached
+        max id to find hashes of deleted contents too
+        """
+        bounds = self.cache.get_id_bounds() or (1, 0)
+        max_id = int(self.cache.conn.get(Content.redis_max_id_key) or 0)
+        return range(bounds[0], max(bounds[1], max_id) + 1)
+
+    def get_sample_ids(self, size: int) -> list[int]:
+        """Uniform sample of the id space, ids of deleted contents are skipped"""
+        ids = self.get_all_ids()
+        return sorted(random.sample(ids, min(size, len(ids))))
+
+    def audit(self, ids: Iterable[int], *, repair: bool = False) -> AuditReport:
+        report = AuditReport()
+        ids = iter(ids)
+        while batch := list(itertools.islice(ids, self.batch_size)):
+            self._audit_batch(batch, report, repair=repair)
+        return report
+
+    def _audit_batch(self, ids: list[int], report: AuditReport, *, repair: bool):
+        cached, _ = self.cache._fetch(ids)  # noqa: SLF001
+        rows = self.cache._get_data().filter(id__in=ids)  # noqa: SLF001
+        fresh = {row["id"]: row for row in rows}
+        orphaned = [
+            id_
+            for id_, value in zip(ids, cached, strict=True)
+            if value and id_ not in fresh
+        ]
+        checked = [
+            (fresh[id_], id_, value)
+            for id_, value in zip(ids, cached, strict=True)
+            if id_ in fresh
+        ]
+        report.checked += len(checked)
+        report.orphaned += len(orphaned)
+        stale = self._compare(checked, report) if checked else []
+        if repair and (orphaned or stale):
+            self._repair(orphaned, stale, report)
+
+    def _compare(
+        self,
+        checked: list[tuple[dict, int, dict]],
+        report: AuditReport,
+    ) -> list[tuple[dict, int, dict]]:
+        """Compare whole columns of a batch at once,
+        returns rows which their cached value is missing or different
+        """
+        rows, _, values = zip(*checked, strict=True)
+        cached_aggregates = [_get_cached_aggregates(value) for value in values]
+        count_drifts = map(
+            operator.sub,
+            [row["likes_count"] for row in rows],
+            [likes_count for likes_count, _ in cached_aggregates],
+        )
+        avg_drifts = map(
+            operator.sub,
+            [_get_avg(row["likes_count"], row["likes_sum"]) for row in rows],
+            [_get_avg(*aggregates) for aggregates in cached_aggregates],
+        )
+        stale = []
+        for item, aggregates, count_drift, avg_drift in zip(
+            checked,
+            cached_aggregates,
+            count_drifts,
+            avg_drifts,
+            strict=True,
+        ):
+            row, _, value = item
+            if not value:
+                report.missing += 1
+                stale.append(item)
+            elif (
+                aggregates != (row["likes_count"], row["likes_sum"])
+                or value.get("title") != row["title"]
+            ):
+                report.drifted += 1
+                report.max_count_drift = max(report.max_count_drift, abs(count_drift))
+                report.max_avg_drift = max(report.max_avg_drift, abs(avg_drift))
+                report.total_avg_drift += abs(avg_drift)
+                stale.append(item)
+        return stale
+
+    def _repair(
+        self,
+        orphaned: list[int],
+        stale: list[tuple[dict, int, dict]],
+        report: AuditReport,
+    ):
+        """Rewrite only the values which are found different"""
+        load_scripts(self.cache.conn, self._repair_script)
+        generation = self.cache.get_generation()
+        pipe = self.cache.conn.pipeline(transaction=False)
+        for id_ in orphaned:
+            self.cache._queue_delete(pipe, id_, generation)  # noqa: SLF001
+        for row, id_, value in stale:
+            args = [
+                self.cache.get_field(id_, "likes_count"),
+                self.cache.get_field(id_, "likes_sum"),
+                value.get("likes_count", ""),
+                value.get("likes_sum", ""),
+                *itertools.chain.from_iterable(self.cache.get_value(row).items()),
+            ]
+            queue_script(
+                pipe,
+                self._repair_script,
+                keys=[self.cache.get_key(id_=id_, generation=generation)],
+                args=args,
+            )
+        result = pipe.execute()
+        report.repaired += len(orphaned) + sum(result[len(orphaned) :])
+        self.cache.invalidate(orphaned + [id_ for _, id_, _ in stale])
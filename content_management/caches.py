@@ -1,127 +1,1830 @@
 from __future__ import annotations
 
+import functools
+import itertools
+import random
+import time
+import uuid
+from datetime import datetime
+from datetime import timedelta
 from typing import TYPE_CHECKING
 
-from django.db.models import Avg
+from django.conf import settings
 from django.db.models import Count
 from django.db.models import OuterRef
+from django.db.models import Sum
 from django.db.models.functions import Coalesce
+from django.utils import timezone
+from redis.client import NEVER_DECODE
 
+from content_management.cluster import group_by_slot
+from content_management.cluster import is_cluster
+from content_management.cluster import load_scripts
+from content_management.cluster import queue_script
+from content_management.cluster import run_read_only_script
+from content_management.codecs import get_codec
+from content_management.local_cache import INVALIDATE_ALL
+from content_management.local_cache import LocalCache
 from content_management.models import Content
 from content_management.models import Like
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+    from collections.abc import Iterable
+
     from redis import Redis
+    from redis.client import Pipeline
+    from redis.cluster import RedisCluster
+    from redis.commands.core import Script
+
+    from content_management.codecs import Codec
+
+    # called with the number of built rows and the id of the last one
+    BuildProgress = Callable[[int, int], None]
+
+
+# hashes written before likes_sum was introduced keep a floating likes_avg,
+# it is converted to likes_sum in place before the hash is touched
+_MIGRATE_LIKES_AVG = """
+local function migrate_likes_avg(key)
+    local avg = redis.call('HGET', key, 'likes_avg')
+    if not avg then
+        return 0
+    end
+    local count = tonumber(redis.call('HGET', key, 'likes_count') or '0')
+    local likes_sum = math.floor(tonumber(avg) * count + 0.5)
+    redis.call('HSET', key, 'likes_sum', likes_sum)
+    redis.call('HDEL', key, 'likes_avg')
+    return 1
+end
+"""
+
+# KEYS[1]: content key
+MIGRATE_LIKES_AVG_SCRIPT = (
+    _MIGRATE_LIKES_AVG
+    + """
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    return 0
+end
+return migrate_likes_avg(KEYS[1])
+"""
+)
+
+# nothing is written if readers were switched to another generation
+# since the keys were named, the caller names them again and retries
+STALE_GENERATION = -1
+_CHECK_GENERATION = f"""
+if KEYS[3] and (redis.call('GET', KEYS[3]) or '0') ~= ARGV[#ARGV] then
+    return {STALE_GENERATION}
+end
+"""
+
+# KEYS: content key, optional user likes key, optional generation pointer
+# ARGV: content id, content title, like value, invalidation channel,
+# then id, title, likes count and likes sum field names in the content hash,
+# id is not stored if its field name is empty,
+# then 1 if a missing content is left to be filled from database on read,
+# then the generation of the content key
+CONTENT_LIKED_SCRIPT = (
+    _MIGRATE_LIKES_AVG
+    + _CHECK_GENERATION
+    + """
+if KEYS[2] then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+end
+if ARGV[9] == '1' and redis.call('HEXISTS', KEYS[1], ARGV[6]) == 0 then
+    return 0
+end
+migrate_likes_avg(KEYS[1])
+local count = redis.call('HINCRBY', KEYS[1], ARGV[7], 1)
+redis.call('HINCRBY', KEYS[1], ARGV[8], ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[6], ARGV[2])
+if ARGV[5] ~= '' then
+    redis.call('HSET', KEYS[1], ARGV[5], ARGV[1])
+end
+redis.call('PUBLISH', ARGV[4], ARGV[1])
+return count
+"""
+)
+
+# KEYS: content key, optional user likes key, optional generation pointer
+# ARGV: past like value, new like value, invalidation channel, content id,
+# then likes count and likes sum field names in the content hash,
+# then the generation of the content key
+LIKE_VALUE_UPDATED_SCRIPT = (
+    _MIGRATE_LIKES_AVG
+    + _CHECK_GENERATION
+    + """
+if KEYS[2] then
+    redis.call('HSET', KEYS[2], ARGV[4], ARGV[2])
+end
+local count = tonumber(redis.call('HGET', KEYS[1], ARGV[5]) or '0')
+if count <= 0 then
+    return 0
+end
+migrate_likes_avg(KEYS[1])
+redis.call('HINCRBY', KEYS[1], ARGV[6], ARGV[2] - ARGV[1])
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+return count
+"""
+)
+
+# a like of which the database is written behind the cache, it is a new like
+# if the user has not liked the content before by the like index of the user.
+# A missing content is left to be filled from database, as its title is unknown
+# KEYS: content key, optional user likes key, optional generation pointer,
+# optional stream the like is appended to
+# ARGV: content id, user id, like value, invalidation channel,
+# then title, likes count and likes sum field names in the content hash,
+# then the past like value of the user or '' if the user likes key is not given,
+# then the like state in the stream, then the generation of the content key
+# returns 1 if it is a new like and 0 if the value of a like is updated
+LIKE_RECEIVED_SCRIPT = (
+    _MIGRATE_LIKES_AVG
+    + _CHECK_GENERATION
+    + """
+local past = ARGV[8]
+if KEYS[2] then
+    past = redis.call('HGET', KEYS[2], ARGV[1]) or ''
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+end
+if KEYS[4] then
+    redis.call('XADD', KEYS[4], '*', 'user_id', ARGV[2], 'content_id', ARGV[1],
+        'value', ARGV[3], 'state', ARGV[9])
+end
+local created = past == ''
+if created then
+    if redis.call('HEXISTS', KEYS[1], ARGV[5]) == 1 then
+        migrate_likes_avg(KEYS[1])
+        redis.call('HINCRBY', KEYS[1], ARGV[6], 1)
+        redis.call('HINCRBY', KEYS[1], ARGV[7], ARGV[3])
+        redis.call('PUBLISH', ARGV[4], ARGV[1])
+    end
+    return 1
+end
+if tonumber(redis.call('HGET', KEYS[1], ARGV[6]) or '0') > 0 then
+    migrate_likes_avg(KEYS[1])
+    redis.call('HINCRBY', KEYS[1], ARGV[7], ARGV[3] - past)
+    redis.call('PUBLISH', ARGV[4], ARGV[1])
+end
+return 0
+"""
+)
+
+# values of many hashes in one encoded reply, `encode` is defined by the codec,
+# in a cluster all keys must be in the same slot
+# KEYS: hash keys
+# ARGV: for each key the number of its fields and then the field names,
+# all fields of a key are returned as a flat list if its number is 0
+_MULTI_GET = """
+local result = {}
+local i = 1
+for k, key in ipairs(KEYS) do
+    local n = tonumber(ARGV[i])
+    if n == 0 then
+        result[k] = redis.call('HGETALL', key)
+    else
+        result[k] = redis.call('HMGET', key, unpack(ARGV, i + 1, i + n))
+    end
+    i = i + n + 1
+end
+return encode(result)
+"""
+
+
+# a fill lock is released only by its owner, it may have expired and been
+# taken by another request
+# KEYS[1]: lock key
+# ARGV[1]: token of the owner
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# live ids of [from, to) in order, at most limit of them. Ids above the max id
+# of the bitmap are not known to be missing, so they are all listed.
+# BITPOS skips the zero bytes of a gap, the bits of a byte which is partly
+# before from are checked one by one
+# KEYS: live ids bitmap, its max id
+# ARGV: from, to, limit
+LIVE_IDS_SCRIPT = """
+local from = tonumber(ARGV[1])
+local to = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local max_id = tonumber(redis.call('GET', KEYS[2]) or '-1')
+local ids = {}
+local pos = from
+local known_to = math.min(to, max_id + 1)
+while #ids < limit and pos < known_to do
+    local found = redis.call(
+        'BITPOS', KEYS[1], 1, math.floor(pos / 8), math.floor((known_to - 1) / 8)
+    )
+    if found == -1 or found >= known_to then
+        pos = known_to
+    elseif found >= pos then
+        ids[#ids + 1] = found
+        pos = found + 1
+    else
+        local byte_end = math.min((math.floor(pos / 8) + 1) * 8, known_to)
+        while #ids < limit and pos < byte_end do
+            if redis.call('GETBIT', KEYS[1], pos) == 1 then
+                ids[#ids + 1] = pos
+            end
+            pos = pos + 1
+        end
+    end
+end
+pos = math.max(pos, max_id + 1)
+while #ids < limit and pos < to do
+    ids[#ids + 1] = pos
+    pos = pos + 1
+end
+return ids
+"""
+
+# the max id is only advanced if the bitmap is built,
+# otherwise ids below the added ones would be taken as missing
+# KEYS: live ids bitmap, its max id
+# ARGV: ids of created contents
+ADD_LIVE_IDS_SCRIPT = """
+local max_id = redis.call('GET', KEYS[2])
+local added = -1
+for _, id in ipairs(ARGV) do
+    redis.call('SETBIT', KEYS[1], id, 1)
+    added = math.max(added, tonumber(id))
+end
+if max_id and added > tonumber(max_id) then
+    redis.call('SET', KEYS[2], added)
+end
+return added
+"""
+
+# a built bitmap replaces the live one with its max id at once
+# KEYS: live ids bitmap, its max id, the built bitmap
+# ARGV: max id of the built bitmap
+PUBLISH_LIVE_IDS_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('RENAME', KEYS[3], KEYS[1])
+else
+    redis.call('DEL', KEYS[1])
+end
+redis.call('SET', KEYS[2], ARGV[1])
+return 1
+"""
+
+# the max id of contents is only raised, so concurrent creations never lower it
+# KEYS[1]: max id key
+# ARGV[1]: id of a created content
+ADVANCE_MAX_ID_SCRIPT = """
+local max_id = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > max_id then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return tonumber(ARGV[1])
+end
+return max_id
+"""
+
+# a field of a content is refreshed only if the content is cached,
+# a partial hash would be read as a content without likes
+# KEYS[1]: content key
+# ARGV: field name, value, invalidation channel, content id
+REFRESH_FIELD_SCRIPT = """
+local refreshed = 0
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    refreshed = 1
+end
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+return refreshed
+"""
+
+# a new generation is allocated for a build, the one left by a crashed build or
+# warm is retired, so its keys are reclaimed
+# KEYS: building generation, last allocated generation, set of retired generations
+START_GENERATION_SCRIPT = """
+local building = redis.call('GET', KEYS[1])
+if building then
+    redis.call('SADD', KEYS[3], building)
+end
+local generation = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], generation)
+return generation
+"""
+
+# the built generation becomes the current one, the current one is kept as the
+# previous one for a rollback and the former previous one is retired
+# KEYS: current generation, previous generation, building generation,
+# set of retired generations
+# ARGV: built generation
+CUT_OVER_SCRIPT = """
+local current = redis.call('GET', KEYS[1]) or '0'
+local previous = redis.call('GET', KEYS[2])
+if previous and previous ~= ARGV[1] then
+    redis.call('SADD', KEYS[4], previous)
+end
+redis.call('SET', KEYS[2], current)
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[3])
+return current
+"""
+
+# the current and previous generations are swapped, so a second rollback
+# switches back to the generation which was rolled back
+# KEYS: current generation, previous generation
+ROLLBACK_SCRIPT = """
+local previous = redis.call('GET', KEYS[2])
+if not previous then
+    return false
+end
+redis.call('SET', KEYS[2], redis.call('GET', KEYS[1]) or '0')
+redis.call('SET', KEYS[1], previous)
+return previous
+"""
+
+
+class CacheBuildError(Exception):
+    pass
+
+
+class GenerationPointer:
+    """Current generation of a versioned cache namespace,
+    it is kept in process for ttl seconds so keys are named without a round trip
+    """
+
+    def __init__(self, key: str, clock: Callable[[], float] = time.monotonic):
+        self.key = key
+        self.clock = clock
+        # generation and the time it expires at
+        self._cached: tuple[int, float] | None = None
+
+    def get(self, conn: Redis | RedisCluster, ttl: float) -> int:
+        cached = self._cached
+        if cached is None or self.clock() >= cached[1]:
+            return self.refresh(conn, ttl)
+        return cached[0]
+
+    def refresh(self, conn: Redis | RedisCluster, ttl: float) -> int:
+        generation = int(conn.get(self.key) or 0)
+        self._cached = (generation, self.clock() + ttl)
+        return generation
+
+
+@functools.cache
+def get_generation_pointer(key: str) -> GenerationPointer:
+    """Pointer shared by the caches of this worker"""
+    return GenerationPointer(key)
+
+
+def get_stream_fields(like: Like) -> dict:
+    """Fields of a like in the stream which the database is written from"""
+    return {
+        "user_id": like.user_id,
+        "content_id": like.content_id,
+        "value": like.value,
+        "state": int(like.state),
+    }
+
+
+def get_multi_get_script(codec: Codec) -> str:
+    return f"local encode = {codec.lua_encode}\n{_MULTI_GET}"
+
+
+@functools.cache
+def get_local_cache() -> LocalCache | None:
+    """Local cache shared by the requests of this worker, if it is enabled"""
+    if not settings.CONTENT_CACHE_LOCAL_ENABLED:
+        return None
+    return LocalCache(
+        max_size=settings.CONTENT_CACHE_LOCAL_MAX_SIZE,
+        ttl=settings.CONTENT_CACHE_LOCAL_TTL,
+    )
+
+
+def _get_active_likes():
+    """Ok likes, the unique constraint keeps one of each user on each content"""
+    return Like.objects.filter(state=Like.StateChoice.OK)
 
 
 class BaseCache:
-    conn: Redis
+    conn: Redis | RedisCluster
+    local_cache: LocalCache | None
+    # values of a page are read in one encoded reply if it is set
+    codec: Codec | None
+    # reads are sent to it, writes and scripts to conn
+    read_conn: Redis | RedisCluster
+    # missed ids are loaded from database, written back and returned
+    read_through: bool
+    # seconds which written values live, they live forever if it is None
+    ttl: int | None
+    # seconds which a fill lock is held, others wait for it at most this long
+    fill_timeout: float
+    fill_lock_prefix: str
+    # ids of changed rows are published on it to invalidate local caches
+    invalidation_channel: str | None = None
+    # id of the last row written by the running or crashed build
+    build_checkpoint_key: str
+    # start time of the last finished build, rows changed after it are stale
+    watermark_key: str
+    # pointer to the generation of keys which readers use, a full build writes
+    # a new generation and switches readers to it once it is validated,
+    # keys are not versioned if it is None
+    generation_key: str | None = None
+    # seconds which the current generation is kept in process
+    generation_ttl: float
+    # generation written by the running build, the current one is used if None
+    generation: int | None
 
-    def __init__(self, conn: Redis):
-        """Get a redis connection session"""
+    def __init__(  # noqa: PLR0913
+        self,
+        conn: Redis | RedisCluster,
+        local_cache: LocalCache | None = None,
+        *,
+        codec: Codec | None = None,
+        read_conn: Redis | RedisCluster | None = None,
+        read_through: bool = False,
+        ttl: int | None = None,
+        fill_timeout: float = 1.0,
+        generation_ttl: float | None = None,
+    ):
+        """Get a redis connection session,
+        an optional in-process cache to be checked before redis,
+        an optional codec of the multi get replies,
+        an optional connection of a replica for reads,
+        the read through options
+        and the seconds which the current generation is kept in process,
+        CONTENT_CACHE_GENERATION_TTL by default
+        """
         self.conn = conn
+        self.local_cache = local_cache
+        self.codec = codec
+        self.read_conn = read_conn or conn
+        self.read_through = read_through
+        self.ttl = ttl or None
+        self.fill_timeout = fill_timeout
+        self.generation_ttl = (
+            settings.CONTENT_CACHE_GENERATION_TTL
+            if generation_ttl is None
+            else generation_ttl
+        )
+        self.generation = None
+        if codec is not None:
+            self._multi_get_script = get_multi_get_script(codec)
+        self._unlock_script = conn.register_script(UNLOCK_SCRIPT)
+        self._start_generation_script = conn.register_script(START_GENERATION_SCRIPT)
+        self._cut_over_script = conn.register_script(CUT_OVER_SCRIPT)
+        self._rollback_script = conn.register_script(ROLLBACK_SCRIPT)
 
     def _get_data(self):
         """It will return all the database related data"""
         raise NotImplementedError
 
     def get_key(self, *args, **kwargs):
-        """Get data key to be used in cache"""
+        """Get data key to be used in cache,
+        in the given generation or the current one if it is not given
+        """
         raise NotImplementedError
 
     def get_value(self, data):
         """Get value to be set in cache"""
         raise NotImplementedError
 
-    def _build(self, data):
-        """Set all data to the cache"""
-        pipe = self.conn.pipeline()
-        for row in data:
-            key = self.get_key(row)
-            value = self.get_value(row)
-            pipe.hset(key, mapping=value)
+    def get_representation(self, value: dict) -> dict:
+        """Get data to be returned from a cached value"""
+        return dict(value)
+
+    def _get_read_fields(self, id_: int) -> list[str]:
+        """Fields of the cached value of id, empty means the whole hash"""
+        return []
+
+    def _queue_read(self, pipe: Pipeline, id_: int, generation: int | None = None):
+        """Queue the command which reads the cached value of id"""
+        pipe.hgetall(self.get_key(id_=id_, generation=generation))
+
+    def _queue_multi_get(
+        self,
+        pipe: Pipeline,
+        ids: list[int],
+        generation: int | None = None,
+    ):
+        """Queue one script which reads the values of all ids,
+        EVAL is used instead of EVALSHA so the pipeline needs no SCRIPT EXISTS
+        round trip, redis caches the compiled script by its body.
+        It is sent by EVAL_RO if reads go to a replica
+        """
+        keys = []
+        args = []
+        for id_ in ids:
+            fields = self._get_read_fields(id_)
+            keys.append(self.get_key(id_=id_, generation=generation))
+            args += [len(fields), *fields]
+        pipe.execute_command(
+            "EVAL_RO" if self.read_conn is not self.conn else "EVAL",
+            self._multi_get_script,
+            len(keys),
+            *keys,
+            *args,
+            # the encoded reply is binary, it must not be decoded as text
+            **{NEVER_DECODE: True},
+        )
+
+    def _split_multi_get(self, ids: list[int], reply: bytes) -> list:
+        """Decode the multi get reply to the replies of the per id commands"""
+        replies = []
+        for id_, values in zip(ids, self.codec.decode(reply), strict=True):
+            if self._get_read_fields(id_):
+                # lua turns missing fields to false
+                replies.append([None if value is False else value for value in values])
+            elif values:
+                replies.append(dict(zip(values[::2], values[1::2], strict=True)))
+            else:
+                # an empty lua table is encoded as an empty object by cjson
+                replies.append({})
+        return replies
+
+    def _parse_read(self, id_: int, reply) -> dict:
+        """Get the cached value of id from the reply of the queued command"""
+        return reply
+
+    def _queue_delete(self, pipe: Pipeline, id_: int, generation: int | None = None):
+        """Queue the command which removes the cached value of id"""
+        pipe.unlink(self.get_key(id_=id_, generation=generation))
+
+    def set_many(self, data: Iterable[dict], batch_size: int = 1000) -> int:
+        """Set rows to the cache without a build checkpoint"""
+        return self._build(data, batch_size=batch_size, checkpoint=False)
+
+    def delete_many(self, ids: list[int]):
+        """Remove cached values of ids"""
+        if not ids:
+            return
+        generation = self.get_generation()
+        pipe = self.conn.pipeline(transaction=False)
+        for id_ in ids:
+            self._queue_delete(pipe, id_, generation)
         pipe.execute()
+        self.invalidate(ids)
+
+    def _build(  # noqa: PLR0913
+        self,
+        data: Iterable[dict],
+        batch_size: int = 1000,
+        ops_per_second: int | None = None,
+        progress: BuildProgress | None = None,
+        *,
+        checkpoint: bool = True,
+    ) -> int:
+        """Set all data to the cache in batches,
+        each batch is written with the id of its last row as the checkpoint,
+        writes are throttled to ops_per_second if it is set
+        """
+        data = iter(data)
+        started_at = time.monotonic()
+        built = 0
+        while batch := list(itertools.islice(data, batch_size)):
+            generation = self.get_generation()
+            pipe = self.conn.pipeline()
+            for row in batch:
+                key = self.get_key(row, generation=generation)
+                value = self.get_value(row)
+                pipe.hset(key, mapping=value)
+                if self.ttl:
+                    pipe.expire(key, self.ttl)
+            last_id = batch[-1]["id"]
+            if checkpoint:
+                pipe.set(self.build_checkpoint_key, last_id)
+            pipe.execute()
+            built += len(batch)
+            if progress is not None:
+                progress(built, last_id)
+            if ops_per_second:
+                time.sleep(
+                    max(started_at + built / ops_per_second - time.monotonic(), 0),
+                )
+        return built
 
-    def build(self):
-        """It will build cache from related database tables"""
-        data = self._get_data()
-        return self._build(data)
+    def get_build_checkpoint(self) -> int | None:
+        """Id of the last row written by an unfinished build"""
+        last_id = self.conn.get(self.build_checkpoint_key)
+        return int(last_id) if last_id is not None else None
 
-    def list(self, ids: list[int]) -> list[dict]:
-        """It will return a list of data related to a list of ids"""
-        pipe = self.conn.pipeline()
+    def build(
+        self,
+        batch_size: int = 1000,
+        ops_per_second: int | None = None,
+        progress: BuildProgress | None = None,
+        *,
+        resume: bool = False,
+    ) -> int:
+        """It will build cache from related database tables,
+        rows are streamed with a server side cursor ordered by id,
+        so a crashed build can be resumed from its checkpoint.
+        It returns the number of built rows
+        """
+        started_at = timezone.now()
+        self.start_generation(resume=resume)
+        data = self._get_data().order_by("id")
+        if resume and (last_id := self.get_build_checkpoint()) is not None:
+            data = data.filter(id__gt=last_id)
+        built = self._build(
+            data.iterator(chunk_size=batch_size),
+            batch_size=batch_size,
+            ops_per_second=ops_per_second,
+            progress=progress,
+        )
+        self.publish_generation(since=started_at, batch_size=batch_size)
+        self.conn.delete(self.build_checkpoint_key)
+        # rows built before a crash may have changed since the first run started
+        if not resume:
+            self.set_watermark(started_at)
+        self.invalidate()
+        return built
+
+    def _get_generation_key(self, name: str) -> str:
+        return f"{self.generation_key}:{name}"
+
+    def get_generation(self) -> int:
+        """Generation which keys are named in, 0 is the unversioned namespace"""
+        if self.generation is not None:
+            return self.generation
+        if self.generation_key is None:
+            return 0
+        return get_generation_pointer(self.generation_key).get(
+            self.conn,
+            self.generation_ttl,
+        )
+
+    def refresh_generation(self) -> int:
+        """Read the current generation again, writes must not go to one
+        which readers were switched from
+        """
+        if self.generation_key is None:
+            return 0
+        return get_generation_pointer(self.generation_key).refresh(
+            self.conn,
+            self.generation_ttl,
+        )
+
+    def start_generation(self, *, resume: bool = False) -> int | None:
+        """Write the following rows to a new generation, or to the generation
+        of the crashed build if it is resumed, the checkpoint of a build
+        belongs to its generation. Retired generations are reclaimed first,
+        the generation of a crashed build which is not resumed is retired
+        """
+        if self.generation_key is None:
+            return None
+        self.reclaim()
+        building_key = self._get_generation_key("building")
+        building = self.conn.get(building_key) if resume else None
+        if building is None:
+            building = self._start_generation_script(
+                keys=[
+                    building_key,
+                    self._get_generation_key("next"),
+                    self._get_generation_key("retired"),
+                ],
+            )
+            self.conn.delete(self.build_checkpoint_key)
+        self.generation = int(building)
+        return self.generation
+
+    def publish_generation(
+        self,
+        since: datetime | None = None,
+        batch_size: int = 1000,
+    ):
+        """Validate the built generation and switch readers to it.
+        Writes made during the build went to the former generation,
+        so rows changed since the build started are written again
+        """
+        generation = self.generation
+        if generation is None:
+            return
+        try:
+            self.validate_generation(since=since)
+        except CacheBuildError:
+            self.conn.sadd(self._get_generation_key("retired"), generation)
+            self.conn.delete(
+                self._get_generation_key("building"),
+                self.build_checkpoint_key,
+            )
+            raise
+        finally:
+            self.generation = None
+        self._cut_over_script(
+            keys=[
+                self.generation_key,
+                self._get_generation_key("previous"),
+                self._get_generation_key("building"),
+                self._get_generation_key("retired"),
+            ],
+            args=[generation],
+        )
+        self.refresh_generation()
+        if since is not None:
+            changed = self._get_changed_data(since=since).order_by("id")
+            self.set_many(changed.iterator(chunk_size=batch_size), batch_size)
+
+    def validate_generation(
+        self,
+        since: datetime | None = None,
+        sample_size: int = 100,
+    ):
+        """Rows of a random sample of ids must be in the built generation,
+        so an empty or truncated generation is never switched to.
+        Rows changed since the build started are skipped, they may have been
+        created after the build passed them and are written after the switch
+        """
+        bounds = self.get_id_bounds()
+        if bounds is None:
+            return
+        first_id, last_id = bounds
+        ids = {first_id, last_id}
+        if last_id - first_id > 1:
+            ids.update(
+                random.sample(
+                    range(first_id + 1, last_id),
+                    k=min(sample_size, last_id - first_id - 1),
+                ),
+            )
+        if since is not None:
+            ids -= set(
+                self._get_changed_data(since=since)
+                .filter(id__in=ids)
+                .values_list("id", flat=True),
+            )
+        if not (loaded := list(self._load(list(ids)))):
+            return
+        cached, _ = self._fetch(loaded, pipe=self.conn.pipeline(transaction=False))
+        if missing := [
+            id_ for id_, value in zip(loaded, cached, strict=True) if not value
+        ]:
+            msg = (
+                f"{len(missing)} of {len(loaded)} sampled rows are missing "
+                f"in generation {self.generation}, e.g. {sorted(missing)[:10]}"
+            )
+            raise CacheBuildError(msg)
+
+    def rollback(self) -> int:
+        """Switch readers back to the previous generation as it was left,
+        rows changed since then are stale until the next build
+        """
+        if self.generation_key is None:
+            msg = "cache keys are not versioned"
+            raise CacheBuildError(msg)
+        previous = self._rollback_script(
+            keys=[self.generation_key, self._get_generation_key("previous")],
+        )
+        if previous is None:
+            msg = "there is no previous generation"
+            raise CacheBuildError(msg)
+        self.refresh_generation()
+        self.invalidate()
+        return int(previous)
+
+    def _get_generation_patterns(self, generation: int) -> list[str]:
+        """Patterns which match the keys of generation and no other key"""
+        raise NotImplementedError
+
+    def reclaim(self, batch_size: int = 1000) -> int:
+        """Unlink keys of retired generations, the current and the previous
+        generations are kept so a build can be rolled back.
+        It returns the number of unlinked keys
+        """
+        if self.generation_key is None:
+            return 0
+        retired_key = self._get_generation_key("retired")
+        kept = {
+            int(generation or 0)
+            for generation in self.conn.mget(
+                self.generation_key,
+                self._get_generation_key("previous"),
+            )
+        }
+        unlinked = 0
+        for generation in map(int, self.conn.smembers(retired_key)):
+            if generation in kept:
+                continue
+            for pattern in self._get_generation_patterns(generation):
+                pipe = self.conn.pipeline(transaction=False)
+                for key in self.conn.scan_iter(match=pattern, count=batch_size):
+                    pipe.unlink(key)
+                    if len(pipe) == batch_size:
+                        unlinked += sum(pipe.execute())
+                unlinked += sum(pipe.execute())
+            self.conn.srem(retired_key, generation)
+        return unlinked
+
+    def get_id_bounds(self) -> tuple[int, int] | None:
+        """Smallest and largest id of the database related data"""
+        data = self._get_data().values_list("id", flat=True).order_by("id")
+        first_id = data.first()
+        if first_id is None:
+            return None
+        return first_id, data.last()
+
+    def build_range(self, start_id: int, end_id: int, batch_size: int = 1000) -> int:
+        """Build rows with start_id <= id < end_id,
+        it writes no checkpoint so disjoint ranges can be built in parallel
+        """
+        data = self._get_data().filter(id__gte=start_id, id__lt=end_id).order_by("id")
+        return self.set_many(data.iterator(chunk_size=batch_size), batch_size)
+
+    def _get_changed_data(self, since: datetime):
+        """It will return the database related data changed after since"""
+        raise NotImplementedError
+
+    def get_watermark(self) -> datetime | None:
+        """Start time of the last finished build"""
+        watermark = self.conn.get(self.watermark_key)
+        return datetime.fromisoformat(watermark) if watermark else None
+
+    def set_watermark(self, watermark: datetime):
+        self.conn.set(self.watermark_key, watermark.isoformat())
+
+    def build_incremental(
+        self,
+        overlap: timedelta = timedelta(minutes=1),
+        batch_size: int = 1000,
+        progress: BuildProgress | None = None,
+    ) -> int:
+        """Rebuild only the rows changed since the watermark,
+        overlap covers transactions committed after the last build had started
+        but stamped before it, rebuilding a row twice is harmless.
+        A full build is done if there is no watermark yet
+        """
+        watermark = self.get_watermark()
+        if watermark is None:
+            return self.build(batch_size=batch_size, progress=progress)
+        started_at = timezone.now()
+        data = self._get_changed_data(since=watermark - overlap).order_by("id")
+        built = self._build(
+            data.iterator(chunk_size=batch_size),
+            batch_size=batch_size,
+            progress=progress,
+        )
+        self.conn.delete(self.build_checkpoint_key)
+        self.set_watermark(started_at)
+        if built:
+            self.invalidate()
+        return built
+
+    def get_fill_lock_key(self, id_: int) -> str:
+        return f"{self.fill_lock_prefix}:{id_}"
+
+    def _load(self, ids: list[int]) -> dict[int, dict]:
+        """Rows of ids from database as values read from the cache"""
+        return {
+            row["id"]: {name: str(value) for name, value in row.items()}
+            for row in self._get_data().filter(id__in=ids)
+        }
+
+    def _lock(self, ids: list[int], token: str) -> list[int]:
+        """Ids which their fill lock is taken by token"""
+        pipe = self.conn.pipeline(transaction=False)
         for id_ in ids:
-            key = self.get_key(id_=id_)
-            pipe.hgetall(key)
-        data = pipe.execute()
+            pipe.set(
+                self.get_fill_lock_key(id_),
+                token,
+                nx=True,
+                px=int(self.fill_timeout * 1000),
+            )
+        return [id_ for id_, locked in zip(ids, pipe.execute(), strict=True) if locked]
+
+    def _unlock(self, ids: list[int], token: str):
+        load_scripts(self.conn, self._unlock_script)
+        pipe = self.conn.pipeline(transaction=False)
+        for id_ in ids:
+            queue_script(
+                pipe,
+                self._unlock_script,
+                keys=[self.get_fill_lock_key(id_)],
+                args=[token],
+            )
+        pipe.execute()
+
+    def _fetch_from_primary(self, ids: list[int]) -> tuple[dict[int, dict], list]:
+        """Cached values of ids and whether their fill locks exist,
+        locks are checked first, so a value written before its lock was
+        released is seen
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        for id_ in ids:
+            pipe.exists(self.get_fill_lock_key(id_))
+        data, lock_exists = self._fetch(ids, pipe)
+        return dict(zip(ids, data, strict=True)), lock_exists
+
+    def fill(self, ids: list[int]) -> dict[int, dict]:
+        """Load missed ids from database with one query and write them back.
+        Only one request fills an id at a time: the others wait for its value
+        until the lock is released or fill_timeout is passed, then the ids
+        which are still missing are read from database without being written
+        """
+        token = uuid.uuid4().hex
+        locked = self._lock(ids, token)
+        filled = {}
+        if locked:
+            try:
+                # another request may have filled them before the locks were taken
+                cached, _ = self._fetch_from_primary(locked)
+                filled = {id_: value for id_, value in cached.items() if value}
+                missed = [id_ for id_ in locked if id_ not in filled]
+                if loaded := self._load(missed):
+                    self.set_many(loaded.values())
+                    filled |= loaded
+                if missing := [id_ for id_ in missed if id_ not in loaded]:
+                    self._set_missing(missing)
+            finally:
+                self._unlock(locked, token)
+        locked_ids = set(locked)
+        waiting = [id_ for id_ in ids if id_ not in locked_ids]
+        deadline = time.monotonic() + self.fill_timeout
+        while waiting and time.monotonic() < deadline:
+            time.sleep(0.01)
+            cached, lock_exists = self._fetch_from_primary(waiting)
+            filled |= {id_: value for id_, value in cached.items() if value}
+            waiting = [
+                id_
+                for id_, exists in zip(waiting, lock_exists, strict=True)
+                if exists and id_ not in filled
+            ]
+        # lock timed out or released without a value, e.g. the filler failed
+        if unfilled := [
+            id_ for id_ in ids if id_ not in filled and id_ not in locked_ids
+        ]:
+            filled |= self._load(unfilled)
+        return filled
+
+    def _set_missing(self, ids: list[int]):
+        """Ids which a fill found in neither the cache nor the database"""
+
+    def invalidate(self, ids: list[int] | None = None):
+        """Drop ids from every local cache, all ids are dropped by default"""
+        if self.invalidation_channel is None:
+            return
+        # one message of space separated ids, cluster pipelines can not publish
+        self.conn.publish(
+            self.invalidation_channel,
+            " ".join(str(id_) for id_ in ids or [INVALIDATE_ALL]),
+        )
+
+    def _fetch(
+        self,
+        ids: list[int],
+        pipe: Pipeline | None = None,
+    ) -> tuple[list[dict], list]:
+        """Get cached values of ids in one round trip,
+        results of the commands already queued in pipe are returned separately.
+        Reads need no MULTI/EXEC, and an encoded reply could not be kept
+        binary inside the reply of EXEC.
+        In a cluster the multi get is sent once per slot, the cluster pipeline
+        writes the commands of all nodes before reading any reply, so nodes
+        serve their part of the page in parallel
+        """
+        if pipe is None:
+            pipe = self.read_conn.pipeline(transaction=False)
+        queued = len(pipe)
+        # keys of a page are named in one generation, read once
+        generation = self.get_generation() if ids else 0
+        groups = []
+        if self.codec is not None:
+            groups = [
+                [ids[i] for i in group]
+                for group in group_by_slot(
+                    self.read_conn,
+                    (self.get_key(id_=id_, generation=generation) for id_ in ids),
+                )
+            ]
+            for group in groups:
+                self._queue_multi_get(pipe, group, generation)
+        else:
+            for id_ in ids:
+                self._queue_read(pipe, id_, generation)
+        result = pipe.execute() if len(pipe) else []
+        replies = result[queued:]
+        if groups:
+            # merge replies of the groups back in order of ids
+            replies_by_id = {}
+            for group, reply in zip(groups, replies, strict=True):
+                replies_by_id.update(
+                    zip(group, self._split_multi_get(group, reply), strict=True),
+                )
+            replies = [replies_by_id[id_] for id_ in ids]
+        data = [
+            self._parse_read(id_, reply)
+            for id_, reply in zip(ids, replies, strict=True)
+        ]
+        return data, result[:queued]
+
+    def _fetch_through_local_cache(
+        self,
+        ids: list[int],
+        pipe: Pipeline | None = None,
+    ) -> tuple[list[dict], list]:
+        """Only ids missed in the local cache are fetched from redis"""
+        self.local_cache.subscribe(self.read_conn, self.invalidation_channel)
+        generation = self.local_cache.generation
+        keys = [str(id_) for id_ in ids]
+        data = [self.local_cache.get(key) for key in keys]
+        missed = [
+            (id_, key)
+            for id_, key, value in zip(ids, keys, data, strict=True)
+            if not value
+        ]
+        fetched, queued = self._fetch([id_ for id_, _ in missed], pipe)
+        fetched = {key: value for (_, key), value in zip(missed, fetched, strict=True)}
+        self.local_cache.set_many(
+            {key: value for key, value in fetched.items() if value},
+            generation=generation,
+        )
+        data = [value or fetched[key] for key, value in zip(keys, data, strict=True)]
+        return data, queued
+
+    def _list(
+        self,
+        ids: Iterable[int],
+        pipe: Pipeline | None = None,
+    ) -> tuple[list[dict], list]:
+        """Get data of ids and results of the commands queued in pipe"""
+        ids = list(ids)
+        if self.local_cache is None:
+            data, queued = self._fetch(ids, pipe)
+        else:
+            data, queued = self._fetch_through_local_cache(ids, pipe)
+        if self.read_through and (
+            missed := [id_ for id_, item in zip(ids, data, strict=True) if not item]
+        ):
+            filled = self.fill(missed)
+            data = [
+                item or filled.get(id_, {}) for id_, item in zip(ids, data, strict=True)
+            ]
         # filter empty values
-        return list(filter(lambda item: item, data))
+        return [self.get_representation(item) for item in data if item], queued
+
+    def list(self, ids: Iterable[int]) -> list[dict]:
+        """It will return a list of data related to a list of ids"""
+        data, _ = self._list(ids)
+        return data
 
 
 class ContentCache(BaseCache):
     """This Cache will store content and content's like data"""
 
-    def __init__(self, conn: Redis):
-        super().__init__(conn)
+    invalidation_channel = "content:invalidate"
+    build_checkpoint_key = "content:build:last_id"
+    watermark_key = "content:build:watermark"
+    fill_lock_prefix = "content:fill"
+    generation_key = "content:{generation}"
 
-    def get_key(self, content: dict | None = None, id_: int | None = None) -> str:
+    def __init__(
+        self,
+        conn: Redis | RedisCluster,
+        local_cache: LocalCache | None = None,
+        **kwargs,
+    ):
+        super().__init__(conn, local_cache, **kwargs)
+        self.hash_tag_size = settings.CONTENT_CACHE_HASH_TAG_SIZE
+        self.user_like_cache = UserLikeCache(conn)
+        self.live_ids = LiveContentIds(conn)
+        self._content_liked_script = conn.register_script(CONTENT_LIKED_SCRIPT)
+        self._like_value_updated_script = conn.register_script(
+            LIKE_VALUE_UPDATED_SCRIPT,
+        )
+        self._migrate_likes_avg_script = conn.register_script(
+            MIGRATE_LIKES_AVG_SCRIPT,
+        )
+        self._like_received_script = conn.register_script(LIKE_RECEIVED_SCRIPT)
+        self._advance_max_id_script = conn.register_script(ADVANCE_MAX_ID_SCRIPT)
+        self._refresh_field_script = conn.register_script(REFRESH_FIELD_SCRIPT)
+
+    def get_key(
+        self,
+        content: dict | None = None,
+        id_: int | None = None,
+        generation: int | None = None,
+    ) -> str:
         if content and content.get("id"):
             id_ = content["id"]
-        return f"content:{id_}"
+        namespace = self._get_namespace(generation)
+        return f"content:{namespace}{self._get_hash_tag(id_)}{id_}"
+
+    def _get_namespace(self, generation: int | None = None) -> str:
+        """Keys of generation 0 keep the names they had before versioning"""
+        if generation is None:
+            generation = self.get_generation()
+        return f"g{generation}:" if generation else ""
+
+    def _get_generation_patterns(self, generation: int) -> list[str]:
+        if generation:
+            return [f"content:g{generation}:*"]
+        return ["content:[0-9]*", "content:{[0-9]*", "content:b:*"]
+
+    def _get_hash_tag(self, id_: int) -> str:
+        """Keys of hash_tag_size consecutive ids share a hash tag,
+        so a page of contents is in one or two cluster slots
+        and it is read by one multi get per slot, no tag is used if it is 0
+        """
+        if not self.hash_tag_size:
+            return ""
+        return f"{{{int(id_) // self.hash_tag_size}}}:"
+
+    def _set_missing(self, ids: list[int]):
+        """Deleted contents are dropped from the live ids on their first miss"""
+        self.live_ids.remove(ids)
+
+    def get_field(self, id_: int, name: str) -> str:
+        """Name of a content field in the hash which stores the content,
+        an empty name means the field is not stored
+        """
+        return name
 
     def get_value(self, content: dict) -> dict:
-        return content
+        return {
+            self.get_field(content["id"], name): value
+            for name, value in content.items()
+            if self.get_field(content["id"], name)
+        }
+
+    def get_representation(self, value: dict) -> dict:
+        """Average is computed on read, so the cache only keeps integers"""
+        value = dict(value)
+        if "likes_sum" in value:
+            likes_count = int(value.get("likes_count") or 0)
+            likes_sum = int(value.pop("likes_sum"))
+            likes_avg = likes_sum / likes_count if likes_count else 0.0
+            value["likes_avg"] = str(likes_avg)
+        return value
 
     def _get_data(self):
-        """Get content data from database"""
-        likes = Like.objects.filter(
-            content_id=OuterRef("id"),
-            state=Like.StateChoice.OK,
-        ).values("content_id")
-        likes_count = likes.annotate(count=Count("user_id", distinct=True)).values(
-            "count",
-        )
-        likes_avg = likes.annotate(avg=Avg("value")).values("avg")
+        """Get content data from database,
+        likes are counted and summed from like_content_active_idx alone
+        """
+        likes = (
+            _get_active_likes().filter(content_id=OuterRef("id")).values("content_id")
+        )
+        likes_count = likes.annotate(count=Count("value")).values("count")
+        likes_sum = likes.annotate(sum=Sum("value")).values("sum")
         return Content.objects.annotate(
             likes_count=Coalesce(likes_count, 0),
-            likes_avg=Coalesce(likes_avg, 0.0),
-        ).values("id", "title", "likes_count", "likes_avg")
+            likes_sum=Coalesce(likes_sum, 0),
+        ).values("id", "title", "likes_count", "likes_sum")
+
+    def _get_changed_data(self, since: datetime):
+        """Get data of contents which they or their likes are changed,
+        ids of both are found by their updated_at indexes, as an OR of them
+        would scan all contents
+        """
+        changed_ids = (
+            Content.objects.filter(updated_at__gt=since)
+            .values("id")
+            .union(Like.objects.filter(updated_at__gt=since).values("content_id"))
+        )
+        return self._get_data().filter(id__in=changed_ids)
+
+    def build(  # noqa: PLR0913
+        self,
+        batch_size: int = 1000,
+        ops_per_second: int | None = None,
+        progress: BuildProgress | None = None,
+        *,
+        resume: bool = False,
+        user_likes: bool = True,
+    ) -> int:
+        """Build contents, their live ids and then the like index of users"""
+        built = super().build(
+            batch_size=batch_size,
+            ops_per_second=ops_per_second,
+            progress=progress,
+            resume=resume,
+        )
+        self.live_ids.build(batch_size=batch_size)
+        if user_likes:
+            self.user_like_cache.build(
+                batch_size=batch_size,
+                ops_per_second=ops_per_second,
+                resume=resume,
+            )
+        return built
+
+    def build_incremental(
+        self,
+        overlap: timedelta = timedelta(minutes=1),
+        batch_size: int = 1000,
+        progress: BuildProgress | None = None,
+        *,
+        user_likes: bool = True,
+    ) -> int:
+        """Rebuild changed contents and then changed likes of users,
+        created contents are changed ones, so they are added to the live ids
+        """
+        watermark = self.get_watermark()
+        built = super().build_incremental(
+            overlap=overlap,
+            batch_size=batch_size,
+            progress=progress,
+        )
+        # the live ids are rebuilt by the full build without a watermark
+        if watermark is not None:
+            self.live_ids.add(
+                Content.objects.filter(updated_at__gt=watermark - overlap)
+                .values_list("id", flat=True)
+                .iterator(chunk_size=batch_size),
+            )
+        if user_likes:
+            self.user_like_cache.build_incremental(
+                overlap=overlap,
+                batch_size=batch_size,
+            )
+        return built
+
+    def list(
+        self,
+        ids: Iterable[int],
+        user_id: int | None = None,
+    ) -> list[dict]:
+        """If user_id is given, like value of the user is added to each content,
+        it is fetched in the same round trip as the contents
+        """
+        if user_id is None:
+            return super().list(ids)
+        ids = list(ids)
+        if not ids:
+            return []
+        pipe = self.read_conn.pipeline(transaction=False)
+        pipe.hmget(self.user_like_cache.get_key(user_id=user_id), ids)
+        data, (values,) = self._list(ids, pipe)
+        likes = dict(zip(ids, values, strict=True))
+        for content in data:
+            value = likes.get(int(content["id"]))
+            content["your_like_value"] = int(value) if value is not None else None
+        return data
+
+    def _run_like_script(
+        self,
+        script: Script,
+        like: Like,
+        args: list,
+        extra_keys: list[str] | None = None,
+    ):
+        """The like index of the user is updated by the same script,
+        which checks that the content key is in the current generation,
+        it is named again and retried if readers were switched meanwhile.
+        In a cluster the content, user and pointer keys are in different slots,
+        so the generation is read first and the index is written
+        by a separate command after the script, extra keys are not given then
+        """
+        user_key = self.user_like_cache.get_key(user_id=like.user_id)
+        if is_cluster(self.conn):
+            generation = self.refresh_generation()
+            result = script(
+                keys=[self.get_key(id_=like.content_id, generation=generation)],
+                args=[*args, generation],
+            )
+            self.conn.hset(user_key, like.content_id, like.value)
+            return result
+        generation = self.get_generation()
+        while True:
+            result = script(
+                keys=[
+                    self.get_key(id_=like.content_id, generation=generation),
+                    user_key,
+                    self.generation_key,
+                    *(extra_keys or []),
+                ],
+                args=[*args, generation],
+            )
+            if result != STALE_GENERATION:
+                return result
+            generation = self.refresh_generation()
 
     def content_liked(self, like: Like):
         """Update content like related data
         increase like count by one
-        update like avg with new like value
+        increase like sum by the new like value
+        add the like to the like index of the user
+        all in one atomic round trip
         """
-        past_count = int(
-            self.conn.hget(self.get_key(id_=like.content_id), "likes_count") or 0,
+        self._run_like_script(
+            self._content_liked_script,
+            like,
+            args=self._get_content_liked_args(like),
         )
-        past_avg = float(
-            self.conn.hget(self.get_key(id_=like.content_id), "likes_avg") or 0,
+
+    def _get_content_liked_args(self, like: Like) -> list:
+        return [
+            like.content_id,
+            like.content.title,
+            like.value,
+            self.invalidation_channel,
+            *(
+                self.get_field(like.content_id, name)
+                for name in ("id", "title", "likes_count", "likes_sum")
+            ),
+            int(self.read_through),
+        ]
+
+    def like_value_updated(self, like: Like, past_value: int | None = None):
+        """Update content like related data
+        replace the past like value by the new one in the like sum,
+        nothing is changed if the content has no cached like.
+        The past value is the initial one of like by default
+        """
+        self._run_like_script(
+            self._like_value_updated_script,
+            like,
+            args=self._get_like_value_updated_args(like, past_value),
         )
-        new_avg = (past_avg * past_count + like.value) / (past_count + 1)
 
-        self.conn.hincrby(self.get_key(id_=like.content_id), "likes_count")
-        self.conn.hset(
-            self.get_key(id_=like.content_id),
-            mapping={
-                "id": like.content_id,
-                "title": like.content.title,
-                "likes_avg": new_avg,
-            },
+    def _get_like_value_updated_args(
+        self,
+        like: Like,
+        past_value: int | None = None,
+    ) -> list:
+        return [
+            like.initial_value("value") if past_value is None else past_value,
+            like.value,
+            self.invalidation_channel,
+            like.content_id,
+            self.get_field(like.content_id, "likes_count"),
+            self.get_field(like.content_id, "likes_sum"),
+        ]
+
+    def likes_saved(
+        self,
+        created: list[Like],
+        updated: list[Like],
+        past_values: dict[int, int] | None = None,
+    ):
+        """content_liked of created likes and like_value_updated of updated likes
+        in one pipelined round trip, each script is still atomic.
+        Past values of updated likes are by like id, their initial values
+        by default.
+        Likes of which readers were switched to another generation meanwhile
+        are updated again one by one.
+        In a cluster the like indexes of the user are written by commands
+        queued after the scripts, as in _run_like_script
+        """
+        calls = [
+            (self._content_liked_script, like, self._get_content_liked_args(like))
+            for like in created
+        ] + [
+            (
+                self._like_value_updated_script,
+                like,
+                self._get_like_value_updated_args(
+                    like,
+                    (past_values or {}).get(like.pk),
+                ),
+            )
+            for like in updated
+        ]
+        if not calls:
+            return
+        cluster = is_cluster(self.conn)
+        generation = self.refresh_generation() if cluster else self.get_generation()
+        load_scripts(
+            self.conn,
+            self._content_liked_script,
+            self._like_value_updated_script,
         )
+        pipe = self.conn.pipeline(transaction=False)
+        for script, like, args in calls:
+            user_key = self.user_like_cache.get_key(user_id=like.user_id)
+            keys = [self.get_key(id_=like.content_id, generation=generation)]
+            if not cluster:
+                keys += [user_key, self.generation_key]
+            queue_script(pipe, script, keys=keys, args=[*args, generation])
+        if cluster:
+            for _, like, _ in calls:
+                pipe.hset(
+                    self.user_like_cache.get_key(user_id=like.user_id),
+                    like.content_id,
+                    like.value,
+                )
+        results = pipe.execute()
+        for (script, like, args), result in zip(calls, results, strict=False):
+            if result == STALE_GENERATION:
+                self._run_like_script(script, like, args)
 
-    def like_value_updated(self, like: Like):
-        """Update content like related data
-        increase like count by one
-        update like avg with new like value
+    def like_received(
+        self,
+        like: Like,
+        stream_key: str,
+        past_value: int | None = None,
+    ) -> bool:
+        """Count a like before it is written to database and append it
+        to the stream which the database is written from, in one atomic
+        round trip. The like index of the user tells if it is a new like.
+        In a cluster the stream is in another slot, so the like is appended
+        after the script and past_value, read before, tells if it is new.
+        Returns True if it is a new like
         """
-        past_value = like.initial_value("value")
-        new_value = like.value
-        count = int(
-            self.conn.hget(self.get_key(id_=like.content_id), "likes_count") or 0,
+        created = self._run_like_script(
+            self._like_received_script,
+            like,
+            args=self._get_like_received_args(like, past_value),
+            extra_keys=[stream_key],
         )
-        past_avg = float(
-            self.conn.hget(self.get_key(id_=like.content_id), "likes_avg") or 0,
+        if is_cluster(self.conn):
+            self.conn.xadd(stream_key, get_stream_fields(like))
+        return bool(created)
+
+    def _get_like_received_args(self, like: Like, past_value: int | None) -> list:
+        return [
+            like.content_id,
+            like.user_id,
+            like.value,
+            self.invalidation_channel,
+            *(
+                self.get_field(like.content_id, name)
+                for name in ("title", "likes_count", "likes_sum")
+            ),
+            "" if past_value is None else past_value,
+            int(like.state),
+        ]
+
+    def likes_received(
+        self,
+        likes: list[Like],
+        stream_key: str,
+        past_values: list[int | None],
+    ) -> list[bool]:
+        """like_received of many likes in one pipelined round trip, rate limited
+        likes are not counted, they are only appended to the stream in order
+        with the others. A rate limited like is always a new one.
+        Likes of which readers were switched to another generation meanwhile
+        are received again one by one
+        """
+        if not likes:
+            return []
+        # arguments of the script of each like, None for a rate limited one
+        calls = [
+            (
+                like,
+                None
+                if like.state == Like.StateChoice.RATE_LIMITED
+                else self._get_like_received_args(like, past_value),
+            )
+            for like, past_value in zip(likes, past_values, strict=True)
+        ]
+        results = self._execute_likes_received(calls, stream_key)
+        created = []
+        for (like, args), result in zip(calls, results, strict=True):
+            if args is None:
+                created.append(True)
+            elif result == STALE_GENERATION:
+                created.append(
+                    bool(
+                        self._run_like_script(
+                            self._like_received_script,
+                            like,
+                            args,
+                            extra_keys=[stream_key],
+                        ),
+                    ),
+                )
+            else:
+                created.append(bool(result))
+        return created
+
+    def _execute_likes_received(
+        self,
+        calls: list[tuple[Like, list | None]],
+        stream_key: str,
+    ) -> list:
+        """Results of the like received scripts of calls, None for rate limited
+        likes, all of them are sent in one round trip.
+        In a cluster the like indexes of the user and the stream are written
+        by commands queued after the scripts, as in like_received
+        """
+        cluster = is_cluster(self.conn)
+        generation = self.refresh_generation() if cluster else self.get_generation()
+        load_scripts(self.conn, self._like_received_script)
+        pipe = self.conn.pipeline(transaction=False)
+        for like, args in calls:
+            if args is None:
+                if not cluster:
+                    pipe.xadd(stream_key, get_stream_fields(like))
+                continue
+            keys = [self.get_key(id_=like.content_id, generation=generation)]
+            if not cluster:
+                keys += [
+                    self.user_like_cache.get_key(user_id=like.user_id),
+                    self.generation_key,
+                    stream_key,
+                ]
+            queue_script(
+                pipe,
+                self._like_received_script,
+                keys=keys,
+                args=[*args, generation],
+            )
+        if cluster:
+            for like, args in calls:
+                if args is not None:
+                    pipe.hset(
+                        self.user_like_cache.get_key(user_id=like.user_id),
+                        like.content_id,
+                        like.value,
+                    )
+            for like, _ in calls:
+                pipe.xadd(stream_key, get_stream_fields(like))
+        # replies of the commands queued for each like, in order of calls
+        results = iter(pipe.execute())
+        return [
+            next(results) if args is not None or not cluster else None
+            for _, args in calls
+        ]
+
+    def content_created(self, content: Content):
+        """Write the entry of a new content, mark it live and advance the max id
+        of contents in one pipelined round trip.
+        Likes counted before, e.g. in the same transaction, are kept
+        """
+        load_scripts(self.conn, self._advance_max_id_script)
+        pipe = self.conn.pipeline(transaction=False)
+        key = self.get_key(id_=content.id)
+        pipe.hset(
+            key,
+            mapping=self.get_value({"id": content.id, "title": content.title}),
         )
-        new_avg = ((past_avg * count) - past_value + new_value) / count
-        self.conn.hset(self.get_key(id_=like.content_id), "likes_avg", new_avg)
+        for name in ("likes_count", "likes_sum"):
+            pipe.hsetnx(key, self.get_field(content.id, name), 0)
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        self.live_ids.queue_add(pipe, [content.id])
+        queue_script(
+            pipe,
+            self._advance_max_id_script,
+            keys=[Content.redis_max_id_key],
+            args=[content.id],
+        )
+        pipe.execute()
+
+    def content_updated(self, content: Content):
+        """Refresh the title of a cached content and drop it from local caches"""
+        self._refresh_field_script(
+            keys=[self.get_key(id_=content.id)],
+            args=[
+                self.get_field(content.id, "title"),
+                content.title,
+                self.invalidation_channel,
+                content.id,
+            ],
+        )
+
+    def contents_deleted(self, ids: list[int]):
+        """Remove entries of deleted contents and mark them missing
+        in one pipelined round trip
+        """
+        if not ids:
+            return
+        generation = self.get_generation()
+        pipe = self.conn.pipeline(transaction=False)
+        for id_ in ids:
+            self._queue_delete(pipe, id_, generation)
+        self.live_ids.queue_remove(pipe, ids)
+        pipe.execute()
+        self.invalidate(ids)
+
+    def migrate_likes_avg(self, batch_size: int = 1000) -> int:
+        """Convert cached likes_avg values to likes_sum in place,
+        returns the number of converted contents
+        """
+        migrated = 0
+        load_scripts(self.conn, self._migrate_likes_avg_script)
+        pipe = self.conn.pipeline(transaction=False)
+        for i, key in enumerate(
+            # hashes of other layouts are matched too, they have no likes_avg
+            self.conn.scan_iter(match="content:*", count=batch_size),
+            start=1,
+        ):
+            queue_script(pipe, self._migrate_likes_avg_script, keys=[key], args=[])
+            if i % batch_size == 0:
+                migrated += sum(pipe.execute())
+        migrated += sum(pipe.execute())
+        return migrated
+
+
+class BucketedContentCache(ContentCache):
+    """Contents are grouped in buckets of bucket_size ids,
+    each bucket is one hash with short field names like `7t` for the title of
+    the 7th content of the bucket. It saves the per key overhead of redis and
+    small buckets keep the compact listpack (ziplist before redis 7) encoding, so
+    bucket_size * 3 must not exceed hash-max-listpack-entries (128 by default)
+    and titles must not exceed hash-max-listpack-value (64 bytes by default)
+    """
+
+    bucket_size: int
+    field_codes = {"id": "", "title": "t", "likes_count": "c", "likes_sum": "s"}
+
+    def __init__(
+        self,
+        conn: Redis | RedisCluster,
+        local_cache: LocalCache | None = None,
+        bucket_size: int | None = None,
+        **kwargs,
+    ):
+        super().__init__(conn, local_cache, **kwargs)
+        self.bucket_size = bucket_size or settings.CONTENT_CACHE_BUCKET_SIZE
+
+    def get_key(
+        self,
+        content: dict | None = None,
+        id_: int | None = None,
+        generation: int | None = None,
+    ) -> str:
+        if content and content.get("id"):
+            id_ = content["id"]
+        bucket = int(id_) // self.bucket_size
+        # ids of a bucket must get the same tag
+        tag = self._get_hash_tag(bucket * self.bucket_size)
+        return f"content:{self._get_namespace(generation)}b:{tag}{bucket}"
+
+    def get_field(self, id_: int, name: str) -> str:
+        code = self.field_codes[name]
+        return f"{int(id_) % self.bucket_size}{code}" if code else ""
+
+    def _get_read_fields(self, id_: int) -> list[str]:
+        return [
+            self.get_field(id_, name) for name in ("title", "likes_count", "likes_sum")
+        ]
+
+    def _queue_read(self, pipe: Pipeline, id_: int, generation: int | None = None):
+        pipe.hmget(
+            self.get_key(id_=id_, generation=generation),
+            self._get_read_fields(id_),
+        )
+
+    def _parse_read(self, id_: int, reply) -> dict:
+        title, likes_count, likes_sum = reply
+        if title is None:
+            return {}
+        value = {"id": str(id_), "title": title}
+        if likes_count is not None:
+            value["likes_count"] = likes_count
+        if likes_sum is not None:
+            value["likes_sum"] = likes_sum
+        return value
+
+    def _queue_delete(self, pipe: Pipeline, id_: int, generation: int | None = None):
+        pipe.hdel(
+            self.get_key(id_=id_, generation=generation),
+            *self._get_read_fields(id_),
+        )
+
+    def migrate_likes_avg(self, batch_size: int = 1000) -> int:
+        """Buckets never had likes_avg values"""
+        return 0
+
+
+CONTENT_CACHE_LAYOUTS = {
+    "hash": ContentCache,
+    "bucket": BucketedContentCache,
+}
+
+
+def get_content_cache(
+    conn: Redis | RedisCluster,
+    local_cache: LocalCache | None = None,
+    read_conn: Redis | RedisCluster | None = None,
+) -> ContentCache:
+    """Content cache with the storage layout, codec
+    and read through options selected in settings
+    """
+    cache_class = CONTENT_CACHE_LAYOUTS[settings.CONTENT_CACHE_LAYOUT]
+    return cache_class(
+        conn,
+        local_cache,
+        codec=get_codec(settings.CONTENT_CACHE_CODEC),
+        read_conn=read_conn,
+        read_through=settings.CONTENT_CACHE_READ_THROUGH,
+        ttl=settings.CONTENT_CACHE_TTL,
+        fill_timeout=settings.CONTENT_CACHE_FILL_TIMEOUT,
+        generation_ttl=settings.CONTENT_CACHE_GENERATION_TTL,
+    )
+
+
+class UserLikeCache(BaseCache):
+    """This Cache will store like value of each user on each content"""
+
+    build_checkpoint_key = "user:likes:build:last_id"
+    watermark_key = "user:likes:build:watermark"
+    fill_lock_prefix = "user:likes:fill"
+
+    def get_key(
+        self,
+        like: dict | None = None,
+        user_id: int | None = None,
+        generation: int | None = None,
+    ) -> str:
+        """Like indexes are not versioned, generation is ignored"""
+        if like and like.get("user_id"):
+            user_id = like["user_id"]
+        return f"user:{user_id}:likes"
+
+    def get_value(self, like: dict) -> dict:
+        return {like["content_id"]: like["value"]}
+
+    def _get_data(self):
+        """Get like of each user on each content from database"""
+        return _get_active_likes().values("id", "user_id", "content_id", "value")
+
+    def _get_changed_data(self, since: datetime):
+        return self._get_data().filter(updated_at__gt=since)
+
+
+class LiveContentIds:
+    """Ids of existing contents as a bitmap, so pages of sparse id ranges only
+    look up ids which exist. A bitmap takes one bit per id up to the max id,
+    e.g. 1.25MB for 10M ids, a sorted set would take tens of bytes per id.
+    The bitmap is the truth up to its max id, ids above it are listed as live,
+    as contents created after the build are not known to it yet.
+    Keys share a hash tag, so scripts and the swap of a build work in a cluster
+    """
+
+    key = "content:{live_ids}"
+    max_id_key = "content:{live_ids}:max_id"
+    build_key = "content:{live_ids}:build"
+
+    conn: Redis | RedisCluster
+    # conn is a replica, scripts which read are sent as read only ones
+    read_only: bool
+
+    def __init__(self, conn: Redis | RedisCluster, *, read_only: bool = False):
+        self.conn = conn
+        self.read_only = read_only
+        self._live_ids_script = conn.register_script(LIVE_IDS_SCRIPT)
+        self._add_script = conn.register_script(ADD_LIVE_IDS_SCRIPT)
+        self._publish_script = conn.register_script(PUBLISH_LIVE_IDS_SCRIPT)
+
+    def build(self, batch_size: int = 1000) -> int:
+        """Rebuild the bitmap from ids in database aside and then swap it in,
+        it returns the max id
+        """
+        self.conn.delete(self.build_key)
+        max_id = 0
+        ids = (
+            Content.objects.values_list("id", flat=True)
+            .order_by("id")
+            .iterator(chunk_size=batch_size)
+        )
+        while batch := list(itertools.islice(ids, batch_size)):
+            pipe = self.conn.pipeline(transaction=False)
+            for id_ in batch:
+                pipe.setbit(self.build_key, id_, 1)
+            pipe.execute()
+            max_id = batch[-1]
+        self._publish_script(
+            keys=[self.key, self.max_id_key, self.build_key],
+            args=[max_id],
+        )
+        return max_id
+
+    def add(self, ids: Iterable[int]):
+        """Mark ids of created contents live"""
+        ids = iter(ids)
+        while batch := list(itertools.islice(ids, 1000)):
+            self._add_script(keys=[self.key, self.max_id_key], args=batch)
+
+    def queue_add(self, pipe: Pipeline, ids: list[int]):
+        """Queue marking ids live in pipe"""
+        load_scripts(self.conn, self._add_script)
+        queue_script(pipe, self._add_script, keys=[self.key, self.max_id_key], args=ids)
+
+    def remove(self, ids: Iterable[int]):
+        """Mark ids of deleted contents missing"""
+        pipe = self.conn.pipeline(transaction=False)
+        self.queue_remove(pipe, ids)
+        pipe.execute()
+
+    def queue_remove(self, pipe: Pipeline, ids: Iterable[int]):
+        """Queue marking ids missing in pipe"""
+        for id_ in ids:
+            pipe.setbit(self.key, id_, 0)
+
+    def list(self, start: int, end: int, limit: int) -> list[int]:
+        """Live ids of [start, end) in order, at most limit of them,
+        the cost does not depend on the size of the range
+        """
+        start = max(start, 0)
+        if start >= end or limit <= 0:
+            return []
+        keys = [self.key, self.max_id_key]
+        args = [start, end, limit]
+        if self.read_only:
+            return run_read_only_script(self.conn, self._live_ids_script, keys, args)
+        return self._live_ids_script(keys=keys, args=args)
+
+    def is_live(self, id_: int) -> bool | None:
+        """Whether the content of id_ exists, None if the bitmap does not know,
+        as it is not built yet or id_ is above its max id
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.get(self.max_id_key)
+        pipe.getbit(self.key, id_)
+        max_id, live = pipe.execute()
+        if max_id is None or id_ > int(max_id):
+            return None
+        return bool(live)
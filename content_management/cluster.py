@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from redis import Redis
+from redis.cluster import ClusterNode
+from redis.cluster import ClusterPipeline
+from redis.cluster import RedisCluster
+from redis.exceptions import NoScriptError
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from redis.client import Pipeline
+    from redis.commands.core import Script
+
+
+def is_cluster(conn: Redis | RedisCluster) -> bool:
+    return isinstance(conn, RedisCluster)
+
+
+def new_connection(conn: Redis | RedisCluster) -> Redis | RedisCluster:
+    """Client of the same server or cluster which shares no connection with conn,
+    e.g. for another process or a pub/sub thread
+    """
+    if is_cluster(conn):
+        return RedisCluster(
+            startup_nodes=[
+                ClusterNode(node.host, node.port) for node in conn.get_primaries()
+            ],
+            decode_responses=conn.get_connection_kwargs().get("decode_responses"),
+        )
+    return Redis(**conn.connection_pool.connection_kwargs)
+
+
+def group_by_slot(conn: Redis | RedisCluster, keys: Iterable[str]) -> list[list[int]]:
+    """Positions of keys grouped by their cluster slot in order of appearance,
+    so commands which take many keys can be sent once per slot.
+    All keys are in one group if conn is not a cluster
+    """
+    keys = list(keys)
+    if not is_cluster(conn):
+        return [list(range(len(keys)))] if keys else []
+    groups: dict[int, list[int]] = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(conn.keyslot(key), []).append(i)
+    return list(groups.values())
+
+
+def load_scripts(conn: Redis | RedisCluster, *scripts: Script):
+    """A cluster pipeline does not load missing scripts like a pipeline does,
+    so scripts are loaded on all primaries before they are queued
+    """
+    if is_cluster(conn):
+        for script in scripts:
+            conn.script_load(script.script)
+
+
+def queue_script(
+    pipe: Pipeline | ClusterPipeline,
+    script: Script,
+    keys: list[str],
+    args: list,
+):
+    """A cluster pipeline blocks script calls, so EVALSHA is queued directly
+    and the script must be loaded by load_scripts before
+    """
+    if isinstance(pipe, ClusterPipeline):
+        pipe.execute_command("EVALSHA", script.sha, len(keys), *keys, *args)
+    else:
+        script(keys=keys, args=args, client=pipe)
+
+
+def run_read_only_script(
+    conn: Redis | RedisCluster,
+    script: Script,
+    keys: list[str],
+    args: list,
+):
+    """Run a script which only reads by EVALSHA_RO, which is flagged read only
+    like GET, so replicas serve it, it needs redis 7.
+    The script is sent by EVAL_RO if the server does not have it yet
+    """
+    try:
+        return conn.evalsha_ro(script.sha, len(keys), *keys, *args)
+    except NoScriptError:
+        return conn.eval_ro(script.script, len(keys), *keys, *args)
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+import msgpack
+
+
+class Codec:
+    """Encoding of the replies built by lua scripts,
+    lua_encode is the function of the redis lua runtime which encodes the reply
+    and decode turns it back to python objects on the client
+    """
+
+    name: str
+    lua_encode: str
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    name = "json"
+    lua_encode = "cjson.encode"
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    lua_encode = "cmsgpack.pack"
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS: dict[str, Codec] = {
+    codec.name: codec for codec in (JSONCodec(), MsgpackCodec())
+}
+
+
+def get_codec(name: str) -> Codec | None:
+    """Codec registered with name, an empty name means no codec"""
+    return CODECS[name] if name else None
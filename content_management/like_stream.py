@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from django.db import connection
+from redis.exceptions import ResponseError
+
+from blog.users.models import User
+from content_management.caches import get_stream_fields
+from content_management.models import Content
+from content_management.models import Like
+
+if TYPE_CHECKING:
+    from redis import Redis
+    from redis.cluster import RedisCluster
+
+# likes are inserted with the time of their entries, bulk_create would set
+# updated_at to now and a later entry of the like would be taken as older.
+# An active like is only updated by a newer entry, so concurrent flushes and
+# likes written to database meanwhile need no lock. Rate limited likes never
+# conflict, they are kept
+APPLY_LIKES_SQL = f"""
+INSERT INTO {Like._meta.db_table} AS l (user_id, content_id, value, state, updated_at)
+SELECT * FROM unnest(
+    %s::bigint[], %s::bigint[], %s::smallint[], %s::integer[], %s::timestamptz[]
+)
+ON CONFLICT (user_id, content_id) WHERE state = {Like.StateChoice.OK}
+DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+WHERE l.updated_at < EXCLUDED.updated_at
+"""  # noqa: SLF001
+
+
+def get_entry_time(entry_id: str) -> datetime:
+    """Time of redis when the entry was appended, it is the first part of its id"""
+    return datetime.fromtimestamp(int(entry_id.split("-")[0]) / 1000, tz=UTC)
+
+
+def _get_limited_at(likes: list[Like]) -> dict[tuple[int, int], datetime | None]:
+    """Time of the latest rate limited like by (user id, content id) of likes,
+    it is None for the pairs of existing users and contents which have none
+    """
+    user_ids = set(
+        User.objects.filter(
+            id__in={like.user_id for like in likes},
+        ).values_list("id", flat=True),
+    )
+    content_ids = set(
+        Content.objects.filter(
+            id__in={like.content_id for like in likes},
+        ).values_list("id", flat=True),
+    )
+    limited_at: dict[tuple[int, int], datetime | None] = {
+        (like.user_id, like.content_id): None
+        for like in likes
+        if like.user_id in user_ids and like.content_id in content_ids
+    }
+    for user_id, content_id, updated_at in Like.objects.filter(
+        user_id__in=user_ids,
+        content_id__in=content_ids,
+        state=Like.StateChoice.RATE_LIMITED,
+    ).values_list("user_id", "content_id", "updated_at"):
+        pair = (user_id, content_id)
+        if pair in limited_at and (
+            limited_at[pair] is None or limited_at[pair] < updated_at
+        ):
+            limited_at[pair] = updated_at
+    return limited_at
+
+
+def apply_likes(entries: list[tuple[str, dict]]) -> int:
+    """Write likes of stream entries with one upsert statement.
+    A like is updated only by entries newer than it, and a rate limited like
+    is not stored again if one newer than the entry is stored,
+    so applying entries again is harmless.
+    Entries of missing users or contents are dropped.
+    Returns the number of written likes
+    """
+    received = [
+        Like(
+            user_id=int(fields["user_id"]),
+            content_id=int(fields["content_id"]),
+            value=int(fields["value"]),
+            state=int(fields["state"]),
+            updated_at=get_entry_time(entry_id),
+        )
+        for entry_id, fields in entries
+    ]
+    limited_at = _get_limited_at(received)
+    # an active like is written once, by its latest entry
+    active: dict[tuple[int, int], Like] = {}
+    limited: list[Like] = []
+    for like in received:
+        pair = (like.user_id, like.content_id)
+        if pair not in limited_at:
+            # the user or the content is missing
+            continue
+        if like.state == Like.StateChoice.OK:
+            if pair not in active or active[pair].updated_at <= like.updated_at:
+                active[pair] = like
+        elif limited_at[pair] is None or limited_at[pair] < like.updated_at:
+            limited.append(like)
+    # rows are written in order, so concurrent flushes do not deadlock
+    likes = sorted(
+        [*active.values(), *limited],
+        key=lambda like: (like.user_id, like.content_id),
+    )
+    if not likes:
+        return 0
+    # hooks are skipped, the cache has counted the likes already
+    with connection.cursor() as cursor:
+        cursor.execute(
+            APPLY_LIKES_SQL,
+            [
+                [like.user_id for like in likes],
+                [like.content_id for like in likes],
+                [like.value for like in likes],
+                [like.state for like in likes],
+                [like.updated_at for like in likes],
+            ],
+        )
+        return cursor.rowcount
+
+
+class LikeStream:
+    """Likes which are counted in the cache when they are received and written
+    to database later by the flush workers of a consumer group in batches.
+    Entries are acknowledged after their batch is committed, so each of them
+    is applied at least once, entries left pending by a dead worker are
+    claimed by another one after min_idle
+    """
+
+    key = "likes:stream"
+    group = "likes:flush"
+
+    conn: Redis | RedisCluster
+    min_idle: timedelta
+
+    def __init__(
+        self,
+        conn: Redis | RedisCluster,
+        min_idle: timedelta = timedelta(minutes=1),
+    ):
+        self.conn = conn
+        self.min_idle = min_idle
+
+    def receive(self, like: Like) -> bool:
+        """Rate limit a new like, count it in the cache and append it,
+        returns True if it is a new like
+        """
+        cache = like.get_cache()
+        past_value = self.conn.hget(
+            cache.user_like_cache.get_key(user_id=like.user_id),
+            like.content_id,
+        )
+        if past_value is None and like.check_rate_limit():
+            self.conn.xadd(self.key, get_stream_fields(like))
+            return True
+        return cache.like_received(
+            like,
+            self.key,
+            past_value=int(past_value) if past_value is not None else None,
+        )
+
+    def receive_many(self, likes: list[Like]) -> list[bool]:
+        """receive of many likes, their past values are read in one round trip,
+        new likes are rate limited in another one and all of them are counted
+        and appended in a third one
+        """
+        cache = Like.get_cache()
+        pipe = self.conn.pipeline(transaction=False)
+        for like in likes:
+            pipe.hget(
+                cache.user_like_cache.get_key(user_id=like.user_id),
+                like.content_id,
+            )
+        past_values = pipe.execute()
+        Like.check_rate_limits(
+            [
+                like
+                for like, past_value in zip(likes, past_values, strict=True)
+                if past_value is None
+            ],
+        )
+        return cache.likes_received(
+            likes,
+            self.key,
+            [int(value) if value is not None else None for value in past_values],
+        )
+
+    def create_group(self):
+        try:
+            self.conn.xgroup_create(self.key, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read(
+        self,
+        consumer: str,
+        count: int = 1000,
+        block: int | None = None,
+    ) -> list[tuple[str, dict | None]]:
+        """Entries left pending by other workers or new entries,
+        block is in milliseconds. Fields of deleted entries are None
+        """
+        _, claimed, *_ = self.conn.xautoclaim(
+            self.key,
+            self.group,
+            consumer,
+            min_idle_time=int(self.min_idle.total_seconds() * 1000),
+            count=count,
+        )
+        if claimed:
+            return claimed
+        reply = self.conn.xreadgroup(
+            self.group,
+            consumer,
+            {self.key: ">"},
+            count=count,
+            block=block,
+        )
+        return reply[0][1] if reply else []
+
+    def ack(self, ids: list[str]):
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.xack(self.key, self.group, *ids)
+        pipe.xdel(self.key, *ids)
+        pipe.execute()
+
+    def flush(self, consumer: str, count: int = 1000, block: int | None = None) -> int:
+        """Write a batch of entries to database,
+        returns the number of the read entries
+        """
+        entries = self.read(consumer, count=count, block=block)
+        if not entries:
+            return 0
+        apply_likes([(entry_id, fields) for entry_id, fields in entries if fields])
+        self.ack([entry_id for entry_id, _ in entries])
+        return len(entries)
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from redis import Redis
+    from redis.client import PubSubWorkerThread
+
+# published instead of key names to drop every cached entry
+INVALIDATE_ALL = "*"
+
+
+class LocalCacheEntry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value: dict, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class LocalCache:
+    """Bounded in-process LRU cache placed in front of redis.
+    Entries are dropped when a key is published on the invalidation channel,
+    ttl bounds the staleness if an invalidation message is lost.
+    """
+
+    max_size: int
+    ttl: float
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        ttl: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # it is increased on each invalidation, so values read from redis
+        # before an invalidation are not stored after it
+        self.generation = 0
+        self._entries: OrderedDict[str, LocalCacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: PubSubWorkerThread | None = None
+        self._pid: int | None = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set_many(self, values: dict[str, dict], generation: int | None = None):
+        """Store values, they are ignored if an invalidation happened
+        since the given generation was read
+        """
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            for key, value in values.items():
+                self._entries[key] = LocalCacheEntry(value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: str):
+        with self._lock:
+            self.generation += 1
+            if INVALIDATE_ALL in keys:
+                self._entries.clear()
+                return
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        self.invalidate(INVALIDATE_ALL)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _handle_message(self, message: dict):
+        """A message is space separated keys"""
+        self.invalidate(*message["data"].split())
+
+    def _handle_exception(self, exc, pubsub, thread):
+        """Invalidation messages may be lost while the connection is broken,
+        so everything is dropped and the next read subscribes again,
+        the stopped thread closes its pubsub connection itself
+        """
+        thread.stop()
+        self._thread = None
+        self.clear()
+
+    def _is_subscribed(self, pid: int) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self._pid == pid
+
+    def subscribe(self, conn: Redis, channel: str):
+        """Listen to the invalidation channel in a daemon thread,
+        it is started once per process, forked workers start their own
+        """
+        pid = os.getpid()
+        if self._is_subscribed(pid):
+            return
+        with self._lock:
+            if self._is_subscribed(pid):
+                return
+            self._pid = pid
+            pubsub = conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: self._handle_message})
+            self._thread = pubsub.run_in_thread(
+                sleep_time=1,
+                daemon=True,
+                exception_handler=self._handle_exception,
+            )
+        # entries cached before the subscription may have missed invalidations
+        self.clear()
+
+    def unsubscribe(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread.join(timeout=1)
+        self._thread = None
+        self._pid = None
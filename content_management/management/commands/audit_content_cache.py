@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from config.settings.base import redis
+from content_management.auditors import ContentCacheAuditor
+from content_management.caches import get_content_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare cached content aggregates with the database "
+        "and optionally repair only the drifted keys"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=None,
+            help="Number of randomly sampled ids to check, all ids by default",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of ids checked per redis and database round trip",
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Rewrite missing and drifted keys and remove orphaned ones",
+        )
+
+    def handle(self, *args, **options):
+        auditor = ContentCacheAuditor(
+            get_content_cache(redis),
+            batch_size=options["batch_size"],
+        )
+        if options["sample"] is None:
+            ids = auditor.get_all_ids()
+        else:
+            ids = auditor.get_sample_ids(options["sample"])
+        report = auditor.audit(ids, repair=options["repair"])
+        self.stdout.write(str(report))
+        if report.missing or report.orphaned or report.drifted:
+            self.stdout.write(self.style.WARNING("cache is diverged"))
+        else:
+            self.stdout.write(self.style.SUCCESS("cache is consistent"))
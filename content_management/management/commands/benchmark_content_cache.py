@@ -0,0 +1,95 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from redis import Redis
+
+from config.settings.base import redis
+from content_management.caches import CONTENT_CACHE_LAYOUTS
+from content_management.codecs import CODECS
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure p50 and p99 latency of reading content cache pages with a "
+        "pipeline of one command per content and with the multi get of each "
+        "codec, synthetic contents are written to an empty scratch database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=10_000,
+            help="Number of synthetic contents",
+        )
+        parser.add_argument(
+            "--db",
+            type=int,
+            default=15,
+            help="Empty redis database used for the measurement",
+        )
+        parser.add_argument(
+            "--page-sizes",
+            type=int,
+            nargs="+",
+            default=[10, 100, 1000],
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=200,
+            help="Number of pages read for each page size and reader",
+        )
+        parser.add_argument(
+            "--layout",
+            choices=CONTENT_CACHE_LAYOUTS,
+            default=settings.CONTENT_CACHE_LAYOUT,
+        )
+
+    def get_rows(self, options):
+        for id_ in range(1, options["count"] + 1):
+            yield {
+                "id": id_,
+                "title": f"title {id_}",
+                "likes_count": id_ % 1000,
+                "likes_sum": id_ % 1000 * 3,
+            }
+
+    def measure(self, cache, page_size: int, options) -> tuple[float, float]:
+        """p50 and p99 of reading random pages in milliseconds"""
+        timings = []
+        for _ in range(options["iterations"]):
+            start_id = random.randint(1, options["count"] - page_size + 1)  # noqa: S311
+            started = time.perf_counter()
+            cache.list(range(start_id, start_id + page_size))
+            timings.append((time.perf_counter() - started) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        return percentiles[49], percentiles[98]
+
+    def handle(self, *args, **options):
+        conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": options["db"]})
+        if conn.dbsize():
+            msg = f"redis database {options['db']} is not empty"
+            raise CommandError(msg)
+        if options["count"] < max(options["page_sizes"]):
+            msg = "--count must not be smaller than the page sizes"
+            raise CommandError(msg)
+        cache_class = CONTENT_CACHE_LAYOUTS[options["layout"]]
+        readers = {"pipeline": cache_class(conn)} | {
+            name: cache_class(conn, codec=codec) for name, codec in CODECS.items()
+        }
+        try:
+            cache_class(conn).set_many(self.get_rows(options))
+            for page_size in options["page_sizes"]:
+                for name, cache in readers.items():
+                    p50, p99 = self.measure(cache, page_size, options)
+                    self.stdout.write(
+                        f"{options['layout']} {name} {page_size} items: "
+                        f"p50 {p50:.3f}ms, p99 {p99:.3f}ms",
+                    )
+        finally:
+            conn.flushdb()
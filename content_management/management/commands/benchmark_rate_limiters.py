@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from redis import Redis
+
+from config.settings.base import redis
+from content_management.rate_limiter import RATE_LIMITERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare redis memory per key, redis commands per decision and burst "
+        "accuracy of the rate limiting algorithms, keys are written to an empty "
+        "scratch database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keys",
+            type=int,
+            default=10_000,
+            help="Number of limited keys used to measure memory",
+        )
+        parser.add_argument(
+            "--db",
+            type=int,
+            default=15,
+            help="Empty redis database used for the measurement",
+        )
+        parser.add_argument(
+            "--limit-count",
+            type=int,
+            default=100,
+        )
+        parser.add_argument(
+            "--limit-period",
+            type=int,
+            default=60,
+            help="Seconds of the limit period",
+        )
+
+    @staticmethod
+    def get_commands(conn: Redis) -> int:
+        """Number of commands run by the server, scripts and their commands
+        are counted, the INFO commands of the measurement are not
+        """
+        return sum(
+            stats["calls"]
+            for name, stats in conn.info("commandstats").items()
+            if name not in ("cmdstat_info", "cmdstat_script")
+        )
+
+    def measure(self, conn: Redis, limiter, options) -> tuple[float, float, int]:
+        """Bytes per key, commands per decision and the admitted requests
+        of a burst of twice the limit on a fresh key
+        """
+        memory = conn.info("memory")["used_memory"]
+        commands = self.get_commands(conn)
+        for i in range(options["keys"]):
+            limiter.is_limited(f"benchmark:{i}")
+        commands = self.get_commands(conn) - commands
+        memory = conn.info("memory")["used_memory"] - memory
+        admitted = sum(
+            not limiter.is_limited("benchmark:burst")
+            for _ in range(2 * options["limit_count"])
+        )
+        return memory / options["keys"], commands / options["keys"], admitted
+
+    def handle(self, *args, **options):
+        conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": options["db"]})
+        if conn.dbsize():
+            msg = f"redis database {options['db']} is not empty"
+            raise CommandError(msg)
+        try:
+            for name, limiter_class in RATE_LIMITERS.items():
+                limiter = limiter_class(
+                    conn,
+                    limit_count=options["limit_count"],
+                    limit_period=timedelta(seconds=options["limit_period"]),
+                )
+                # the script is loaded before commands are counted
+                limiter.is_limited("benchmark:load")
+                memory, commands, admitted = self.measure(conn, limiter, options)
+                self.stdout.write(
+                    f"{name}: {memory:.0f} bytes per key, "
+                    f"{commands:.1f} commands per decision, "
+                    f"{admitted} of {2 * options['limit_count']} burst requests "
+                    f"admitted with a limit of {options['limit_count']}",
+                )
+                conn.flushdb()
+        finally:
+            conn.flushdb()
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from config.settings.base import redis
+from content_management.caches import get_content_cache
+
+
+class Command(BaseCommand):
+    help = "Build the content cache from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of contents fetched and written per round trip",
+        )
+        parser.add_argument(
+            "--ops-per-second",
+            type=int,
+            default=None,
+            help="Throttle writes to this rate to run against live traffic",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue from the last checkpoint of a crashed build",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Rebuild only contents changed since the last build, "
+            "it is meant to be run from cron every minute",
+        )
+        parser.add_argument(
+            "--rollback",
+            action="store_true",
+            help="Switch readers back to the generation of the previous build",
+        )
+        parser.add_argument(
+            "--reclaim",
+            action="store_true",
+            help="Unlink keys of retired generations, a build does it as well",
+        )
+        parser.add_argument(
+            "--overlap",
+            type=int,
+            default=60,
+            help="Seconds before the last build start to look for changes",
+        )
+
+    def progress(self, built: int, last_id: int):
+        self.stdout.write(f"{built} contents built, last id: {last_id}")
+
+    def handle(self, *args, **options):
+        cache = get_content_cache(redis)
+        if options["rollback"]:
+            generation = cache.rollback()
+            self.stdout.write(
+                self.style.SUCCESS(f"rolled back to generation {generation}"),
+            )
+            return
+        if options["reclaim"]:
+            unlinked = cache.reclaim(batch_size=options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"{unlinked} keys unlinked"))
+            return
+        if options["incremental"]:
+            built = cache.build_incremental(
+                overlap=timedelta(seconds=options["overlap"]),
+                batch_size=options["batch_size"],
+                progress=self.progress,
+            )
+            self.stdout.write(self.style.SUCCESS(f"{built} contents rebuilt"))
+            return
+        if options["resume"]:
+            last_id = cache.get_build_checkpoint()
+            self.stdout.write(f"resuming after id: {last_id}")
+        built = cache.build(
+            batch_size=options["batch_size"],
+            ops_per_second=options["ops_per_second"],
+            progress=self.progress,
+            resume=options["resume"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"{built} contents built"))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from redis import Redis
+
+from config.settings.base import redis
+from content_management.caches import CONTENT_CACHE_LAYOUTS
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure redis memory used by each content cache layout "
+        "with synthetic contents written to an empty scratch database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=100_000,
+            help="Number of synthetic contents",
+        )
+        parser.add_argument(
+            "--db",
+            type=int,
+            default=15,
+            help="Empty redis database used for the measurement",
+        )
+        parser.add_argument(
+            "--title-length",
+            type=int,
+            default=30,
+            help="Length of the synthetic titles",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def get_rows(self, options):
+        for id_ in range(1, options["count"] + 1):
+            yield {
+                "id": id_,
+                "title": f"{id_:0{options['title_length']}d}",
+                "likes_count": id_ % 1000,
+                "likes_sum": id_ % 1000 * 3,
+            }
+
+    def handle(self, *args, **options):
+        conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": options["db"]})
+        if conn.dbsize():
+            msg = f"redis database {options['db']} is not empty"
+            raise CommandError(msg)
+        try:
+            for name, cache_class in CONTENT_CACHE_LAYOUTS.items():
+                before = conn.info("memory")["used_memory"]
+                cache = cache_class(conn)
+                cache.set_many(self.get_rows(options), options["batch_size"])
+                used = conn.info("memory")["used_memory"] - before
+                self.stdout.write(
+                    f"{name}: {conn.dbsize()} keys, {used} bytes, "
+                    f"{used / options['count']:.1f} bytes per content, "
+                    f"{conn.object('encoding', cache.get_key(id_=1))} encoding",
+                )
+                conn.flushdb()
+        finally:
+            conn.flushdb()
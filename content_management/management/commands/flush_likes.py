@@ -0,0 +1,59 @@
+import os
+import socket
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from config.settings.base import redis
+from content_management.like_stream import LikeStream
+
+
+class Command(BaseCommand):
+    help = (
+        "Write likes received in write behind mode to the database, "
+        "many workers can run at once as consumers of one group"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of likes read and written per batch",
+        )
+        parser.add_argument(
+            "--block",
+            type=int,
+            default=1000,
+            help="Milliseconds to wait for new likes",
+        )
+        parser.add_argument(
+            "--min-idle",
+            type=int,
+            default=60,
+            help="Seconds after which likes of a dead worker are taken over",
+        )
+        parser.add_argument(
+            "--consumer",
+            default=f"{socket.gethostname()}-{os.getpid()}",
+            help="Name of the worker in the consumer group",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Write the pending likes and exit",
+        )
+
+    def handle(self, *args, **options):
+        stream = LikeStream(redis, min_idle=timedelta(seconds=options["min_idle"]))
+        stream.create_group()
+        while True:
+            count = stream.flush(
+                options["consumer"],
+                count=options["batch_size"],
+                block=None if options["once"] else options["block"],
+            )
+            if count:
+                self.stdout.write(f"{count} likes flushed")
+            elif options["once"]:
+                break
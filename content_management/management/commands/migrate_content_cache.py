@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from config.settings.base import redis
+from content_management.caches import get_content_cache
+
+
+class Command(BaseCommand):
+    help = "Convert cached content like averages to like sums in place"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of keys scanned and converted per round trip",
+        )
+
+    def handle(self, *args, **options):
+        cache = get_content_cache(redis)
+        migrated = cache.migrate_likes_avg(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{migrated} contents migrated"))
@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from redis import Redis
+from redis.cluster import RedisCluster
+
+from config.settings.base import redis
+from content_management.caches import BaseCache
+from content_management.caches import LiveContentIds
+from content_management.caches import UserLikeCache
+from content_management.caches import get_content_cache
+from content_management.cluster import new_connection
+
+CACHES = {
+    "content": get_content_cache,
+    "user_likes": UserLikeCache,
+}
+
+# redis connection of the worker process
+_conn: Redis | RedisCluster | None = None
+
+
+def split_id_range(first_id: int, last_id: int, shards: int) -> list[tuple[int, int]]:
+    """Split [first_id, last_id] to at most `shards` half open ranges"""
+    size = max(-(-(last_id - first_id + 1) // shards), 1)
+    return [
+        (start_id, min(start_id + size, last_id + 1))
+        for start_id in range(first_id, last_id + 1, size)
+    ]
+
+
+def _init_worker(conn: Redis | RedisCluster):
+    """Each worker opens its own database and redis connections"""
+    global _conn  # noqa: PLW0603
+    connections.close_all()
+    _conn = new_connection(conn)
+
+
+def _build_shard(
+    shard: tuple[str, int, int, int, int | None],
+) -> tuple[str, int, int, int, float]:
+    name, start_id, end_id, batch_size, generation = shard
+    started_at = time.monotonic()
+    cache: BaseCache = CACHES[name](_conn)
+    cache.generation = generation
+    built = cache.build_range(start_id, end_id, batch_size=batch_size)
+    return name, start_id, end_id, built, time.monotonic() - started_at
+
+
+class Command(BaseCommand):
+    help = (
+        "Warm up the content cache by building id ranges in a process pool, "
+        "each worker uses its own database and redis connections"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes",
+        )
+        parser.add_argument(
+            "--shards-per-process",
+            type=int,
+            default=4,
+            help="More shards than processes balance uneven id ranges",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows fetched and written per round trip",
+        )
+
+    def get_shards(
+        self,
+        options,
+        generations: dict[str, int | None],
+    ) -> list[tuple[str, int, int, int, int | None]]:
+        shards = options["processes"] * options["shards_per_process"]
+        result = []
+        for name, get_cache in CACHES.items():
+            bounds = get_cache(redis).get_id_bounds()
+            if bounds is None:
+                continue
+            result += [
+                (name, start_id, end_id, options["batch_size"], generations[name])
+                for start_id, end_id in split_id_range(*bounds, shards)
+            ]
+        return result
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        started = time.monotonic()
+        # versioned caches are built in a new generation, readers are switched
+        # to it after all shards are built
+        generations = {
+            name: get_cache(redis).start_generation()
+            for name, get_cache in CACHES.items()
+        }
+        shards = self.get_shards(options, generations)
+        # forked workers must not share the connections of this process
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        with context.Pool(
+            processes=options["processes"],
+            initializer=_init_worker,
+            # forked workers get the client without pickling it
+            initargs=(redis,),
+        ) as pool:
+            total = 0
+            for name, start_id, end_id, built, elapsed in pool.imap_unordered(
+                _build_shard,
+                shards,
+            ):
+                total += built
+                self.stdout.write(
+                    f"{name} [{start_id}, {end_id}): {built} rows "
+                    f"in {elapsed:.2f}s ({built / max(elapsed, 1e-6):.0f} rows/s)",
+                )
+        LiveContentIds(redis).build()
+        elapsed = time.monotonic() - started
+        for name, get_cache in CACHES.items():
+            cache: BaseCache = get_cache(redis)
+            cache.generation = generations[name]
+            cache.publish_generation(since=started_at, batch_size=options["batch_size"])
+            cache.set_watermark(started_at)
+            cache.invalidate()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{total} rows in {len(shards)} shards built in {elapsed:.2f}s "
+                f"({total / max(elapsed, 1e-6):.0f} rows/s)",
+            ),
+        )
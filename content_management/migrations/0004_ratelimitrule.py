@@ -0,0 +1,34 @@
+# Generated by Django 4.2.13 on 2026-10-18 18:57
+
+import datetime
+from django.db import migrations, models
+import django_lifecycle.mixins
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content_management', '0003_content_like_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('use_case', models.CharField(default='like', max_length=50, verbose_name='use case')),
+                ('name', models.CharField(max_length=50, verbose_name='name')),
+                ('key', models.CharField(help_text='Formatted with the values of the request, e.g. user_id:{user_id}, keys of rules must differ', max_length=200, verbose_name='key')),
+                ('conditions', models.JSONField(blank=True, default=dict, help_text='The rule applies only to requests with these values, e.g. {"content_id": 42}', verbose_name='conditions')),
+                ('limit_count', models.PositiveIntegerField(verbose_name='limit count')),
+                ('limit_period', models.DurationField(default=datetime.timedelta(seconds=60), verbose_name='limit period')),
+                ('enabled', models.BooleanField(default=True, verbose_name='enabled')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+            ],
+            bases=(django_lifecycle.mixins.LifecycleModelMixin, models.Model),
+        ),
+        migrations.AddConstraint(
+            model_name='ratelimitrule',
+            constraint=models.UniqueConstraint(fields=('use_case', 'name'), name='unique_rate_limit_rule_name'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.13 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+# the latest of duplicate likes in OK state of a user and content is kept,
+# the cache is built again after it, as it counted the duplicates
+DELETE_DUPLICATE_LIKES = """
+DELETE FROM content_management_like AS duplicate
+USING content_management_like AS latest
+WHERE duplicate.user_id = latest.user_id
+AND duplicate.content_id = latest.content_id
+AND duplicate.state = 1
+AND latest.state = 1
+AND (duplicate.updated_at, duplicate.id) < (latest.updated_at, latest.id)
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content_management', '0004_ratelimitrule'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATE_LIKES, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(condition=models.Q(('state', 1)), fields=('user', 'content'), name='unique_active_like'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.13 on 2026-10-18 19:13
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # indexes are built without blocking writes to likes,
+    # the index of user is dropped after like_user_content_idx is built
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('content_management', '0005_unique_active_like'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='like',
+            index=models.Index(fields=['user', 'content'], name='like_user_content_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='like',
+            index=models.Index(condition=models.Q(('state', 1)), fields=['content'], include=('value',), name='like_content_active_idx'),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,8 +1,19 @@
+import functools
+import json
+import string
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
 from django.core.validators import MinValueValidator
+from django.db import connection
 from django.db import models
+from django.db import transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_lifecycle import AFTER_CREATE
+from django_lifecycle import AFTER_DELETE
+from django_lifecycle import AFTER_SAVE
 from django_lifecycle import AFTER_UPDATE
 from django_lifecycle import BEFORE_CREATE
 from django_lifecycle import LifecycleModel
@@ -11,21 +22,44 @@ from django_lifecycle.conditions import WhenFieldHasChanged
 
 from blog.users.models import User
 from config.settings.base import redis
-from content_management.rate_limiter import TokenBucketRateLimiter
+from content_management.rate_limiter import RULES_CHANNEL
+from content_management.rate_limiter import RULES_KEY
+from content_management.rate_limiter import RateLimit
+from content_management.rate_limiter import get_rate_limiter
 
 
-class Content(models.Model):
+class Content(LifecycleModel):
     redis_max_id_key = "content:max_id"
     title = models.CharField(verbose_name=_("title"), max_length=50)
     text = models.TextField(verbose_name=_("text"))
+    updated_at = models.DateTimeField(
+        verbose_name=_("updated at"),
+        auto_now=True,
+        db_index=True,
+    )
 
     def __str__(self):
         return f"{self.title}: {self.text[:50]}"
 
+    @staticmethod
+    def get_cache():
+        from content_management.caches import get_content_cache
+
+        return get_content_cache(redis)
+
+    # the cache is written once the content is committed, so a rolled back
+    # content is never listed. Deleted contents are removed by a signal,
+    # as contents deleted by querysets and cascades run no hooks
     @hook(AFTER_CREATE)
-    def update_max_id(self):
-        if self.id and self.id > int(redis.get(self.redis_max_id_key)):
-            redis.set(self.redis_max_id_key, self.id)
+    def write_cache(self):
+        transaction.on_commit(lambda: self.get_cache().content_created(self))
+
+    @hook(
+        AFTER_UPDATE,
+        condition=WhenFieldHasChanged("title", has_changed=True),
+    )
+    def refresh_cached_title(self):
+        transaction.on_commit(lambda: self.get_cache().content_updated(self))
 
 
 class Like(LifecycleModel):
@@ -34,7 +68,8 @@ class Like(LifecycleModel):
         RATE_LIMITED = 2
 
     content = models.ForeignKey(Content, on_delete=models.CASCADE)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # likes of a user are found by the leading column of like_user_content_idx
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     value = models.PositiveSmallIntegerField(
         verbose_name=_("value"),
         validators=(
@@ -47,6 +82,38 @@ class Like(LifecycleModel):
         choices=StateChoice.choices,
         default=StateChoice.OK,
     )
+    updated_at = models.DateTimeField(
+        verbose_name=_("updated at"),
+        auto_now=True,
+        db_index=True,
+    )
+
+    # address of the client which liked, it is not stored
+    client_ip: str | None = None
+    # decision of the rate limiter on the creation of the like
+    rate_limit: RateLimit | None = None
+
+    class Meta:
+        constraints = [
+            # one like in OK state per user and content,
+            # rate limited likes are kept
+            models.UniqueConstraint(
+                fields=["user", "content"],
+                condition=models.Q(state=1),
+                name="unique_active_like",
+            ),
+        ]
+        indexes = [
+            # likes of stream entries are looked up in every state
+            models.Index(fields=["user", "content"], name="like_user_content_idx"),
+            # likes of a content are counted and summed from the index alone
+            models.Index(
+                fields=["content"],
+                include=["value"],
+                condition=models.Q(state=1),
+                name="like_content_active_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.content}: {self.value}"
@@ -55,22 +122,126 @@ class Like(LifecycleModel):
     def get_cache():
         """Get cache instance
         TODO: maybe it can be cached in python!"""
-        from content_management.caches import ContentCache
+        from content_management.caches import get_content_cache
 
-        return ContentCache(redis)
+        return get_content_cache(redis)
 
     @staticmethod
     def get_rate_limiter():
-        return TokenBucketRateLimiter(conn=redis)
+        return get_rate_limiter()
 
-    def _get_rate_limiter_key(self) -> str:
-        return f"like:rate-limiter:content_id:{self.content_id}"
+    def _get_rate_limiter_key(self) -> tuple[tuple[str, object], ...]:
+        """Values of the request which limit rules are keyed by"""
+        return (
+            ("content_id", self.content_id),
+            ("user_id", self.user_id),
+            ("ip", self.client_ip),
+        )
 
-    @hook(BEFORE_CREATE)
-    def update_cache(self):
+    def check_rate_limit(self) -> bool:
+        """Consume the rate limit of a new like,
+        it is marked as rate limited if it is rejected
+        """
         rate_limiter = self.get_rate_limiter()
-        if rate_limiter.is_limited(self._get_rate_limiter_key()):
+        self.rate_limit = rate_limiter.consume(self._get_rate_limiter_key())
+        if self.rate_limit.limited:
             self.state = Like.StateChoice.RATE_LIMITED
+        return self.rate_limit.limited
+
+    def upsert(self) -> bool:
+        """Create the like or update the value of the active like of the user
+        for the content with one statement, the unique constraint of active
+        likes tells which one is done. The cache is updated as by the hooks,
+        which are not run, a created like which is rate limited is marked
+        afterwards. Returns True if the like is created
+        """
+        self.updated_at = timezone.now()
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute(
+                    UPSERT_LIKE_SQL,
+                    {
+                        "user_id": self.user_id,
+                        "content_id": self.content_id,
+                        "value": self.value,
+                        "updated_at": self.updated_at,
+                    },
+                )
+                if (row := cursor.fetchone()) is not None:
+                    break
+                # the like was created by a concurrent request after the
+                # statement started, the next one reads its past value
+        self.pk, created, past_value = row
+        if created:
+            if self.check_rate_limit():
+                Like.objects.filter(pk=self.pk).update(state=self.state)
+            else:
+                self.get_cache().content_liked(self)
+        elif past_value != self.value:
+            self.get_cache().like_value_updated(self, past_value=past_value)
+        return created
+
+    @classmethod
+    def upsert_many(cls, likes: list["Like"]) -> list[bool]:
+        """upsert of many likes, at most one per user and content, with one
+        statement, new likes are rate limited in one round trip and the cache
+        is updated in one pipeline. Returns True for each created like
+        """
+        updated_at = timezone.now()
+        pending = {(like.user_id, like.content_id): like for like in likes}
+        rows = []
+        with connection.cursor() as cursor:
+            while pending:
+                cursor.execute(
+                    UPSERT_LIKES_SQL,
+                    {
+                        "user_ids": [user_id for user_id, _ in pending],
+                        "content_ids": [content_id for _, content_id in pending],
+                        "values": [like.value for like in pending.values()],
+                        "updated_at": updated_at,
+                    },
+                )
+                # likes created by concurrent requests after the statement
+                # started are not returned, the next one reads their past values
+                for pk, user_id, content_id, created, past_value in cursor.fetchall():
+                    like = pending.pop((user_id, content_id))
+                    like.pk = pk
+                    like.updated_at = updated_at
+                    rows.append((like, created, past_value))
+        created = [like for like, is_new, _ in rows if is_new]
+        cls.check_rate_limits(created)
+        if limited := [
+            like.pk for like in created if like.state == Like.StateChoice.RATE_LIMITED
+        ]:
+            Like.objects.filter(pk__in=limited).update(
+                state=Like.StateChoice.RATE_LIMITED,
+            )
+        past_values = {like.pk: past for like, is_new, past in rows if not is_new}
+        cls.get_cache().likes_saved(
+            [like for like in created if like.state == Like.StateChoice.OK],
+            [
+                like
+                for like, _, past in rows
+                if like.pk in past_values and past != like.value
+            ],
+            past_values=past_values,
+        )
+        return [like.pk not in past_values for like in likes]
+
+    @classmethod
+    def check_rate_limits(cls, likes: list["Like"]):
+        """check_rate_limit of many new likes in one round trip"""
+        rate_limits = cls.get_rate_limiter().consume_many(
+            [like._get_rate_limiter_key() for like in likes],  # noqa: SLF001
+        )
+        for like, rate_limit in zip(likes, rate_limits, strict=True):
+            like.rate_limit = rate_limit
+            if rate_limit.limited:
+                like.state = Like.StateChoice.RATE_LIMITED
+
+    @hook(BEFORE_CREATE)
+    def update_cache(self):
+        if self.check_rate_limit():
             return
         cache = self.get_cache()
         cache.content_liked(self)
@@ -82,3 +253,142 @@ class Like(LifecycleModel):
     def update_content_like_cache(self):
         cache = self.get_cache()
         cache.like_value_updated(self)
+
+
+# the past value is read by the common table expression, which locks the
+# active like, as RETURNING gives only the new row. The conflicting like is
+# not updated if it was created after the statement started, no row is
+# returned then. xmax of a new row is 0
+UPSERT_LIKE_SQL = f"""
+WITH past AS (
+    SELECT value FROM {Like._meta.db_table}
+    WHERE user_id = %(user_id)s AND content_id = %(content_id)s
+    AND state = {Like.StateChoice.OK}
+    FOR UPDATE
+)
+INSERT INTO {Like._meta.db_table} AS l (user_id, content_id, value, state, updated_at)
+VALUES (
+    %(user_id)s, %(content_id)s, %(value)s, {Like.StateChoice.OK}, %(updated_at)s
+)
+ON CONFLICT (user_id, content_id) WHERE state = {Like.StateChoice.OK}
+DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+WHERE EXISTS (SELECT FROM past)
+RETURNING l.id, l.xmax = 0, (SELECT value FROM past)
+"""  # noqa: S608, SLF001
+
+# upsert of many likes as by UPSERT_LIKE_SQL, past likes are found by
+# the arrays, as the planner reads the whole table to join the unnest,
+# and they are locked in order, so concurrent statements do not deadlock
+UPSERT_LIKES_SQL = f"""
+WITH likes AS (
+    SELECT * FROM unnest(
+        %(user_ids)s::bigint[], %(content_ids)s::bigint[], %(values)s::smallint[]
+    ) AS e (user_id, content_id, value)
+), past AS (
+    SELECT l.user_id, l.content_id, l.value FROM {Like._meta.db_table} l
+    WHERE l.user_id = ANY(%(user_ids)s) AND l.content_id = ANY(%(content_ids)s)
+    AND (l.user_id, l.content_id) IN (SELECT user_id, content_id FROM likes)
+    AND l.state = {Like.StateChoice.OK}
+    ORDER BY l.user_id, l.content_id
+    FOR UPDATE
+)
+INSERT INTO {Like._meta.db_table} AS l (user_id, content_id, value, state, updated_at)
+SELECT user_id, content_id, value, {Like.StateChoice.OK}, %(updated_at)s
+FROM likes
+ORDER BY user_id, content_id
+ON CONFLICT (user_id, content_id) WHERE state = {Like.StateChoice.OK}
+DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+WHERE EXISTS (
+    SELECT FROM past WHERE past.user_id = l.user_id AND past.content_id = l.content_id
+)
+RETURNING l.id, l.user_id, l.content_id, l.xmax = 0, (
+    SELECT value FROM past
+    WHERE past.user_id = l.user_id AND past.content_id = l.content_id
+)
+"""  # noqa: S608, SLF001
+
+
+class RateLimitRule(LifecycleModel):
+    """Rate limit of a use case which overrides the one of settings by name,
+    rules are published to redis on each change and workers apply them
+    as soon as they are notified
+    """
+
+    use_case = models.CharField(
+        verbose_name=_("use case"),
+        max_length=50,
+        default="like",
+    )
+    name = models.CharField(verbose_name=_("name"), max_length=50)
+    key = models.CharField(
+        verbose_name=_("key"),
+        max_length=200,
+        help_text=_(
+            "Formatted with the values of the request, e.g. user_id:{user_id}, "
+            "keys of rules must differ",
+        ),
+    )
+    conditions = models.JSONField(
+        verbose_name=_("conditions"),
+        default=dict,
+        blank=True,
+        help_text=_(
+            "The rule applies only to requests with these values, "
+            'e.g. {"content_id": 42}',
+        ),
+    )
+    limit_count = models.PositiveIntegerField(verbose_name=_("limit count"))
+    limit_period = models.DurationField(
+        verbose_name=_("limit period"),
+        default=timedelta(minutes=1),
+    )
+    enabled = models.BooleanField(verbose_name=_("enabled"), default=True)
+    updated_at = models.DateTimeField(verbose_name=_("updated at"), auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["use_case", "name"],
+                name="unique_rate_limit_rule_name",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.use_case} {self.name}: {self.limit_count} in {self.limit_period}"
+
+    def clean(self):
+        try:
+            list(string.Formatter().parse(self.key))
+        except ValueError as e:
+            raise ValidationError({"key": str(e)}) from e
+        if not isinstance(self.conditions, dict):
+            raise ValidationError({"conditions": _("Conditions must be an object")})
+        if self.limit_count == 0 or self.limit_period <= timedelta(0):
+            raise ValidationError(_("Limit count and period must be positive"))
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "key": self.key,
+            "conditions": self.conditions,
+            "limit_count": self.limit_count,
+            "limit_period": self.limit_period.total_seconds(),
+            "enabled": self.enabled,
+        }
+
+    @classmethod
+    def publish(cls, use_case: str, conn=redis) -> str:
+        """Store the rules of the use case in redis and send them to workers"""
+        rules = [rule.to_dict() for rule in cls.objects.filter(use_case=use_case)]
+        data = json.dumps(rules)
+        conn.hset(RULES_KEY, use_case, data)
+        conn.publish(RULES_CHANNEL, json.dumps({"use_case": use_case, "rules": rules}))
+        return data
+
+    @hook(AFTER_SAVE)
+    @hook(AFTER_DELETE)
+    def publish_use_case(self):
+        use_cases = {self.use_case, self.initial_value("use_case")} - {None}
+        # workers must not see a change which is rolled back
+        for use_case in use_cases:
+            transaction.on_commit(functools.partial(self.publish, use_case))
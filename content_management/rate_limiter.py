@@ -1,35 +1,770 @@
+from __future__ import annotations
+
+import functools
+import itertools
+import json
+import math
+import os
+import string
+import threading
+import time
+from dataclasses import dataclass
 from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+
+from config.settings.base import redis
+from content_management.cluster import is_cluster
+from content_management.cluster import load_scripts
+from content_management.cluster import new_connection
+from content_management.cluster import queue_script
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from redis import Redis
+    from redis.client import PubSubWorkerThread
+    from redis.cluster import RedisCluster
+
+# limit rules stored in the database by use case,
+# changes are published on the channel
+RULES_KEY = "rate-limiter:rules"
+RULES_CHANNEL = "rate-limiter:rules"
+
+# each algorithm defines load, which reads the state of a key and how many
+# tokens it has, retry_after, milliseconds until a state has enough tokens,
+# and apply, which takes tokens of a state and returns how many are left.
+# The clock of redis is used so workers need no synced clocks
+
+# tokens are refilled continuously at capacity / period from the time of the
+# last decision. A missing bucket is full, the key expires when the bucket
+# would be full again, the key is a hash of tokens and the time of the last
+# decision
+BUCKET_FUNCTIONS = """
+local function load(key, capacity, period, now)
+    -- counters of the former fixed window limiter are strings
+    if redis.call('TYPE', key).ok == 'string' then
+        redis.call('DEL', key)
+    end
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1])
+    local ts = tonumber(bucket[2])
+    if tokens == nil or ts == nil then
+        tokens = capacity
+        ts = now
+    end
+    tokens = math.min(capacity, tokens + math.max(now - ts, 0) * capacity / period)
+    return {key = key, capacity = capacity, period = period, now = now,
+        available = tokens}
+end
+local function retry_after(state, cost)
+    return (cost - state.available) * state.period / state.capacity
+end
+local function apply(state, taken)
+    local tokens = math.min(state.capacity, state.available - taken)
+    redis.call('HSET', state.key, 'tokens', tostring(tokens), 'ts', tostring(state.now))
+    redis.call('PEXPIRE', state.key,
+        math.ceil((state.capacity - tokens) * state.period / state.capacity) + 1)
+    return tokens
+end
+"""
+
+# generic cell rate algorithm, the key keeps only the theoretical arrival
+# time (tat) of the next request in milliseconds, each request moves it by
+# period / capacity and it may be at most period ahead of now,
+# so bursts of capacity are admitted
+GCRA_FUNCTIONS = """
+local function load(key, capacity, period, now)
+    local emission = period / capacity
+    local tat = math.max(tonumber(redis.call('GET', key) or '0'), now)
+    return {key = key, period = period, now = now, emission = emission,
+        tat = tat, available = (now + period - tat) / emission}
+end
+local function retry_after(state, cost)
+    return (cost - state.available) * state.emission
+end
+local function apply(state, taken)
+    local tat = math.max(state.tat + taken * state.emission, state.now)
+    if tat > state.now then
+        redis.call('SET', state.key, tostring(tat), 'PX', math.ceil(tat - state.now))
+    else
+        redis.call('DEL', state.key)
+    end
+    return (state.now + state.period - tat) / state.emission
+end
+"""
+
+# sliding window counter, counts of the current and the previous fixed windows
+# are kept in a hash by window number, the previous count is weighted by
+# the part of the previous window which is still in the sliding window
+SLIDING_WINDOW_FUNCTIONS = """
+local function load(key, capacity, period, now)
+    local window = math.floor(now / period)
+    local to_next = (window + 1) * period - now
+    local counts = redis.call('HMGET', key, window, window - 1)
+    local current = tonumber(counts[1]) or 0
+    local previous = tonumber(counts[2]) or 0
+    return {key = key, capacity = capacity, period = period, window = window,
+        to_next = to_next, current = current, previous = previous,
+        available = capacity - previous * to_next / period - current}
+end
+local function retry_after(state, cost)
+    local need = cost - state.available
+    if state.previous > 0 and need * state.period / state.previous <= state.to_next then
+        return need * state.period / state.previous
+    end
+    -- the current window is the previous one then
+    local next_need = cost - (state.capacity - state.current)
+    if next_need > 0 then
+        return state.to_next + next_need * state.period / state.current
+    end
+    return state.to_next
+end
+local function apply(state, taken)
+    -- at most the count of the current window is given back
+    taken = math.max(taken, -state.current)
+    if taken == 0 then
+        return state.available
+    end
+    redis.call('HINCRBY', state.key, state.window, taken)
+    if redis.call('HLEN', state.key) > 2 then
+        for _, field in ipairs(redis.call('HKEYS', state.key)) do
+            if tonumber(field) < state.window - 1 then
+                redis.call('HDEL', state.key, field)
+            end
+        end
+    end
+    redis.call('PEXPIRE', state.key, 2 * state.period)
+    return state.available - taken
+end
+"""
+
+# tokens are taken of every key only if every key has enough of them,
+# so a request rejected by one limit costs nothing of the others
+# KEYS: limited keys
+# ARGV: tokens taken by the decision,
+# 1 if fewer tokens are taken when a key has not enough of them,
+# then capacity and period in milliseconds of each key,
+# a negative number of tokens gives them back
+# returns taken tokens, the fewest remaining tokens of the keys,
+# milliseconds to retry after and the position of the key which rejected
+# the decision, 0 if it is admitted
+DECIDE_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local partial = ARGV[2] == '1'
+local time = redis.call('TIME')
+local now = time[1] * 1000 + time[2] / 1000
+local taken = cost
+local states = {}
+for i, key in ipairs(KEYS) do
+    local state = load(key, tonumber(ARGV[2 * i + 1]), tonumber(ARGV[2 * i + 2]), now)
+    states[i] = state
+    if state.available < cost then
+        if partial and state.available >= 1 then
+            taken = math.min(taken, math.floor(state.available))
+        else
+            return {0, tostring(state.available), tostring(retry_after(state, cost)), i}
+        end
+    end
+end
+local remaining = nil
+for _, state in ipairs(states) do
+    local left = apply(state, taken)
+    if remaining == nil or left < remaining then
+        remaining = left
+    end
+end
+return {taken, tostring(remaining), '0', 0}
+"""
+
+BUCKET_SCRIPT = BUCKET_FUNCTIONS + DECIDE_SCRIPT
+GCRA_SCRIPT = GCRA_FUNCTIONS + DECIDE_SCRIPT
+SLIDING_WINDOW_SCRIPT = SLIDING_WINDOW_FUNCTIONS + DECIDE_SCRIPT
 
-from redis import Redis
+
+@dataclass
+class RateLimit:
+    limited: bool
+    # tokens left after the decision, fractional while they are refilled
+    remaining: float
+    # seconds until the request would be admitted, 0 if it is admitted
+    retry_after: float
+    # name of the rule which rejected the request
+    rule: str | None = None
 
 
 class BaseRateLimiter:
-    def is_limited(self, key: str) -> bool:
+    def consume(self, key, tokens: int = 1) -> RateLimit:
         raise NotImplementedError
 
+    def consume_many(self, keys: list, tokens: int = 1) -> list[RateLimit]:
+        return [self.consume(key, tokens) for key in keys]
+
+    def is_limited(self, key) -> bool:
+        return self.consume(key).limited
+
 
-class TokenBucketRateLimiter(BaseRateLimiter):
-    conn: Redis
+class ScriptRateLimiter(BaseRateLimiter):
+    """Limit of limit_count requests in limit_period decided by one script,
+    so concurrent workers never over admit and a decision costs one round trip.
+    The clock of redis is used, workers need no synced clocks
+    """
+
+    conn: Redis | RedisCluster
     limit_count: int
     limit_period: timedelta
+    script: str
+    # keys of algorithms are kept apart, so the algorithm can be switched
+    key_suffix: str = ""
 
     def __init__(
         self,
-        conn: Redis,
+        conn: Redis | RedisCluster,
         limit_count: int = 100,
         limit_period: timedelta = timedelta(minutes=1),
     ):
-        # TODO: limit count and period must be configurable from admin panel,
-        # some packages like constance are suitable for this use case
         self.conn = conn
         self.limit_count = limit_count
         self.limit_period = limit_period
+        self._script = conn.register_script(self.script)
+
+    def _get_limits(self, key) -> list[tuple[str, int, timedelta, str | None]]:
+        """Redis key, count, period and rule name of each limit of key"""
+        return [(key, self.limit_count, self.limit_period, None)]
+
+    def decide(
+        self,
+        key,
+        tokens: int,
+        *,
+        partial: bool = False,
+    ) -> tuple[int, RateLimit]:
+        """Take tokens of every limit of key if all of them have enough,
+        with partial as many as all of them have.
+        Returns the taken tokens and the decision
+        """
+        return self.decide_limits(self._get_limits(key), tokens, partial=partial)
+
+    def decide_limits(
+        self,
+        limits: list[tuple[str, int, timedelta, str | None]],
+        tokens: int,
+        *,
+        partial: bool = False,
+    ) -> tuple[int, RateLimit]:
+        """Decision of limits as returned by _get_limits"""
+        if not limits:
+            return tokens, RateLimit(limited=False, remaining=math.inf, retry_after=0)
+        keys, args = self._get_script_input(limits, tokens, partial=partial)
+        return self._get_decision(limits, self._script(keys=keys, args=args))
+
+    def _get_script_input(
+        self,
+        limits: list[tuple[str, int, timedelta, str | None]],
+        tokens: int,
+        *,
+        partial: bool,
+    ) -> tuple[list[str], list]:
+        return (
+            [f"{limit_key}{self.key_suffix}" for limit_key, *_ in limits],
+            [
+                tokens,
+                int(partial),
+                *itertools.chain.from_iterable(
+                    (count, int(period.total_seconds() * 1000))
+                    for _, count, period, _ in limits
+                ),
+            ],
+        )
+
+    @staticmethod
+    def _get_decision(
+        limits: list[tuple[str, int, timedelta, str | None]],
+        reply: list,
+    ) -> tuple[int, RateLimit]:
+        taken, remaining, retry_after, rejected_by = reply
+        return taken, RateLimit(
+            limited=not taken,
+            remaining=float(remaining),
+            retry_after=float(retry_after) / 1000,
+            rule=limits[rejected_by - 1][3] if rejected_by else None,
+        )
+
+    def consume(self, key, tokens: int = 1) -> RateLimit:
+        """Take tokens of key if it has enough of them"""
+        _, limit = self.decide(key, tokens)
+        return limit
+
+    def consume_many(self, keys: list, tokens: int = 1) -> list[RateLimit]:
+        """Decisions of many keys in one pipelined round trip,
+        each key is decided alone as by consume
+        """
+        decisions = self.decide_many(
+            [(self._get_limits(key), tokens) for key in keys],
+        )
+        return [limit for _, limit in decisions]
+
+    def decide_many(
+        self,
+        decisions: list[tuple[list[tuple[str, int, timedelta, str | None]], int]],
+    ) -> list[tuple[int, RateLimit]]:
+        """Limits and tokens decided alone in one pipelined round trip"""
+        load_scripts(self.conn, self._script)
+        pipe = self.conn.pipeline(transaction=False)
+        for limits, tokens in decisions:
+            if limits:
+                keys, args = self._get_script_input(limits, tokens, partial=False)
+                queue_script(pipe, self._script, keys=keys, args=args)
+        replies = iter(pipe.execute())
+        return [
+            self._get_decision(limits, next(replies))
+            if limits
+            else (tokens, RateLimit(limited=False, remaining=math.inf, retry_after=0))
+            for limits, tokens in decisions
+        ]
+
+    def take(self, key, tokens: int) -> int:
+        """Take at most tokens, as many as key has"""
+        taken, _ = self.decide(key, tokens, partial=True)
+        return taken
+
+    def give_back(self, key, tokens: int):
+        """Return unused tokens, the limit is never raised over limit_count"""
+        self.decide(key, -tokens)
+
+
+class TokenBucketRateLimiter(ScriptRateLimiter):
+    """Bucket of limit_count tokens which is refilled continuously,
+    a full bucket is refilled in limit_period
+    """
+
+    script = BUCKET_SCRIPT
+
+
+class GCRARateLimiter(ScriptRateLimiter):
+    """Generic cell rate algorithm, it admits the same requests
+    as the token bucket but keeps one timestamp per key instead of a hash
+    """
+
+    script = GCRA_SCRIPT
+    key_suffix = ":gcra"
+
+
+class SlidingWindowRateLimiter(ScriptRateLimiter):
+    """Sliding window counter, requests of the previous fixed window
+    are counted by the part of it in the sliding window
+    """
+
+    script = SLIDING_WINDOW_SCRIPT
+    key_suffix = ":sliding"
+
+
+RATE_LIMITERS = {
+    "token_bucket": TokenBucketRateLimiter,
+    "gcra": GCRARateLimiter,
+    "sliding_window": SlidingWindowRateLimiter,
+}
+
+
+@dataclass(frozen=True)
+class LimitRule:
+    # reported as the rule of the rejected requests
+    name: str
+    # formatted with the values of the request, e.g. "user_id:{user_id}",
+    # the rule is skipped if one of its values is missing
+    key: str
+    limit_count: int
+    limit_period: timedelta
+    # (name, value) pairs, the rule applies only to requests with these values
+    conditions: tuple[tuple[str, str], ...] = ()
+
+    @property
+    def fields(self) -> set[str]:
+        return {field for _, field, _, _ in string.Formatter().parse(self.key) if field}
+
+
+class CompositeRateLimiter(ScriptRateLimiter):
+    """Limits of many rules, e.g. per content, user, ip and global,
+    decided in one script call. A request takes tokens of every rule
+    only if every rule admits it, the first rule which rejects it is reported.
+    Keys are tuples of (name, value) pairs of the request, so they can be
+    leased. Keys of a use case share a hash tag in a cluster, so the limits
+    of a use case are on one shard
+    """
+
+    # rules or a function which returns the current rules
+    rules: list[LimitRule] | Callable[[], list[LimitRule]]
+
+    def __init__(
+        self,
+        conn: Redis | RedisCluster,
+        rules: list[LimitRule] | Callable[[], list[LimitRule]],
+        use_case: str = "like",
+        algorithm: str = "token_bucket",
+    ):
+        limiter_class = RATE_LIMITERS[algorithm]
+        self.script = limiter_class.script
+        self.key_suffix = limiter_class.key_suffix
+        self.rules = rules
+        self.prefix = f"{{{use_case}}}" if is_cluster(conn) else use_case
+        super().__init__(conn)
+
+    def _get_rules(self) -> list[LimitRule]:
+        return self.rules() if callable(self.rules) else self.rules
+
+    def _get_limits(
+        self,
+        key: tuple[tuple[str, object], ...],
+        rules: list[LimitRule] | None = None,
+    ) -> list[tuple[str, int, timedelta, str | None]]:
+        values = dict(key)
+        if rules is None:
+            rules = self._get_rules()
+        return [
+            (
+                f"{self.prefix}:rate-limiter:{rule.key.format_map(values)}",
+                rule.limit_count,
+                rule.limit_period,
+                rule.name,
+            )
+            for rule in rules
+            if all(values.get(field) is not None for field in rule.fields)
+            and all(str(values.get(name)) == value for name, value in rule.conditions)
+        ]
+
+    def consume_many(self, keys: list, tokens: int = 1) -> list[RateLimit]:
+        """The rules are read once for all keys"""
+        rules = self._get_rules()
+        decisions = self.decide_many(
+            [(self._get_limits(key, rules), tokens) for key in keys],
+        )
+        return [limit for _, limit in decisions]
+
+
+@dataclass
+class Lease:
+    # redis key, count, period and rule name of the leased limit
+    limit: tuple[str, int, timedelta, str | None]
+    # tokens of the lease which are not used yet
+    tokens: int
+    # tokens taken by the lease
+    size: int
+    expires_at: float
+
+
+class LeasingRateLimiter(BaseRateLimiter):
+    """Each worker takes tokens of the limits of a limiter in leases and
+    admits from them without a round trip until they run out or the lease
+    expires. Leases are kept per limit, so a hot content is leased once
+    for the likes of all users. Only the limits of leased_rules are leased,
+    all of them if it is None, the others, e.g. per user, are rarely hit
+    twice in a lease and are decided by one script call per request.
+    A limit takes a lease of 2 tokens, when it is down to its last token
+    a lease twice as large is added, up to max_lease tokens, so a hot limit
+    costs one script call per max_lease decisions and a lease is never empty.
+    Expired leases are swept once per lease_ttl and their unused tokens
+    are given back in one round trip.
+    Tokens are taken from the limiter before they are used, so a worker
+    is at most max_lease tokens off a limit, either way,
+    as leased tokens are unavailable to other workers for at most lease_ttl
+    """
+
+    limiter: ScriptRateLimiter
+    max_lease: int
+    lease_ttl: float
+    leased_rules: set[str | None] | None
+
+    def __init__(  # noqa: PLR0913
+        self,
+        limiter: ScriptRateLimiter,
+        max_lease: int = 10,
+        lease_ttl: float = 1.0,
+        leased_rules: set[str | None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.limiter = limiter
+        self.max_lease = max_lease
+        self.lease_ttl = lease_ttl
+        self.leased_rules = leased_rules
+        self.clock = clock
+        self._leases: dict[str, Lease] = {}
+        self._swept_at = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens: int = 1) -> RateLimit:
+        if tokens != 1:
+            return self.limiter.consume(key, tokens)
+        limits = self.limiter._get_limits(key)  # noqa: SLF001
+        leased = [
+            limit
+            for limit in limits
+            if self.leased_rules is None or limit[3] in self.leased_rules
+        ]
+        if not leased:
+            return self.limiter.decide_limits(limits, tokens)[1]
+        now = self.clock()
+        for limit, size in self._get_refills(leased, now):
+            if (rejected := self._refill(limit, size, now)) is not None:
+                return rejected
+        with self._lock:
+            taken = [
+                lease
+                for limit in leased
+                if (lease := self._leases.get(limit[0])) is not None and lease.tokens
+            ]
+            for lease in taken:
+                lease.tokens -= 1
+        # limits which are not leased, or of which other threads
+        # took the last tokens meanwhile, are decided in redis
+        taken_keys = {lease.limit[0] for lease in taken}
+        admitted, limit = self.limiter.decide_limits(
+            [limit for limit in limits if limit[0] not in taken_keys],
+            tokens,
+        )
+        with self._lock:
+            for lease in taken:
+                if not admitted:
+                    lease.tokens += 1
+                elif not lease.tokens and self._leases.get(lease.limit[0]) is lease:
+                    del self._leases[lease.limit[0]]
+        if not admitted:
+            return limit
+        return RateLimit(
+            limited=False,
+            remaining=min([limit.remaining, *(lease.tokens for lease in taken)]),
+            retry_after=0,
+        )
+
+    def _get_refills(
+        self,
+        leased: list[tuple[str, int, timedelta, str | None]],
+        now: float,
+    ) -> list[tuple[tuple[str, int, timedelta, str | None], int]]:
+        """Leased limits which have no lease or only its last token
+        and the size of their next lease
+        """
+        with self._lock:
+            expired = self._pop_expired(now, [limit[0] for limit in leased])
+            refills = []
+            for limit in leased:
+                lease = self._leases.get(limit[0])
+                if lease is None:
+                    refills.append((limit, min(2, self.max_lease)))
+                elif lease.tokens == 1:
+                    # the last token is kept until a larger lease is added
+                    refills.append((limit, min(lease.size * 2, self.max_lease)))
+        # redis is called out of the lock, so other keys are not blocked
+        self._give_back(expired)
+        return refills
+
+    def _refill(
+        self,
+        limit: tuple[str, int, timedelta, str | None],
+        size: int,
+        now: float,
+    ) -> RateLimit | None:
+        """Add size tokens to the lease of limit,
+        the decision if the limit has no token for the request
+        """
+        taken, decision = self.limiter.decide_limits([limit], size, partial=True)
+        with self._lock:
+            # another thread may have leased the limit meanwhile
+            lease = self._leases.get(limit[0])
+            if lease is None and not taken:
+                return decision
+            if lease is None:
+                self._leases[limit[0]] = Lease(
+                    limit=limit,
+                    tokens=taken,
+                    size=size,
+                    expires_at=now + self.lease_ttl,
+                )
+            elif taken:
+                lease.tokens += taken
+                lease.size = size
+                lease.expires_at = now + self.lease_ttl
+        return None
+
+    def _pop_expired(self, now: float, keys: list[str]) -> list[Lease]:
+        """Expired leases, which are removed. All leases are swept
+        once per lease_ttl, otherwise only the ones of keys
+        """
+        if now - self._swept_at >= self.lease_ttl:
+            self._swept_at = now
+            keys = list(self._leases)
+        expired = [
+            key
+            for key in keys
+            if key in self._leases and now >= self._leases[key].expires_at
+        ]
+        return [self._leases.pop(key) for key in expired]
+
+    def _give_back(self, leases: list[Lease]):
+        """Unused tokens of leases are given back in one round trip"""
+        if leases:
+            self.limiter.decide_many(
+                [([lease.limit], -lease.tokens) for lease in leases],
+            )
+
+    def consume_many(self, keys: list, tokens: int = 1) -> list[RateLimit]:
+        """Batches skip the leases, they cost one round trip anyway"""
+        return self.limiter.consume_many(keys, tokens)
+
+    def release(self):
+        """Give back unused tokens of all leases, e.g. before the worker exits"""
+        with self._lock:
+            leases, self._leases = self._leases, {}
+        self._give_back(list(leases.values()))
+
+
+def to_limit_rule(rule: dict) -> LimitRule:
+    """Rule of settings or redis, limit_period is in seconds"""
+    return LimitRule(
+        name=rule["name"],
+        key=rule["key"],
+        limit_count=rule["limit_count"],
+        limit_period=timedelta(seconds=rule["limit_period"]),
+        conditions=tuple(
+            sorted(
+                (name, str(value)) for name, value in rule.get("conditions", {}).items()
+            ),
+        ),
+    )
+
+
+class RateLimitRules:
+    """Limit rules of a use case cached in the worker, so a decision costs
+    no lookup. Rules stored in the database override the defaults of settings
+    by name, a disabled one removes it. They are stored in redis and sent on
+    the rules channel on each change, the worker replaces its rules when
+    the message arrives, ttl bounds the staleness if a message is lost
+    """
+
+    conn: Redis | RedisCluster
+    use_case: str
+    defaults: list[dict]
+    ttl: float
+
+    def __init__(  # noqa: PLR0913
+        self,
+        conn: Redis | RedisCluster,
+        use_case: str,
+        defaults: list[dict],
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.conn = conn
+        self.use_case = use_case
+        self.defaults = defaults
+        self.ttl = ttl
+        self.clock = clock
+        self._rules: list[LimitRule] = []
+        self._expires_at: float | None = None
+        self._lock = threading.Lock()
+        self._thread: PubSubWorkerThread | None = None
+        self._pid: int | None = None
+
+    def __call__(self) -> list[LimitRule]:
+        return self.get()
+
+    def get(self) -> list[LimitRule]:
+        self.subscribe()
+        if self._expires_at is None or self.clock() >= self._expires_at:
+            self.refresh()
+        return self._rules
+
+    def refresh(self):
+        data = self.conn.hget(RULES_KEY, self.use_case)
+        if data is None:
+            # redis has lost them, they are published again from the database
+            from content_management.models import RateLimitRule
+
+            data = RateLimitRule.publish(self.use_case, self.conn)
+        self._set(json.loads(data))
+
+    def _set(self, stored: list[dict]):
+        rules = {rule["name"]: rule for rule in self.defaults}
+        for rule in stored:
+            rules[rule["name"]] = rule
+        self._rules = [
+            to_limit_rule(rule) for rule in rules.values() if rule.get("enabled", True)
+        ]
+        self._expires_at = self.clock() + self.ttl
+
+    def _handle_message(self, message: dict):
+        """A message is the use case and its stored rules"""
+        data = json.loads(message["data"])
+        if data["use_case"] == self.use_case:
+            self._set(data["rules"])
+
+    def _handle_exception(self, exc, pubsub, thread):
+        """Changes may be missed while the connection is broken, so the rules
+        are read again by the next decision, which subscribes again
+        """
+        thread.stop()
+        self._thread = None
+        self._expires_at = None
+
+    def _is_subscribed(self, pid: int) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self._pid == pid
+
+    def subscribe(self):
+        """Listen to the rules channel in a daemon thread,
+        it is started once per process, forked workers start their own
+        """
+        pid = os.getpid()
+        if self._is_subscribed(pid):
+            return
+        with self._lock:
+            if self._is_subscribed(pid):
+                return
+            self._pid = pid
+            # the pool of conn is not shared with the listening thread
+            pubsub = new_connection(self.conn).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{RULES_CHANNEL: self._handle_message})
+            self._thread = pubsub.run_in_thread(
+                sleep_time=1,
+                daemon=True,
+                exception_handler=self._handle_exception,
+            )
+        # changes made before the subscription may have been missed
+        self._expires_at = None
+
+    def unsubscribe(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread.join(timeout=1)
+        self._thread = None
+        self._pid = None
+
+
+@functools.cache
+def get_rate_limit_rules(use_case: str) -> RateLimitRules:
+    return RateLimitRules(
+        redis,
+        use_case,
+        defaults=settings.RATE_LIMITS[use_case],
+        ttl=settings.RATE_LIMIT_RULES_TTL,
+    )
+
 
-    def is_limited(self, key: str) -> bool:
-        if self.conn.setnx(key, self.limit_count):
-            self.conn.expire(key, int(self.limit_period.total_seconds()))
-        bucket_val = self.conn.get(key)
-        if bucket_val and int(bucket_val) > 0:
-            self.conn.decrby(key, 1)
-            return False
-        return True
+@functools.cache
+def get_rate_limiter(use_case: str = "like") -> BaseRateLimiter:
+    """Rate limiter of this worker with the current rules and the algorithm
+    of the use case, with leasing if it is enabled
+    """
+    limiter = CompositeRateLimiter(
+        redis,
+        rules=get_rate_limit_rules(use_case),
+        use_case=use_case,
+        algorithm=settings.RATE_LIMITER_ALGORITHMS[use_case],
+    )
+    if not settings.RATE_LIMITER_LEASING:
+        return limiter
+    return LeasingRateLimiter(
+        limiter,
+        max_lease=settings.RATE_LIMITER_LEASE_MAX_TOKENS,
+        lease_ttl=settings.RATE_LIMITER_LEASE_TTL,
+        leased_rules=set(settings.RATE_LIMITER_LEASED_RULES),
+    )
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import functools
+import itertools
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING
+from typing import TypeVar
+
+from django.conf import settings
+from redis import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from config.settings.base import redis
+from content_management.cluster import is_cluster
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from redis.cluster import RedisCluster
+
+T = TypeVar("T")
+
+# errors of a replica which make the read to be retried on the primary
+REPLICA_ERRORS = (RedisConnectionError, RedisTimeoutError)
+
+
+class Replica:
+    __slots__ = ("conn", "healthy", "fresh_at")
+
+    def __init__(self, conn: Redis):
+        self.conn = conn
+        self.healthy = False
+        # time of the primary which the replica data is at least as new as
+        self.fresh_at: float | None = None
+
+
+class ReplicaRouter:
+    """Send read only commands to healthy replicas of the primary,
+    writes and scripts which write stay on the primary. The content list
+    reads the max content id, its page of live ids and the cached contents
+    with the like values of the user through it. Scripts of these reads
+    are sent as EVAL_RO/EVALSHA_RO to replicas, which needs redis 7, and as
+    EVAL/EVALSHA to the primary.
+
+    Replica lag is measured by replication offsets: offsets of the primary
+    are sampled on each check, a replica which has reached the offset sampled
+    at time t has every write made before t. A replica is used while its data
+    is at most max_lag seconds older than the last check, so reads may be
+    max_lag + check_interval seconds stale. Reads fall back to the primary if
+    no replica is healthy, a replica which fails a read is skipped
+    until the next check
+    """
+
+    primary: Redis | RedisCluster
+    replicas: list[Replica]
+    max_lag: float
+    check_interval: float
+
+    def __init__(  # noqa: PLR0913
+        self,
+        primary: Redis | RedisCluster,
+        replicas: list[Redis],
+        max_lag: float = 1.0,
+        check_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.primary = primary
+        self.replicas = [Replica(conn) for conn in replicas]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.clock = clock
+        self.checked_at: float | None = None
+        # (time, offset) samples of the primary in the last max_lag seconds
+        self._offsets: deque[tuple[float, int]] = deque()
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Refresh the health of replicas, the primary offset is read first,
+        so a replica at or after it has every write made before the check
+        """
+        now = self.clock()
+        self.checked_at = now
+        primary_offset = int(self.primary.info("replication")["master_repl_offset"])
+        self._offsets.append((now, primary_offset))
+        while self._offsets[0][0] < now - self.max_lag:
+            self._offsets.popleft()
+        for replica in self.replicas:
+            try:
+                info = replica.conn.info("replication")
+            except REPLICA_ERRORS:
+                replica.healthy = False
+                continue
+            offset = int(info.get("slave_repl_offset", -1))
+            replica.fresh_at = max(
+                (at for at, sampled in self._offsets if offset >= sampled),
+                default=None,
+            )
+            replica.healthy = (
+                info.get("master_link_status") == "up"
+                and replica.fresh_at is not None
+                and now - replica.fresh_at <= self.max_lag
+            )
+
+    def _is_check_due(self) -> bool:
+        return (
+            self.checked_at is None
+            or self.clock() >= self.checked_at + self.check_interval
+        )
+
+    def _check_if_due(self):
+        if not self._is_check_due():
+            return
+        with self._lock:
+            if self._is_check_due():
+                self.check()
+
+    def get_read_connection(self) -> Redis | RedisCluster:
+        """A healthy replica in round robin or the primary"""
+        if not self.replicas:
+            return self.primary
+        self._check_if_due()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return self.primary
+        return healthy[next(self._round_robin) % len(healthy)].conn
+
+    def read(self, func: Callable[[Redis | RedisCluster], T]) -> T:
+        """Run the read only func on a replica,
+        it is run again on the primary if the replica fails
+        """
+        conn = self.get_read_connection()
+        if conn is self.primary:
+            return func(conn)
+        try:
+            return func(conn)
+        except REPLICA_ERRORS:
+            for replica in self.replicas:
+                if replica.conn is conn:
+                    replica.healthy = False
+            return func(self.primary)
+
+
+@functools.cache
+def get_replica_router() -> ReplicaRouter:
+    """Router of this worker over the replicas in settings,
+    a cluster has replicas of its own shards, so it is used as is
+    """
+    if is_cluster(redis):
+        return ReplicaRouter(redis, [])
+    replicas = [
+        Redis(
+            **{
+                **redis.connection_pool.connection_kwargs,
+                "host": host,
+                "port": int(port),
+                # a dead replica must not hang the read before the fallback
+                "socket_timeout": settings.REDIS_REPLICA_SOCKET_TIMEOUT,
+                "socket_connect_timeout": settings.REDIS_REPLICA_SOCKET_TIMEOUT,
+            },
+        )
+        for host, port in (
+            replica.rsplit(":", 1) for replica in settings.REDIS_REPLICAS
+        )
+    ]
+    return ReplicaRouter(
+        redis,
+        replicas,
+        max_lag=settings.REDIS_REPLICA_MAX_LAG,
+        check_interval=settings.REDIS_REPLICA_CHECK_INTERVAL,
+    )
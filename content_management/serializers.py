@@ -1,6 +1,11 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 from rest_framework import status
 
+from config.settings.base import redis
+from content_management.caches import LiveContentIds
+from content_management.like_stream import LikeStream
 from content_management.models import Content
 from content_management.models import Like
 
@@ -17,20 +22,103 @@ class LikeContentSerializer(serializers.ModelSerializer):
         fields = ["content", "value"]
 
     def save(self, **kwargs) -> tuple[Like, int]:
-        user_id = self.context["user_id"]
-        if like := Like.objects.filter(
-            user_id=user_id,
-            content=self.validated_data["content"],
-            state=Like.StateChoice.OK,
-        ).first():
-            # update value
-            like.value = self.validated_data["value"]
-            like.save(update_fields=["value"])
-            return like, status.HTTP_200_OK
         like = Like(
-            user_id=user_id,
+            user_id=self.context["user_id"],
             content=self.validated_data["content"],
             value=self.validated_data["value"],
         )
-        like.save(**kwargs)
-        return like, status.HTTP_201_CREATED
+        like.client_ip = self.context.get("client_ip")
+        created = like.upsert()
+        return like, status.HTTP_201_CREATED if created else status.HTTP_200_OK
+
+
+class LikeWriteBehindSerializer(serializers.Serializer):
+    """Like which is counted in the cache and written to database later,
+    the content is checked by the live ids of the cache without a query,
+    unless they are not built yet, e.g. after redis lost them
+    """
+
+    content = serializers.IntegerField(min_value=1)
+    value = serializers.IntegerField(min_value=0, max_value=5)
+
+    def validate_content(self, value: int) -> int:
+        live = LiveContentIds(redis).is_live(value)
+        if live is None:
+            live = Content.objects.filter(id=value).exists()
+        if not live:
+            raise serializers.ValidationError(_("Content does not exist."))
+        return value
+
+    def save(self, **kwargs) -> tuple[Like, int]:
+        like = Like(
+            user_id=self.context["user_id"],
+            content_id=self.validated_data["content"],
+            value=self.validated_data["value"],
+        )
+        like.client_ip = self.context.get("client_ip")
+        created = LikeStream(redis).receive(like)
+        return like, status.HTTP_201_CREATED if created else status.HTTP_200_OK
+
+
+class LikeItemSerializer(serializers.Serializer):
+    content = serializers.IntegerField(min_value=1)
+    value = serializers.IntegerField(min_value=0, max_value=5)
+
+
+class BulkLikeSerializer(serializers.Serializer):
+    """Likes of the user sent in one request, e.g. queued by an offline client.
+    Contents are checked by one query and the likes are saved by one upsert
+    statement, or appended to the like stream if likes are written behind,
+    new likes are rate limited in one pipelined call. Items are applied
+    in their order, so the last value of a content wins and repeated items
+    of a rate limited like are rate limited too
+    """
+
+    CREATED = "created"
+    UPDATED = "updated"
+    RATE_LIMITED = "rate-limited"
+    NOT_FOUND = "not-found"
+
+    likes = serializers.ListField(
+        child=LikeItemSerializer(),
+        allow_empty=False,
+        max_length=settings.LIKE_BULK_MAX_SIZE,
+    )
+
+    def save(self, **kwargs) -> list[dict]:
+        items = self.validated_data["likes"]
+        contents = Content.objects.only("id", "title").in_bulk(
+            {item["content"] for item in items},
+        )
+        likes: dict[int, Like] = {}
+        for item in items:
+            if (content := contents.get(item["content"])) is None:
+                continue
+            if (like := likes.get(content.id)) is None:
+                like = Like(user_id=self.context["user_id"], content=content)
+                like.client_ip = self.context.get("client_ip")
+                likes[content.id] = like
+            like.value = item["value"]
+        if settings.LIKE_WRITE_BEHIND:
+            created = LikeStream(redis).receive_many(list(likes.values()))
+        else:
+            created = Like.upsert_many(list(likes.values()))
+        new = {
+            like.content_id
+            for like, is_new in zip(likes.values(), created, strict=True)
+            if is_new
+        }
+        results = []
+        for item in items:
+            if (like := likes.get(item["content"])) is None:
+                status_ = self.NOT_FOUND
+            elif like.state == Like.StateChoice.RATE_LIMITED:
+                status_ = self.RATE_LIMITED
+            elif like.content_id in new:
+                # only the first item of a new like creates it
+                new.discard(like.content_id)
+                status_ = self.CREATED
+            else:
+                status_ = self.UPDATED
+            results.append({**item, "status": status_})
+        return results
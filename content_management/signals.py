@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from content_management.models import Content
+
+
+@receiver(post_delete, sender=Content)
+def remove_cached_content(sender, instance: Content, **kwargs):
+    """Sent for contents deleted one by one, by querysets and by cascades"""
+    id_ = instance.pk
+    transaction.on_commit(lambda: Content.get_cache().contents_deleted([id_]))
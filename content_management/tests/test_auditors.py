@@ -0,0 +1,138 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from blog.users.models import User
+from config.settings.base import redis
+from content_management.auditors import ContentCacheAuditor
+from content_management.caches import BucketedContentCache
+from content_management.caches import ContentCache
+from content_management.models import Content
+from content_management.models import Like
+
+
+class TestContentCacheAuditor(TestCase):
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        User.objects.bulk_create(
+            [User(id=i, username=f"user {i}") for i in range(1, 3)],
+        )
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text=f"text {i}") for i in range(1, 6)],
+        )
+        Like.objects.bulk_create(
+            [
+                Like(content_id=1, user_id=1, value=5),
+                Like(content_id=1, user_id=2, value=3),
+                Like(content_id=2, user_id=1, value=1),
+            ],
+        )
+        self.cache = ContentCache(self.conn)
+        self.cache.build(user_likes=False)
+        self.conn.set(Content.redis_max_id_key, 5)
+        self.auditor = ContentCacheAuditor(self.cache, batch_size=2)
+
+    def _diverge(self):
+        # drifted count and sum
+        self.conn.hset(
+            self.cache.get_key(id_=1),
+            mapping={"likes_count": 3, "likes_sum": 12},
+        )
+        # drifted title
+        self.conn.hset(self.cache.get_key(id_=2), "title", "old title")
+        # missing
+        self.conn.delete(self.cache.get_key(id_=3))
+        # orphaned
+        Content.objects.filter(id=5).delete()
+
+    def test_consistent_cache(self):
+        report = self.auditor.audit(self.auditor.get_all_ids())
+        assert report.checked == 5  # noqa: PLR2004
+        assert report.drifted == report.missing == report.orphaned == 0
+
+    def test_diverged_cache(self):
+        self._diverge()
+        report = self.auditor.audit(self.auditor.get_all_ids())
+        assert report.checked == 4  # noqa: PLR2004
+        assert report.drifted == 2  # noqa: PLR2004
+        assert report.missing == 1
+        assert report.orphaned == 1
+        assert report.max_count_drift == 1
+        assert report.max_avg_drift == 0
+        assert report.repaired == 0
+        assert self.conn.exists(self.cache.get_key(id_=3)) == 0
+
+    def test_repair(self):
+        self._diverge()
+        self.conn.hset(self.cache.get_key(id_=4), "likes_count", 7)
+        untouched = self.conn.hgetall(self.cache.get_key(id_=4))
+        report = self.auditor.audit([1, 2, 3, 5], repair=True)
+        assert report.repaired == 4  # noqa: PLR2004
+        assert self.conn.hgetall(self.cache.get_key(id_=4)) == untouched
+        assert self.conn.exists(self.cache.get_key(id_=5)) == 0
+        report = self.auditor.audit([1, 2, 3, 5])
+        assert report.drifted == report.missing == report.orphaned == 0
+
+    def test_repair_skips_concurrently_changed_keys(self):
+        self._diverge()
+        report = self.auditor.audit([1], repair=False)
+        # a like arrives between the audit read and the repair
+        self.conn.hincrby(self.cache.get_key(id_=1), "likes_count", 1)
+        stale = [
+            (
+                {"id": 1, "title": "title 1", "likes_count": 2, "likes_sum": 8},
+                self.cache.get_key(id_=1),
+                {"likes_count": "3", "likes_sum": "12"},
+            ),
+        ]
+        self.auditor._repair([], stale, report)  # noqa: SLF001
+        assert report.repaired == 0
+        assert self.conn.hget(self.cache.get_key(id_=1), "likes_count") == "4"
+
+    def test_sample(self):
+        ids = self.auditor.get_sample_ids(3)
+        assert len(ids) == 3  # noqa: PLR2004
+        assert set(ids) <= set(range(1, 6))
+        assert self.auditor.get_sample_ids(10) == [1, 2, 3, 4, 5]
+
+    def test_command(self):
+        self._diverge()
+        out = StringIO()
+        call_command("audit_content_cache", "--repair", stdout=out)
+        assert "cache is diverged" in out.getvalue()
+        out = StringIO()
+        call_command("audit_content_cache", "--sample=10", stdout=out)
+        assert "cache is consistent" in out.getvalue()
+
+
+class TestBucketedContentCacheAuditor(TestCase):
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text=f"text {i}") for i in range(1, 4)],
+        )
+        self.cache = BucketedContentCache(self.conn, bucket_size=2)
+        self.cache.build(user_likes=False)
+        self.auditor = ContentCacheAuditor(self.cache)
+
+    def test_repair(self):
+        self.conn.hset(self.cache.get_key(id_=2), mapping={"0c": 2, "1t": "old title"})
+        Content.objects.filter(id=1).delete()
+        report = self.auditor.audit([1, 2, 3], repair=True)
+        assert report.drifted == 2  # noqa: PLR2004
+        assert report.orphaned == 1
+        assert report.repaired == 3  # noqa: PLR2004
+        assert self.conn.exists(self.cache.get_key(id_=1)) == 0
+        assert self.conn.hgetall(self.cache.get_key(id_=2)) == {
+            "0t": "title 2",
+            "0c": "0",
+            "0s": "0",
+            "1t": "title 3",
+            "1c": "0",
+            "1s": "0",
+        }
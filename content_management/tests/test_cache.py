@@ -1,8 +1,29 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.db import connections
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.utils import timezone
+from redis import Redis
 
 from blog.users.models import User
 from config.settings.base import redis
+from content_management.caches import BaseCache
+from content_management.caches import CacheBuildError
 from content_management.caches import ContentCache
+from content_management.caches import LiveContentIds
+from content_management.caches import UserLikeCache
+from content_management.caches import get_content_cache
+from content_management.management.commands.warm_content_cache import split_id_range
 from content_management.models import Content
 from content_management.models import Like
 
@@ -15,7 +36,6 @@ class TestContentCache(TestCase):
         self._create_users()
         self._create_contents()
         self._create_likes()
-        self._create_likes()
 
     @staticmethod
     def _create_users():
@@ -53,7 +73,27 @@ class TestContentCache(TestCase):
         Like.objects.bulk_create(likes)
 
     def _get_cache(self):
-        return ContentCache(self.conn)
+        return get_content_cache(self.conn)
+
+    def test_generation_is_read_once_per_page(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        with mock.patch.object(
+            self.conn,
+            "execute_command",
+            wraps=self.conn.execute_command,
+        ) as execute_command:
+            assert len(cache.list(range(1, 101))) == 3  # noqa: PLR2004
+            assert len(cache.list(range(1, 101), user_id=1)) == 3  # noqa: PLR2004
+        # the page itself is read by one pipeline
+        assert [call.args for call in execute_command.call_args_list] == [
+            ("GET", ContentCache.generation_key),
+        ] * 2
+
+    def test_generation_ttl_defaults_to_settings(self):
+        with override_settings(CONTENT_CACHE_GENERATION_TTL=60):
+            assert ContentCache(self.conn).generation_ttl == 60  # noqa: PLR2004
+        assert ContentCache(self.conn, generation_ttl=0).generation_ttl == 0
 
     def test_before_build_cache_is_empty(self):
         cache = self._get_cache()
@@ -69,3 +109,688 @@ class TestContentCache(TestCase):
             {"id": "2", "title": "title 2", "likes_count": "3", "likes_avg": "2.0"},
             {"id": "3", "title": "title 3", "likes_count": "0", "likes_avg": "0.0"},
         ]
+
+    @override_settings(CONTENT_CACHE_READ_THROUGH=True, CONTENT_CACHE_TTL=60)
+    def test_read_through(self):
+        cache = self._get_cache()
+        with self.assertNumQueries(1):
+            result = cache.list(range(1, 10))
+        assert result == [
+            {"id": "1", "title": "title 1", "likes_count": "1", "likes_avg": "5.0"},
+            {"id": "2", "title": "title 2", "likes_count": "3", "likes_avg": "2.0"},
+            {"id": "3", "title": "title 3", "likes_count": "0", "likes_avg": "0.0"},
+        ]
+        assert 0 < self.conn.ttl(cache.get_key(id_=1)) <= 60  # noqa: PLR2004
+        with self.assertNumQueries(0):
+            assert cache.list(range(1, 4)) == result
+
+    @override_settings(CONTENT_CACHE_READ_THROUGH=True)
+    def test_read_through_waits_for_another_fill(self):
+        cache = self._get_cache()
+        self.conn.set(cache.get_fill_lock_key(1), "other", px=1000)
+
+        def fill():
+            conn = Redis(**{**self.conn.connection_pool.connection_kwargs, "db": 15})
+            time.sleep(0.05)
+            get_content_cache(conn).set_many(
+                [{"id": 1, "title": "filled", "likes_count": 0, "likes_sum": 0}],
+            )
+            conn.delete(cache.get_fill_lock_key(1))
+
+        thread = threading.Thread(target=fill)
+        thread.start()
+        with self.assertNumQueries(0):
+            result = cache.list([1])
+        thread.join()
+        assert result[0]["title"] == "filled"
+
+    @override_settings(CONTENT_CACHE_READ_THROUGH=True, CONTENT_CACHE_FILL_TIMEOUT=0.05)
+    def test_read_through_without_the_lock_is_not_written(self):
+        cache = self._get_cache()
+        self.conn.set(cache.get_fill_lock_key(1), "other", px=1000)
+        with self.assertNumQueries(1):
+            assert cache.list([1])[0]["title"] == "title 1"
+        assert self.conn.exists(cache.get_key(id_=1)) == 0
+
+    def test_build_in_batches(self):
+        cache = self._get_cache()
+        progress = mock.Mock()
+        assert cache.build(batch_size=2, progress=progress) == 3  # noqa: PLR2004
+        assert progress.call_args_list == [mock.call(2, 2), mock.call(3, 3)]
+        assert len(cache.list(range(1, 10))) == 3  # noqa: PLR2004
+        assert cache.get_build_checkpoint() is None
+
+    def test_build_resumes_from_checkpoint(self):
+        cache = self._get_cache()
+        # a crashed build wrote contents up to id 2 to its generation
+        generation = cache.start_generation()
+        cache.set_many(cache._get_data().filter(id__lte=2))  # noqa: SLF001
+        self.conn.set(cache.build_checkpoint_key, 2)
+        cache.generation = None
+        assert cache.list(range(1, 10)) == []
+        assert cache.build(resume=True) == 1
+        assert cache.get_generation() == generation
+        assert [item["id"] for item in cache.list(range(1, 10))] == ["1", "2", "3"]
+
+    def test_crashed_generation_is_reclaimed_after_rebuild(self):
+        cache = self._get_cache()
+        crashed = cache.start_generation()
+        cache.set_many(cache._get_data())  # noqa: SLF001
+        cache.generation = None
+        assert self.conn.keys(f"content:g{crashed}:*")
+        cache.build(user_likes=False)
+        assert cache.get_generation() == crashed + 1
+        assert cache.reclaim() > 0
+        assert self.conn.keys(f"content:g{crashed}:*") == []
+        assert len(cache.list(range(1, 10))) == 3  # noqa: PLR2004
+
+    def test_build_switches_generation(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        first = cache.get_generation()
+        assert self.conn.exists(cache.get_key(id_=1)) == 1
+        Content.objects.filter(id=1).update(title="new title")
+        cache.build(user_likes=False)
+        assert cache.get_generation() == first + 1
+        assert cache.list([1])[0]["title"] == "new title"
+        # the previous generation is kept until the next build
+        assert cache.rollback() == first
+        assert cache.list([1])[0]["title"] == "title 1"
+        assert cache.rollback() == first + 1
+        cache.build(user_likes=False)
+        assert cache.reclaim() > 0
+        assert self.conn.keys(f"content:g{first}:*") == []
+
+    def test_unversioned_keys_are_reclaimed(self):
+        cache = self._get_cache()
+        cache.set_many(cache._get_data())  # noqa: SLF001
+        unversioned = self.conn.keys("content:*")
+        cache.build(user_likes=False)
+        assert cache.get_generation() == 1
+        # they are the previous generation until the next build
+        cache.build(user_likes=False)
+        assert cache.reclaim() == len(unversioned)
+        assert not set(self.conn.keys("content:*")) & set(unversioned)
+        assert len(cache.list(range(1, 10))) == 3  # noqa: PLR2004
+
+    def test_invalid_generation_is_not_switched_to(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        generation = cache.get_generation()
+        with (
+            mock.patch.object(cache, "_build", return_value=0),
+            pytest.raises(CacheBuildError),
+        ):
+            cache.build(user_likes=False)
+        assert cache.get_generation() == generation
+        assert len(cache.list(range(1, 10))) == 3  # noqa: PLR2004
+
+    def test_changes_during_build_are_written_after_the_switch(self):
+        cache = self._get_cache()
+        build = cache._build  # noqa: SLF001
+
+        def build_and_change(*args, **kwargs):
+            built = build(*args, **kwargs)
+            Content.objects.filter(id=2).update(
+                title="changed",
+                updated_at=timezone.now(),
+            )
+            return built
+
+        with mock.patch.object(cache, "_build", side_effect=build_and_change):
+            cache.build(user_likes=False)
+        assert cache.list([2])[0]["title"] == "changed"
+
+    @mock.patch("content_management.caches.time.sleep")
+    def test_build_is_throttled(self, mocked_sleep):
+        cache = self._get_cache()
+        cache.build(batch_size=1, ops_per_second=1, user_likes=False)
+        assert mocked_sleep.call_count == 3  # noqa: PLR2004
+        assert mocked_sleep.call_args_list[-1].args[0] > 2  # noqa: PLR2004
+
+    def test_build_command(self):
+        out = StringIO()
+        call_command("build_content_cache", "--batch-size=2", "--resume", stdout=out)
+        assert "3 contents built" in out.getvalue()
+        assert len(self._get_cache().list(range(1, 10))) == 3  # noqa: PLR2004
+
+    def test_rollback_command(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        cache.build(user_likes=False)
+        out = StringIO()
+        call_command("build_content_cache", "--rollback", stdout=out)
+        assert "rolled back to generation 1" in out.getvalue()
+        assert cache.get_generation() == 1
+
+    def test_build_incremental_without_watermark_builds_all(self):
+        cache = self._get_cache()
+        assert cache.build_incremental() == 3  # noqa: PLR2004
+        assert cache.get_watermark() is not None
+
+    def test_build_incremental_rebuilds_changed_contents(self):
+        cache = self._get_cache()
+        cache.build()
+        Like.objects.create(content_id=3, user_id=1, value=3)
+        Content.objects.filter(id=1).update(
+            title="new title",
+            updated_at=timezone.now(),
+        )
+        progress = mock.Mock()
+        assert cache.build_incremental(overlap=timedelta(0), progress=progress) == 2  # noqa: PLR2004
+        assert progress.call_args_list == [mock.call(2, 3)]
+        result = cache.list([1, 3])
+        assert result[0]["title"] == "new title"
+        assert result[1]["likes_count"] == "1"
+        assert cache.build_incremental(overlap=timedelta(0)) == 0
+
+    def test_build_incremental_overlap(self):
+        cache = self._get_cache()
+        cache.build()
+        long_ago = cache.get_watermark() - timedelta(hours=1)
+        Content.objects.update(updated_at=long_ago)
+        Like.objects.update(updated_at=long_ago)
+        Like.objects.filter(content_id=1).update(
+            updated_at=cache.get_watermark() - timedelta(seconds=30),
+        )
+        assert cache.build_incremental(overlap=timedelta(0)) == 0
+        assert cache.build_incremental(overlap=timedelta(minutes=1)) == 1
+
+    def test_build_incremental_command(self):
+        out = StringIO()
+        call_command("build_content_cache", "--incremental", stdout=out)
+        call_command("build_content_cache", "--incremental", stdout=out)
+        assert "contents rebuilt" in out.getvalue()
+
+    def test_build_user_likes(self):
+        cache = self._get_cache()
+        cache.build()
+        assert self.conn.hgetall("user:1:likes") == {"1": "5", "2": "2"}
+        assert self.conn.hgetall("user:2:likes") == {"2": "0"}
+        assert cache.list([1, 2, 3], user_id=1) == [
+            {
+                "id": "1",
+                "title": "title 1",
+                "likes_count": "1",
+                "likes_avg": "5.0",
+                "your_like_value": 5,
+            },
+            {
+                "id": "2",
+                "title": "title 2",
+                "likes_count": "3",
+                "likes_avg": "2.0",
+                "your_like_value": 2,
+            },
+            {
+                "id": "3",
+                "title": "title 3",
+                "likes_count": "0",
+                "likes_avg": "0.0",
+                "your_like_value": None,
+            },
+        ]
+
+    def test_build_without_user_likes(self):
+        self._get_cache().build(user_likes=False)
+        assert UserLikeCache(self.conn).get_watermark() is None
+        assert self.conn.exists("user:1:likes") == 0
+
+
+class TestContentCacheLikeScripts(TestCase):
+    writers = 8
+    likes_per_writer = 50
+
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        self.user = User.objects.create(id=1, username="user 1")
+        self.content = Content.objects.create(id=1, title="title 1", text="text 1")
+
+    def _get_like(self, value: int) -> Like:
+        return Like(content=self.content, user=self.user, value=value)
+
+    def _get_cache(self):
+        return get_content_cache(self.conn)
+
+    def _new_connection(self) -> Redis:
+        return Redis(**{**self.conn.connection_pool.connection_kwargs, "db": 15})
+
+    def test_content_liked(self):
+        cache = self._get_cache()
+        cache.content_liked(self._get_like(5))
+        cache.content_liked(self._get_like(2))
+        assert cache.list([self.content.id]) == [
+            {"id": "1", "title": "title 1", "likes_count": "2", "likes_avg": "3.5"},
+        ]
+
+    @override_settings(CONTENT_CACHE_READ_THROUGH=True)
+    def test_like_on_missing_content_is_filled_on_read(self):
+        cache = self._get_cache()
+        like = self._get_like(5)
+        cache.content_liked(like)
+        assert self.conn.exists(cache.get_key(id_=self.content.id)) == 0
+        Like.objects.bulk_create([like])
+        assert cache.list([self.content.id], user_id=self.user.id) == [
+            {
+                "id": "1",
+                "title": "title 1",
+                "likes_count": "1",
+                "likes_avg": "5.0",
+                "your_like_value": 5,
+            },
+        ]
+
+    def test_like_value_updated(self):
+        cache = self._get_cache()
+        cache.content_liked(self._get_like(5))
+        cache.content_liked(self._get_like(2))
+        like = self._get_like(2)
+        like.value = 4
+        with mock.patch.object(Like, "initial_value", return_value=2):
+            cache.like_value_updated(like)
+        assert cache.list([self.content.id]) == [
+            {"id": "1", "title": "title 1", "likes_count": "2", "likes_avg": "4.5"},
+        ]
+        assert self.conn.hgetall("user:1:likes") == {"1": "4"}
+
+    def test_like_value_updated_without_cached_likes(self):
+        cache = self._get_cache()
+        like = self._get_like(4)
+        with mock.patch.object(Like, "initial_value", return_value=2):
+            cache.like_value_updated(like)
+        assert cache.list([self.content.id]) == []
+
+    def test_parallel_likes_are_exact(self):
+        def like_many(value: int):
+            cache = get_content_cache(self._new_connection())
+            for _ in range(self.likes_per_writer):
+                cache.content_liked(self._get_like(value))
+
+        values = [i % 6 for i in range(self.writers)]
+        with ThreadPoolExecutor(max_workers=self.writers) as executor:
+            list(executor.map(like_many, values))
+
+        count = self.writers * self.likes_per_writer
+        avg = sum(values) * self.likes_per_writer / count
+        result = self._get_cache().list([self.content.id])
+        assert int(result[0]["likes_count"]) == count
+        assert math.isclose(float(result[0]["likes_avg"]), avg)
+
+    @override_settings(CONTENT_CACHE_GENERATION_TTL=60)
+    def test_one_round_trip_per_like(self):
+        cache = self._get_cache()
+        # first call may load the script into redis
+        cache.content_liked(self._get_like(1))
+        likes = 10
+        with mock.patch.object(
+            self.conn,
+            "execute_command",
+            wraps=self.conn.execute_command,
+        ) as execute_command:
+            for _ in range(likes):
+                cache.content_liked(self._get_like(1))
+        assert execute_command.call_count == likes
+
+    def test_generation_is_read_once_per_like(self):
+        cache = self._get_cache()
+        cache.content_liked(self._get_like(1))
+        with mock.patch.object(
+            self.conn,
+            "execute_command",
+            wraps=self.conn.execute_command,
+        ) as execute_command:
+            cache.content_liked(self._get_like(1))
+        assert [call.args[0] for call in execute_command.call_args_list] == [
+            "GET",
+            "EVALSHA",
+        ]
+
+
+@override_settings(CONTENT_CACHE_LAYOUT="bucket", CONTENT_CACHE_BUCKET_SIZE=2)
+class TestBucketedContentCache(TestContentCache):
+    def test_contents_are_grouped_in_buckets(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        assert self.conn.hgetall(cache.get_key(id_=2)) == {
+            "0t": "title 2",
+            "0c": "3",
+            "0s": "6",
+            "1t": "title 3",
+            "1c": "0",
+            "1s": "0",
+        }
+
+    def test_delete_many(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        cache.delete_many([2])
+        assert [item["id"] for item in cache.list(range(1, 10))] == ["1", "3"]
+
+
+@override_settings(CONTENT_CACHE_LAYOUT="bucket", CONTENT_CACHE_BUCKET_SIZE=2)
+class TestBucketedContentCacheLikeScripts(TestContentCacheLikeScripts):
+    def test_like_value_updated_without_cached_likes(self):
+        cache = self._get_cache()
+        like = self._get_like(4)
+        with mock.patch.object(Like, "initial_value", return_value=2):
+            cache.like_value_updated(like)
+        assert cache.list([self.content.id]) == []
+        assert self.conn.exists("content:b:0") == 0
+
+
+@override_settings(CONTENT_CACHE_CODEC="msgpack")
+class TestContentCacheMultiGet(TestContentCache):
+    def test_page_is_read_by_one_command(self):
+        pipe = self.conn.pipeline(transaction=False)
+        self._get_cache()._queue_multi_get(pipe, list(range(1, 10)))  # noqa: SLF001
+        assert len(pipe) == 1
+
+    def test_same_values_as_pipeline(self):
+        cache = self._get_cache()
+        cache.build()
+        pipeline_cache = get_content_cache(self.conn)
+        pipeline_cache.codec = None
+        assert cache.list(range(1, 10), user_id=2) == pipeline_cache.list(
+            range(1, 10),
+            user_id=2,
+        )
+
+
+@override_settings(
+    CONTENT_CACHE_CODEC="json",
+    CONTENT_CACHE_LAYOUT="bucket",
+    CONTENT_CACHE_BUCKET_SIZE=2,
+)
+class TestBucketedContentCacheMultiGet(TestContentCacheMultiGet):
+    pass
+
+
+class TestBenchmarkContentCache(TestCase):
+    def setUp(self):
+        self.conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": 14})
+        self.conn.flushdb()
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "benchmark_content_cache",
+            "--count=20",
+            "--db=14",
+            "--page-sizes",
+            "5",
+            "20",
+            "--iterations=10",
+            stdout=out,
+        )
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 6  # noqa: PLR2004
+        assert lines[0].startswith("hash pipeline 5 items: p50")
+        assert lines[-1].startswith("hash msgpack 20 items: p50")
+        assert self.conn.dbsize() == 0
+
+
+class TestCompareContentCacheMemory(TestCase):
+    def setUp(self):
+        self.conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": 14})
+        self.conn.flushdb()
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "compare_content_cache_memory",
+            "--count=100",
+            "--db=14",
+            stdout=out,
+        )
+        lines = out.getvalue().splitlines()
+        assert lines[0].startswith("hash: 100 keys")
+        assert lines[1].startswith("bucket: 4 keys")
+        assert self.conn.dbsize() == 0
+
+
+class TestContentCacheLikesAvgMigration(TestCase):
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        self.conn.hset(
+            "content:1",
+            mapping={"id": 1, "title": "title 1", "likes_count": 3, "likes_avg": 2.0},
+        )
+        self.conn.hset(
+            "content:2",
+            mapping={"id": 2, "title": "title 2", "likes_count": 3, "likes_sum": 4},
+        )
+        self.conn.set(Content.redis_max_id_key, 2)
+
+    def test_migrate_likes_avg(self):
+        cache = ContentCache(self.conn)
+        assert cache.migrate_likes_avg(batch_size=1) == 1
+        assert self.conn.hgetall("content:1") == {
+            "id": "1",
+            "title": "title 1",
+            "likes_count": "3",
+            "likes_sum": "6",
+        }
+        assert self.conn.hgetall("content:2")["likes_sum"] == "4"
+        assert self.conn.get(Content.redis_max_id_key) == "2"
+
+    def test_command_is_idempotent(self):
+        call_command("migrate_content_cache", stdout=StringIO())
+        call_command("migrate_content_cache", stdout=StringIO())
+        assert self.conn.hget("content:1", "likes_sum") == "6"
+
+    def test_like_migrates_old_hash(self):
+        user = User.objects.create(id=1, username="user 1")
+        content = Content.objects.create(id=1, title="title 1", text="text 1")
+        cache = ContentCache(self.conn)
+        cache.content_liked(Like(content=content, user=user, value=4))
+        assert cache.list([1]) == [
+            {"id": "1", "title": "title 1", "likes_count": "4", "likes_avg": "2.5"},
+        ]
+
+
+class TestLiveContentIds(TestCase):
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        # ids with gaps inside a byte and across many bytes of the bitmap
+        self.ids = [1, 3, 4, 9, 17, 1000, 1001, 5000]
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text=f"text {i}") for i in self.ids],
+        )
+
+    def test_before_build_all_ids_are_listed(self):
+        live_ids = LiveContentIds(self.conn)
+        assert live_ids.list(5, 10, limit=100) == [5, 6, 7, 8, 9]
+        assert live_ids.list(5, 10**12, limit=3) == [5, 6, 7]
+
+    def test_list(self):
+        live_ids = LiveContentIds(self.conn)
+        assert live_ids.build(batch_size=3) == 5000  # noqa: PLR2004
+        assert live_ids.list(0, 5001, limit=100) == self.ids
+        assert live_ids.list(4, 1001, limit=100) == [4, 9, 17, 1000]
+        assert live_ids.list(2, 5001, limit=3) == [3, 4, 9]
+        assert live_ids.list(10, 17, limit=100) == []
+        assert live_ids.list(-10, 2, limit=100) == [1]
+        # ids after the max id are not known to be missing
+        assert live_ids.list(4000, 10**12, limit=3) == [5000, 5001, 5002]
+
+    def test_add_and_remove(self):
+        live_ids = LiveContentIds(self.conn)
+        live_ids.build()
+        live_ids.add([5003, 5007])
+        live_ids.remove([1000, 17])
+        assert live_ids.list(10, 10**12, limit=4) == [1001, 5000, 5003, 5007]
+        assert live_ids.list(5008, 5010, limit=4) == [5008, 5009]
+
+    def test_rebuild_drops_deleted_ids(self):
+        live_ids = LiveContentIds(self.conn)
+        live_ids.build()
+        Content.objects.filter(id__gt=1000).delete()
+        assert live_ids.build() == 1000  # noqa: PLR2004
+        assert live_ids.list(0, 1003, limit=100) == [1, 3, 4, 9, 17, 1000, 1001, 1002]
+        Content.objects.all().delete()
+        assert live_ids.build() == 0
+        assert self.conn.exists(live_ids.key, live_ids.build_key) == 0
+
+    def test_content_cache_build(self):
+        cache = get_content_cache(self.conn)
+        cache.build(user_likes=False)
+        assert cache.live_ids.list(0, 10**12, limit=100)[: len(self.ids)] == self.ids
+        Content.objects.create(id=6000, title="title", text="text")
+        cache.build_incremental(user_likes=False)
+        assert cache.live_ids.list(5000, 10**12, limit=2) == [5000, 6000]
+
+    @override_settings(CONTENT_CACHE_READ_THROUGH=True)
+    def test_missed_content_is_removed_on_fill(self):
+        cache = get_content_cache(self.conn)
+        cache.live_ids.build()
+        Content.objects.filter(id=3).delete()
+        assert [item["id"] for item in cache.list([1, 3, 4])] == ["1", "4"]
+        assert cache.live_ids.list(0, 5, limit=100) == [1, 4]
+
+
+class TestContentWriteThrough(TestCase):
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        self.cache = get_content_cache(self.conn)
+
+    def _create(self, id_: int, title: str = "title") -> Content:
+        with self.captureOnCommitCallbacks(execute=True):
+            return Content.objects.create(id=id_, title=title, text="text")
+
+    def test_created_content_is_listed(self):
+        self._create(3)
+        self.cache.live_ids.build()
+        self._create(5)
+        assert self.cache.list([5]) == [
+            {"id": "5", "title": "title", "likes_count": "0", "likes_avg": "0.0"},
+        ]
+        assert self.cache.live_ids.list(0, 10**12, limit=2) == [3, 5]
+        assert self.conn.get(Content.redis_max_id_key) == "5"
+        # the max id is never lowered
+        self._create(4)
+        assert self.conn.get(Content.redis_max_id_key) == "5"
+
+    def test_likes_of_the_same_transaction_are_kept(self):
+        user = User.objects.create(id=1, username="user 1")
+        with self.captureOnCommitCallbacks(execute=True):
+            content = Content.objects.create(id=1, title="title", text="text")
+            Like.objects.create(content=content, user=user, value=4)
+        assert self.cache.list([1])[0]["likes_count"] == "1"
+
+    def test_rolled_back_content_is_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Content.objects.create(id=1, title="title", text="text")
+        assert callbacks
+        assert self.cache.list([1]) == []
+
+    def test_title_is_refreshed(self):
+        content = self._create(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            content.title = "new title"
+            content.save()
+        assert self.cache.list([1])[0]["title"] == "new title"
+        self.cache.delete_many([1])
+        with self.captureOnCommitCallbacks(execute=True):
+            content.title = "newer title"
+            content.save()
+        # a content which is not cached is not written partially
+        assert self.cache.list([1]) == []
+
+    def test_deleted_content_is_removed(self):
+        contents = [self._create(i) for i in range(1, 4)]
+        self.cache.live_ids.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            contents[0].delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            Content.objects.filter(id__gt=2).delete()
+        assert [item["id"] for item in self.cache.list(range(1, 4))] == ["2"]
+        assert self.cache.live_ids.list(0, 4, limit=10) == [2]
+
+
+@override_settings(CONTENT_CACHE_LAYOUT="bucket", CONTENT_CACHE_BUCKET_SIZE=2)
+class TestBucketedContentWriteThrough(TestContentWriteThrough):
+    pass
+
+
+@override_settings(CONTENT_CACHE_READ_THROUGH=True)
+class TestContentCacheSingleFlightFill(TransactionTestCase):
+    readers = 8
+
+    def setUp(self):
+        self.conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": 15})
+        self.conn.flushdb()
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text=f"text {i}") for i in range(1, 4)],
+        )
+
+    def test_concurrent_misses_are_filled_once(self):
+        def read():
+            try:
+                conn = Redis(**self.conn.connection_pool.connection_kwargs)
+                return get_content_cache(conn).list(range(1, 4))
+            finally:
+                connections.close_all()
+
+        with (
+            mock.patch.object(
+                BaseCache,
+                "set_many",
+                autospec=True,
+                side_effect=BaseCache.set_many,
+            ) as set_many,
+            ThreadPoolExecutor(self.readers) as executor,
+        ):
+            results = list(executor.map(lambda _: read(), range(self.readers)))
+        assert set_many.call_count == 1
+        assert all(len(result) == 3 for result in results)  # noqa: PLR2004
+
+
+class TestWarmContentCache(TransactionTestCase):
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        User.objects.bulk_create(
+            [User(id=i, username=f"user {i}") for i in range(1, 4)],
+        )
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text=f"text {i}") for i in range(1, 21)],
+        )
+        Like.objects.bulk_create(
+            [Like(content_id=i, user_id=i % 3 + 1, value=i % 6) for i in range(1, 21)],
+        )
+
+    def test_split_id_range(self):
+        assert split_id_range(1, 10, 3) == [(1, 5), (5, 9), (9, 11)]
+        assert split_id_range(5, 5, 4) == [(5, 6)]
+        assert split_id_range(1, 2, 4) == [(1, 2), (2, 3)]
+
+    def test_warm_content_cache(self):
+        out = StringIO()
+        # workers open their own connections on the test redis db
+        connection_kwargs = {**self.conn.connection_pool.connection_kwargs, "db": 15}
+        with mock.patch.dict(
+            self.conn.connection_pool.connection_kwargs,
+            connection_kwargs,
+        ):
+            call_command("warm_content_cache", "--processes=2", stdout=out)
+        assert "40 rows in" in out.getvalue()
+        cache = ContentCache(self.conn)
+        result = cache.list(range(1, 21), user_id=2)
+        assert len(result) == 20  # noqa: PLR2004
+        assert result[0] == {
+            "id": "1",
+            "title": "title 1",
+            "likes_count": "1",
+            "likes_avg": "1.0",
+            "your_like_value": 1,
+        }
+        assert cache.get_watermark() is not None
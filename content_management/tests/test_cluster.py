@@ -0,0 +1,198 @@
+import os
+import time
+from unittest import skipUnless
+
+from django.test import TestCase
+from django.test import override_settings
+from redis.cluster import RedisCluster
+
+from blog.users.models import User
+from config.settings.base import redis
+from content_management.auditors import ContentCacheAuditor
+from content_management.caches import get_content_cache
+from content_management.cluster import group_by_slot
+from content_management.cluster import new_connection
+from content_management.like_stream import LikeStream
+from content_management.local_cache import LocalCache
+from content_management.models import Content
+from content_management.models import Like
+
+# e.g. redis://localhost:7000 of docker-compose.redis-cluster.yml
+REDIS_CLUSTER_TEST_URL = os.environ.get("REDIS_CLUSTER_TEST_URL")
+
+
+class TestGroupBySlot(TestCase):
+    def test_one_group_without_cluster(self):
+        assert group_by_slot(redis, ["a", "b", "c"]) == [[0, 1, 2]]
+        assert group_by_slot(redis, []) == []
+
+
+@skipUnless(REDIS_CLUSTER_TEST_URL, "REDIS_CLUSTER_TEST_URL is not set")
+@override_settings(CONTENT_CACHE_HASH_TAG_SIZE=4, CONTENT_CACHE_CODEC="msgpack")
+class TestClusterContentCache(TestCase):
+    def setUp(self):
+        self.conn = RedisCluster.from_url(
+            REDIS_CLUSTER_TEST_URL,
+            decode_responses=True,
+        )
+        self.conn.flushall()
+        User.objects.bulk_create(
+            [User(id=i, username=f"user {i}") for i in range(1, 3)],
+        )
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text=f"text {i}") for i in range(1, 11)],
+        )
+        Like.objects.bulk_create(
+            [
+                Like(content_id=1, user_id=1, value=5),
+                Like(content_id=1, user_id=2, value=3),
+                Like(content_id=9, user_id=1, value=1),
+            ],
+        )
+
+    def tearDown(self):
+        self.conn.flushall()
+        self.conn.close()
+
+    def _get_cache(self):
+        return get_content_cache(self.conn)
+
+    def test_keys_of_a_tag_share_a_slot(self):
+        cache = self._get_cache()
+        keys = [cache.get_key(id_=id_) for id_ in range(1, 11)]
+        assert len(group_by_slot(self.conn, keys)) == 3  # noqa: PLR2004
+        assert len({self.conn.keyslot(key) for key in keys[:3]}) == 1
+
+    def test_list(self):
+        cache = self._get_cache()
+        cache.build()
+        data = cache.list(range(1, 12), user_id=1)
+        assert [item["id"] for item in data] == [str(i) for i in range(1, 11)]
+        assert data[0] == {
+            "id": "1",
+            "title": "title 1",
+            "likes_count": "2",
+            "likes_avg": "4.0",
+            "your_like_value": 5,
+        }
+        assert data[8]["your_like_value"] == 1
+        cache.codec = None
+        assert cache.list(range(1, 12), user_id=1) == data
+
+    def test_like_scripts(self):
+        cache = self._get_cache()
+        cache.build()
+        content = Content.objects.get(id=2)
+        user = User.objects.get(id=2)
+        like = Like(content=content, user=user, value=4)
+        cache.content_liked(like)
+        assert cache.list([2], user_id=2)[0]["your_like_value"] == 4  # noqa: PLR2004
+        like.value = 2
+        like._initial_state = {"value": 4}  # noqa: SLF001
+        cache.like_value_updated(like)
+        assert cache.list([2], user_id=2)[0] == {
+            "id": "2",
+            "title": "title 2",
+            "likes_count": "1",
+            "likes_avg": "2.0",
+            "your_like_value": 2,
+        }
+
+    def test_like_received(self):
+        cache = self._get_cache()
+        cache.build()
+        like = Like(content_id=2, user_id=2, value=4)
+        assert cache.like_received(like, LikeStream.key)
+        like.value = 2
+        assert not cache.like_received(like, LikeStream.key, past_value=4)
+        assert cache.list([2], user_id=2)[0] == {
+            "id": "2",
+            "title": "title 2",
+            "likes_count": "1",
+            "likes_avg": "2.0",
+            "your_like_value": 2,
+        }
+        assert self.conn.xlen(LikeStream.key) == 2  # noqa: PLR2004
+
+    def test_likes_received(self):
+        cache = self._get_cache()
+        cache.build()
+        limited = Like(content_id=3, user_id=2, value=1)
+        limited.state = Like.StateChoice.RATE_LIMITED
+        likes = [
+            Like(content_id=2, user_id=2, value=4),
+            limited,
+            Like(content_id=1, user_id=1, value=1),
+        ]
+        assert cache.likes_received(likes, LikeStream.key, [None, None, 5]) == [
+            True,
+            True,
+            False,
+        ]
+        assert cache.list([2], user_id=2)[0]["your_like_value"] == 4  # noqa: PLR2004
+        assert cache.list([3])[0]["likes_count"] == "0"
+        assert [
+            fields["content_id"] for _, fields in self.conn.xrange(LikeStream.key)
+        ] == ["2", "3", "1"]
+
+    def test_likes_saved(self):
+        cache = self._get_cache()
+        cache.build()
+        created = Like(content=Content(id=2, title="title 2"), user_id=2, value=4)
+        updated = Like.objects.get(content_id=1, user_id=1)
+        updated.value = 1
+        cache.likes_saved([created], [updated])
+        first, second = cache.list([1, 2], user_id=1)
+        assert (first["likes_avg"], first["your_like_value"]) == ("2.0", 1)
+        assert cache.list([2], user_id=2)[0]["your_like_value"] == 4  # noqa: PLR2004
+        assert (second["likes_count"], second["likes_avg"]) == ("1", "4.0")
+
+    def test_content_lifecycle(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        cache.content_created(Content(id=11, title="title 11"))
+        cache.content_updated(Content(id=11, title="new title"))
+        assert cache.list([11])[0]["title"] == "new title"
+        assert self.conn.get(Content.redis_max_id_key) == "11"
+        cache.contents_deleted([10, 11])
+        assert cache.list([10, 11]) == []
+        assert cache.live_ids.list(9, 12, limit=10) == [9]
+
+    def test_local_cache_is_invalidated(self):
+        local_cache = LocalCache(max_size=10, ttl=60)
+        cache = get_content_cache(new_connection(self.conn), local_cache=local_cache)
+        try:
+            cache.build(user_likes=False)
+            assert cache.list([1])[0]["likes_count"] == "2"
+            generation = local_cache.generation
+            cache.content_liked(
+                Like(content=Content(id=1, title="title 1"), user_id=1, value=4),
+            )
+            deadline = time.monotonic() + 5
+            while local_cache.generation == generation:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert cache.list([1])[0]["likes_count"] == "3"
+        finally:
+            local_cache.unsubscribe()
+
+    def test_auditor_repairs_cache(self):
+        cache = self._get_cache()
+        cache.build(user_likes=False)
+        self.conn.hset(cache.get_key(id_=1), cache.get_field(1, "likes_count"), 7)
+        self.conn.unlink(cache.get_key(id_=10))
+        auditor = ContentCacheAuditor(cache)
+        report = auditor.audit(auditor.get_all_ids(), repair=True)
+        assert report.drifted == 1
+        assert report.repaired == 2  # noqa: PLR2004
+        assert auditor.audit(auditor.get_all_ids()).drifted == 0
+
+
+@override_settings(CONTENT_CACHE_LAYOUT="bucket", CONTENT_CACHE_BUCKET_SIZE=2)
+class TestClusterBucketedContentCache(TestClusterContentCache):
+    def test_keys_of_a_tag_share_a_slot(self):
+        cache = self._get_cache()
+        keys = [cache.get_key(id_=id_) for id_ in range(1, 11)]
+        assert len(group_by_slot(self.conn, keys)) == 3  # noqa: PLR2004
+        # 2 and 3 are in the same bucket
+        assert keys[1] == keys[2]
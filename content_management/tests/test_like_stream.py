@@ -0,0 +1,225 @@
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse_lazy
+from redis.client import Pipeline
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from blog.users.models import User
+from config.settings.base import redis
+from content_management.caches import ContentCache
+from content_management.caches import LiveContentIds
+from content_management.like_stream import LikeStream
+from content_management.like_stream import apply_likes
+from content_management.like_stream import get_entry_time
+from content_management.models import Content
+from content_management.models import Like
+from content_management.rate_limiter import RateLimit
+
+
+def _get_entry(user_id: int, content_id: int, value: int, seconds: float = 0, **kw):
+    entry_id = f"{int((time.time() + seconds) * 1000)}-0"
+    state = kw.get("state", Like.StateChoice.OK)
+    return entry_id, {
+        "user_id": str(user_id),
+        "content_id": str(content_id),
+        "value": str(value),
+        "state": str(state),
+    }
+
+
+@override_settings(LIKE_WRITE_BEHIND=True)
+class TestLikeWriteBehind(TestCase):
+    url = reverse_lazy("api:like-content")
+
+    def setUp(self):
+        redis.select(15)
+        redis.flushdb()
+        self.user = User.objects.create_user("user 1", password="12345")  # noqa: S106
+        self.content = Content.objects.create(id=1, title="title", text="text")
+        self.cache = ContentCache(redis)
+        self.cache.build()
+        self.client = APIClient()
+        self.client.login(username="user 1", password="12345")  # noqa: S106
+
+    def _flush(self) -> str:
+        out = StringIO()
+        call_command("flush_likes", "--once", stdout=out)
+        return out.getvalue()
+
+    def test_like_is_written_behind_the_cache(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data={"content": 1, "value": 3})
+        # only the session and the user are read
+        assert not [
+            query
+            for query in queries
+            if "content_management_like" in query["sql"]
+            or "content_management_content" in query["sql"]
+        ]
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json() == {"content": 1, "value": 3}
+        assert self.cache.list([1])[0]["likes_count"] == "1"
+        assert not Like.objects.exists()
+        assert self._flush() == "1 likes flushed\n"
+        like = Like.objects.get()
+        assert (like.user_id, like.content_id, like.value) == (self.user.id, 1, 3)
+
+        response = self.client.post(self.url, data={"content": 1, "value": 5})
+        assert response.status_code == status.HTTP_200_OK
+        assert self.cache.list([1])[0]["likes_avg"] == "5.0"
+        self._flush()
+        like = Like.objects.get()
+        assert like.value == 5  # noqa: PLR2004
+        assert redis.xlen(LikeStream.key) == 0
+
+    @mock.patch.object(Like, "get_rate_limiter")
+    def test_rate_limited_like(self, mocked_get_rate_limiter):
+        mocked_get_rate_limiter.return_value.consume.return_value = RateLimit(
+            limited=True,
+            remaining=0,
+            retry_after=1,
+            rule="user",
+        )
+        response = self.client.post(self.url, data={"content": 1, "value": 3})
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response["X-RateLimit-Rule"] == "user"
+        assert self.cache.list([1])[0]["likes_count"] == "0"
+        self._flush()
+        assert Like.objects.get().state == Like.StateChoice.RATE_LIMITED
+
+    def test_bulk_round_trips_do_not_grow_with_likes(self):
+        Content.objects.bulk_create(
+            [Content(id=i, title="title", text="text") for i in range(2, 41)],
+        )
+        self.cache.build()
+        stream = LikeStream(redis)
+
+        def count_round_trips(content_ids: range) -> int:
+            likes = [Like(user=self.user, content_id=i, value=3) for i in content_ids]
+            with (
+                mock.patch.object(
+                    redis,
+                    "execute_command",
+                    wraps=redis.execute_command,
+                ) as execute_command,
+                mock.patch.object(
+                    Pipeline,
+                    "execute",
+                    autospec=True,
+                    side_effect=Pipeline.execute,
+                ) as execute,
+            ):
+                assert stream.receive_many(likes) == [True] * len(likes)
+            return execute_command.call_count + execute.call_count
+
+        # the first call may load the scripts into redis
+        count_round_trips(range(1, 3))
+        assert count_round_trips(range(3, 5)) == count_round_trips(range(5, 41))
+        assert redis.xlen(LikeStream.key) == 40  # noqa: PLR2004
+        assert self.cache.list([40])[0]["likes_count"] == "1"
+
+    def test_missing_content(self):
+        Content.objects.create(id=3, title="title", text="text")
+        LiveContentIds(redis).build()
+        response = self.client.post(self.url, data={"content": 2, "value": 3})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_content_is_checked_in_database_until_live_ids_are_built(self):
+        redis.flushdb()
+        response = self.client.post(self.url, data={"content": 2, "value": 3})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = self.client.post(self.url, data={"content": 1, "value": 3})
+        assert response.status_code == status.HTTP_201_CREATED
+        # a content created after the build is not known to the live ids
+        Content.objects.create(id=5, title="title", text="text")
+        LiveContentIds(redis).build()
+        Content.objects.create(id=6, title="title", text="text")
+        response = self.client.post(self.url, data={"content": 6, "value": 3})
+        assert response.status_code == status.HTTP_201_CREATED
+        response = self.client.post(self.url, data={"content": 7, "value": 3})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestApplyLikes(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(id=1, username="user 1")
+        self.content = Content.objects.create(id=1, title="title", text="text")
+
+    def test_applying_again_is_harmless(self):
+        entries = [
+            _get_entry(1, 1, 3, seconds=-0.3),
+            _get_entry(1, 1, 4, seconds=-0.2),
+            _get_entry(1, 1, 1, seconds=-0.1, state=Like.StateChoice.RATE_LIMITED),
+        ]
+        assert apply_likes(entries) == 2  # noqa: PLR2004
+        assert apply_likes(entries) == 0
+        assert Like.objects.get(state=Like.StateChoice.OK).value == 4  # noqa: PLR2004
+        assert Like.objects.filter(state=Like.StateChoice.RATE_LIMITED).count() == 1
+
+    def test_older_entry_does_not_override_like(self):
+        Like.objects.create(user=self.user, content=self.content, value=5)
+        assert apply_likes([_get_entry(1, 1, 3, seconds=-10)]) == 0
+        assert apply_likes([_get_entry(1, 1, 2, seconds=10)]) == 1
+        assert Like.objects.get().value == 2  # noqa: PLR2004
+
+    def test_like_is_updated_by_a_later_batch(self):
+        created, updated = (
+            _get_entry(1, 1, 3, seconds=-10),
+            _get_entry(1, 1, 4, seconds=-5),
+        )
+        assert apply_likes([created]) == 1
+        # the like has the time of its entry, not the one of the flush
+        assert Like.objects.get().updated_at == get_entry_time(created[0])
+        assert apply_likes([updated]) == 1
+        like = Like.objects.get()
+        assert like.value == 4  # noqa: PLR2004
+        assert like.updated_at == get_entry_time(updated[0])
+
+    def test_like_written_to_database_meanwhile_is_not_a_conflict(self):
+        # e.g. by a worker which did not write likes behind yet
+        Like.objects.create(user=self.user, content=self.content, value=5)
+        Content.objects.create(id=2, title="title", text="text")
+        entries = [
+            _get_entry(1, 1, 3, seconds=10),
+            _get_entry(1, 1, 4, seconds=11),
+            _get_entry(1, 2, 1, seconds=11),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            assert apply_likes(entries) == 2  # noqa: PLR2004
+        assert not [query for query in queries if "advisory" in query["sql"]]
+        assert dict(Like.objects.values_list("content_id", "value")) == {1: 4, 2: 1}
+
+    def test_entries_of_missing_rows_are_dropped(self):
+        entries = [_get_entry(1, 2, 3), _get_entry(2, 1, 3), _get_entry(1, 1, 3)]
+        assert apply_likes(entries) == 1
+        assert Like.objects.count() == 1
+
+
+class TestLikeStream(TestCase):
+    def setUp(self):
+        redis.select(15)
+        redis.flushdb()
+        User.objects.create(id=1, username="user 1")
+        Content.objects.create(id=1, title="title", text="text")
+        self.stream = LikeStream(redis, min_idle=timedelta(0))
+        self.stream.create_group()
+        # the group is created once
+        self.stream.create_group()
+
+    def test_likes_of_a_dead_worker_are_taken_over(self):
+        redis.xadd(LikeStream.key, _get_entry(1, 1, 3)[1])
+        assert len(self.stream.read("dead")) == 1
+        assert not Like.objects.exists()
+        assert self.stream.flush("alive") == 1
+        assert Like.objects.get().value == 3  # noqa: PLR2004
+        assert redis.xpending(LikeStream.key, LikeStream.group)["pending"] == 0
+        assert self.stream.flush("alive") == 0
@@ -0,0 +1,104 @@
+import time
+
+from django.test import TestCase
+from redis import Redis
+
+from blog.users.models import User
+from config.settings.base import redis
+from content_management.caches import ContentCache
+from content_management.local_cache import LocalCache
+from content_management.models import Content
+from content_management.models import Like
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLocalCache(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LocalCache(max_size=2, ttl=1, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        assert self.cache.get("a") is None
+        self.cache.set_many({"a": {"id": "1"}})
+        assert self.cache.get("a") == {"id": "1"}
+        assert self.cache.stats()["hits"] == 1
+        assert self.cache.stats()["misses"] == 1
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set_many({"a": {"id": "1"}, "b": {"id": "2"}})
+        self.cache.get("a")
+        self.cache.set_many({"c": {"id": "3"}})
+        assert self.cache.get("b") is None
+        assert self.cache.get("a") == {"id": "1"}
+        assert self.cache.stats()["evictions"] == 1
+
+    def test_ttl_expiration(self):
+        self.cache.set_many({"a": {"id": "1"}})
+        self.clock.now = 1
+        assert self.cache.get("a") is None
+        assert self.cache.stats()["expirations"] == 1
+
+    def test_invalidate(self):
+        self.cache.set_many({"a": {"id": "1"}, "b": {"id": "2"}})
+        self.cache.invalidate("a")
+        assert self.cache.get("a") is None
+        assert self.cache.get("b") == {"id": "2"}
+        self.cache.clear()
+        assert len(self.cache) == 0
+
+    def test_values_read_before_invalidation_are_ignored(self):
+        generation = self.cache.generation
+        self.cache.invalidate("a")
+        self.cache.set_many({"a": {"id": "1"}}, generation=generation)
+        assert self.cache.get("a") is None
+
+
+class TestContentCacheWithLocalCache(TestCase):
+    def setUp(self):
+        # pub/sub takes its own connection, so the pool must be on the test db
+        self.conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": 15})
+        self.conn.flushdb()
+        self.local_cache = LocalCache(max_size=10, ttl=60)
+        self.cache = ContentCache(self.conn, local_cache=self.local_cache)
+        self.user = User.objects.create(id=1, username="user 1")
+        self.content = Content.objects.create(id=1, title="title 1", text="text 1")
+
+    def tearDown(self):
+        self.local_cache.unsubscribe()
+
+    def _wait_for_invalidation(self, generation: int):
+        deadline = time.monotonic() + 5
+        while self.local_cache.generation == generation:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    def test_hits_do_not_reach_redis(self):
+        self.cache.content_liked(Like(content=self.content, user=self.user, value=4))
+        assert self.cache.list([1, 2]) == self.cache.list([1, 2])
+        assert self.local_cache.stats()["hits"] == 1
+        # missing keys are not cached
+        assert self.local_cache.stats()["misses"] == 3  # noqa: PLR2004
+
+    def test_like_invalidates_local_cache(self):
+        like = Like(content=self.content, user=self.user, value=4)
+        self.cache.content_liked(like)
+        assert self.cache.list([1])[0]["likes_count"] == "1"
+        generation = self.local_cache.generation
+        self.cache.content_liked(like)
+        self._wait_for_invalidation(generation)
+        assert self.cache.list([1])[0]["likes_count"] == "2"
+
+    def test_build_invalidates_local_cache(self):
+        self.cache.content_liked(Like(content=self.content, user=self.user, value=4))
+        self.cache.list([1])
+        generation = self.local_cache.generation
+        self.cache.build()
+        self._wait_for_invalidation(generation)
+        assert self.cache.list([1])[0]["likes_count"] == "0"
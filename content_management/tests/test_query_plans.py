@@ -0,0 +1,177 @@
+import json
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from blog.users.models import User
+from config.settings.base import redis
+from content_management.caches import ContentCache
+from content_management.caches import UserLikeCache
+from content_management.like_stream import APPLY_LIKES_SQL
+from content_management.models import UPSERT_LIKE_SQL
+from content_management.models import UPSERT_LIKES_SQL
+from content_management.models import Content
+from content_management.models import Like
+
+USERS = 1000
+CONTENTS = 20_000
+LIKES_PER_USER = 50
+
+
+def get_seq_scans(plan: dict) -> list[str]:
+    """Tables read by sequential scans in an EXPLAIN (FORMAT JSON) plan,
+    an index scan without an index condition reads the whole table too
+    """
+    tables = []
+    if plan.get("Node Type") == "Seq Scan" or (
+        plan.get("Node Type") in ("Index Scan", "Index Only Scan")
+        and "Index Cond" not in plan
+    ):
+        tables.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables += get_seq_scans(child)
+    return tables
+
+
+class TestQueryPlans(TestCase):
+    """Hot queries must keep using indexes on a realistic dataset,
+    a sequential scan of likes or contents fails the test
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create(
+            [User(id=i, username=f"user {i}") for i in range(1, USERS + 1)],
+        )
+        with connection.cursor() as cursor:
+            # each user likes distinct contents, one like in 20 is rate
+            # limited and likes and contents are changed a month ago,
+            # except for the last ones
+            cursor.execute(
+                f"""
+                INSERT INTO {Content._meta.db_table} (id, title, text, updated_at)
+                SELECT
+                    i,
+                    'title ' || i,
+                    'text ' || i,
+                    CASE WHEN i > %(old)s
+                    THEN now() ELSE now() - interval '30 days' END
+                FROM generate_series(1, %(contents)s) i;
+                INSERT INTO {Like._meta.db_table}
+                (user_id, content_id, value, state, updated_at)
+                SELECT
+                    u,
+                    (u * 7919 + k * 104729) %% %(contents)s + 1,
+                    (u + k) %% 6,
+                    CASE WHEN k %% 20 = 0 THEN %(rate_limited)s ELSE %(ok)s END,
+                    CASE WHEN u * k > %(old_likes)s
+                    THEN now() ELSE now() - interval '30 days' END
+                FROM generate_series(1, %(users)s) u,
+                generate_series(1, %(likes_per_user)s) k;
+                ANALYZE {Content._meta.db_table};
+                ANALYZE {Like._meta.db_table};
+                """,  # noqa: SLF001
+                {
+                    "old": CONTENTS - 10,
+                    "contents": CONTENTS,
+                    "rate_limited": Like.StateChoice.RATE_LIMITED,
+                    "ok": Like.StateChoice.OK,
+                    "old_likes": USERS * LIKES_PER_USER - 100,
+                    "users": USERS,
+                    "likes_per_user": LIKES_PER_USER,
+                },
+            )
+        # deferred foreign keys of the likes are checked once,
+        # instead of after each test
+        connection.check_constraints()
+
+    def setUp(self):
+        self.since = timezone.now() - timedelta(hours=1)
+
+    def _explain(self, sql: str, params) -> dict:
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def assert_no_seq_scan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        plan = self._explain(sql, params)
+        assert not get_seq_scans(plan), json.dumps(plan, indent=2)
+
+    def test_full_scan_is_found(self):
+        plan = self._explain(
+            *Like.objects.filter(value=1).query.sql_with_params(),
+        )
+        assert get_seq_scans(plan) == [Like._meta.db_table]  # noqa: SLF001
+        plan = self._explain(
+            *Content.objects.order_by("id").query.sql_with_params(),
+        )
+        assert get_seq_scans(plan) == [Content._meta.db_table]  # noqa: SLF001
+
+    def test_like_upsert(self):
+        plan = self._explain(
+            UPSERT_LIKE_SQL,
+            {"user_id": 1, "content_id": 1, "value": 1, "updated_at": self.since},
+        )
+        assert not get_seq_scans(plan), json.dumps(plan, indent=2)
+
+    def test_bulk_like_upsert(self):
+        plan = self._explain(
+            UPSERT_LIKES_SQL,
+            {
+                "user_ids": [1] * 500,
+                "content_ids": list(range(1, 501)),
+                "values": [1] * 500,
+                "updated_at": self.since,
+            },
+        )
+        assert not get_seq_scans(plan), json.dumps(plan, indent=2)
+
+    def test_rate_limited_likes_of_stream_entries(self):
+        self.assert_no_seq_scan(
+            Like.objects.filter(
+                user_id__in=range(1, 100),
+                content_id__in=range(1, 1000),
+                state=Like.StateChoice.RATE_LIMITED,
+            ).values_list("user_id", "content_id", "updated_at"),
+        )
+
+    def test_stream_entries_upsert(self):
+        plan = self._explain(
+            APPLY_LIKES_SQL,
+            [
+                list(range(1, 501)),
+                list(range(1, 501)),
+                [1] * 500,
+                [Like.StateChoice.OK] * 500,
+                [self.since] * 500,
+            ],
+        )
+        assert not get_seq_scans(plan), json.dumps(plan, indent=2)
+
+    def test_content_cache_fill(self):
+        cache = ContentCache(redis)
+        self.assert_no_seq_scan(cache._get_data().filter(id__in=range(1, 21)))  # noqa: SLF001
+
+    def test_content_cache_build_range(self):
+        cache = ContentCache(redis)
+        self.assert_no_seq_scan(
+            cache._get_data().filter(id__gte=1, id__lt=1001).order_by("id"),  # noqa: SLF001
+        )
+
+    def test_content_cache_build_incremental(self):
+        cache = ContentCache(redis)
+        self.assert_no_seq_scan(
+            cache._get_changed_data(since=self.since).order_by("id"),  # noqa: SLF001
+        )
+
+    def test_user_like_cache_build_incremental(self):
+        cache = UserLikeCache(redis)
+        self.assert_no_seq_scan(
+            cache._get_changed_data(since=self.since).order_by("id"),  # noqa: SLF001
+        )
@@ -0,0 +1,597 @@
+import functools
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.management import call_command
+from django.test import TestCase
+from django.test import override_settings
+from redis import Redis
+
+from config.settings.base import redis
+from content_management.admin import RateLimitRuleAdmin
+from content_management.models import RateLimitRule
+from content_management.rate_limiter import RATE_LIMITERS
+from content_management.rate_limiter import CompositeRateLimiter
+from content_management.rate_limiter import GCRARateLimiter
+from content_management.rate_limiter import LeasingRateLimiter
+from content_management.rate_limiter import LimitRule
+from content_management.rate_limiter import RateLimitRules
+from content_management.rate_limiter import SlidingWindowRateLimiter
+from content_management.rate_limiter import TokenBucketRateLimiter
+from content_management.tests.test_local_cache import FakeClock
+
+
+class TestTokenBucketRateLimiter(TestCase):
+    key = "like:rate-limiter:content_id:1"
+    limiter_class = TokenBucketRateLimiter
+
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+
+    def _get_limiter(self, conn: Redis | None = None, **kwargs):
+        return self.limiter_class(conn or self.conn, **kwargs)
+
+    def test_burst_is_limited(self):
+        limiter = self._get_limiter(limit_count=3)
+        results = [limiter.consume(self.key) for _ in range(4)]
+        assert [result.limited for result in results] == [False, False, False, True]
+        assert math.isclose(results[0].remaining, 2, abs_tol=0.01)
+        # a token is refilled every 20 seconds
+        assert 19 < results[-1].retry_after <= 20  # noqa: PLR2004
+        key = f"{self.key}{limiter.key_suffix}"
+        assert 0 < self.conn.pttl(key) <= 120_000  # noqa: PLR2004
+
+    def test_tokens_are_refilled_continuously(self):
+        limiter = self._get_limiter(
+            limit_count=2,
+            limit_period=timedelta(milliseconds=100),
+        )
+        assert not limiter.is_limited(self.key)
+        assert not limiter.is_limited(self.key)
+        assert limiter.is_limited(self.key)
+        time.sleep(0.06)
+        # one token is refilled in 50ms, not the whole bucket
+        assert not limiter.is_limited(self.key)
+        assert limiter.is_limited(self.key)
+
+    def test_take_and_give_back(self):
+        limiter = self._get_limiter(limit_count=3)
+        assert limiter.take(self.key, 5) == 3  # noqa: PLR2004
+        assert limiter.is_limited(self.key)
+        limiter.give_back(self.key, 2)
+        assert not limiter.is_limited(self.key)
+        assert not limiter.is_limited(self.key)
+        assert limiter.is_limited(self.key)
+        # unused tokens can not raise the limit
+        limiter.give_back(self.key, 10)
+        assert limiter.take(self.key, 5) == 3  # noqa: PLR2004
+
+    def test_counter_of_fixed_window_is_replaced(self):
+        self.conn.set(self.key, 0, ex=60)
+        limiter = self._get_limiter(limit_count=3)
+        assert not limiter.is_limited(self.key)
+        assert self.conn.type(self.key) == "hash"
+
+    def test_parallel_clients_do_not_over_admit(self):
+        limit_count = 50
+        clients = 8
+
+        def like(_):
+            conn = Redis(**{**self.conn.connection_pool.connection_kwargs, "db": 15})
+            limiter = self._get_limiter(conn, limit_count=limit_count)
+            return sum(not limiter.is_limited(self.key) for _ in range(20))
+
+        with ThreadPoolExecutor(clients) as executor:
+            admitted = sum(executor.map(like, range(clients)))
+        # 160 likes in well under the 1.2 seconds which refill a token
+        assert admitted == limit_count
+
+
+class TestGCRARateLimiter(TestTokenBucketRateLimiter):
+    limiter_class = GCRARateLimiter
+
+    def test_counter_of_fixed_window_is_replaced(self):
+        """Keys of other algorithms are not shared"""
+        self.conn.set(self.key, 0, ex=60)
+        limiter = self._get_limiter(limit_count=3)
+        assert not limiter.is_limited(self.key)
+        assert self.conn.type(f"{self.key}:gcra") == "string"
+
+
+class TestSlidingWindowRateLimiter(TestGCRARateLimiter):
+    limiter_class = SlidingWindowRateLimiter
+
+    def _get_window(self, period: int) -> tuple[int, float]:
+        """Current window and the part of it which is left"""
+        seconds, microseconds = self.conn.time()
+        now = seconds * 1000 + microseconds / 1000
+        window = int(now // period)
+        return window, ((window + 1) * period - now) / period
+
+    def test_burst_is_limited(self):
+        limiter = self._get_limiter(limit_count=3)
+        results = [limiter.consume(self.key) for _ in range(4)]
+        assert [result.limited for result in results] == [False, False, False, True]
+        assert math.isclose(results[0].remaining, 2, abs_tol=0.01)
+        # the current window must become the previous one,
+        # then a third of it must slide out
+        assert 20 < results[-1].retry_after <= 80  # noqa: PLR2004
+
+    def test_tokens_are_refilled_continuously(self):
+        period = 3_600_000
+        window, left = self._get_window(period)
+        self.conn.hset(f"{self.key}:sliding", window - 1, 100)
+        limiter = self._get_limiter(limit_count=100, limit_period=timedelta(hours=1))
+        admitted = sum(not limiter.is_limited(self.key) for _ in range(100))
+        # requests of the previous window are weighted by the part left of it
+        assert abs(admitted - 100 * (1 - left)) <= 1
+
+    def test_counter_of_fixed_window_is_replaced(self):
+        self.conn.set(self.key, 0, ex=60)
+        limiter = self._get_limiter(limit_count=3)
+        assert not limiter.is_limited(self.key)
+        assert self.conn.type(f"{self.key}:sliding") == "hash"
+
+    def test_counts_of_old_windows_are_removed(self):
+        window, _ = self._get_window(60_000)
+        key = f"{self.key}:sliding"
+        self.conn.hset(key, mapping={window - 5: 1, window - 1: 1})
+        assert not self._get_limiter(limit_count=3).is_limited(self.key)
+        assert self.conn.hgetall(key) == {str(window - 1): "1", str(window): "1"}
+
+
+class TestLeasingRateLimiter(TestCase):
+    key = "like:rate-limiter:content_id:1"
+
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+        self.clock = FakeClock()
+
+    def _get_limiter(self, limit_count: int = 100) -> LeasingRateLimiter:
+        return LeasingRateLimiter(
+            TokenBucketRateLimiter(self.conn, limit_count=limit_count),
+            max_lease=10,
+            lease_ttl=1,
+            clock=self.clock,
+        )
+
+    def _get_tokens(self) -> float:
+        return float(self.conn.hget(self.key, "tokens"))
+
+    def test_hot_key_is_decided_locally(self):
+        limiter = self._get_limiter()
+        with mock.patch.object(
+            limiter.limiter,
+            "_script",
+            wraps=limiter.limiter._script,  # noqa: SLF001
+        ) as script:
+            assert not any(limiter.is_limited(self.key) for _ in range(100))
+        # leases of 2, 4, 8 and then 10 tokens
+        assert script.call_count == 13  # noqa: PLR2004
+        assert self._get_tokens() < 1
+
+    def test_unused_tokens_are_given_back(self):
+        limiter = self._get_limiter()
+        for _ in range(4):
+            limiter.is_limited(self.key)
+        # 2 + 4 tokens are leased
+        assert math.isclose(self._get_tokens(), 94, abs_tol=0.01)
+        self.clock.now = 2
+        limiter.is_limited(self.key)
+        # 2 unused tokens are given back and a lease of 2 is taken
+        assert math.isclose(self._get_tokens(), 94, abs_tol=0.01)
+        limiter.release()
+        assert math.isclose(self._get_tokens(), 95, abs_tol=0.01)
+
+    def test_no_lease_is_empty(self):
+        limiter = self._get_limiter(limit_count=3)
+        admitted = [not limiter.is_limited(self.key) for _ in range(5)]
+        assert admitted == [True, True, True, False, False]
+        assert not limiter._leases  # noqa: SLF001
+
+    def test_expired_leases_are_swept(self):
+        limiter = self._get_limiter()
+        keys = [f"like:rate-limiter:content_id:{i}" for i in range(2, 12)]
+        for key in keys:
+            limiter.is_limited(key)
+        assert len(limiter._leases) == 10  # noqa: PLR2004, SLF001
+        self.clock.now = 2
+        limiter.is_limited(self.key)
+        # only the lease of the last decision is kept
+        assert list(limiter._leases) == [self.key]  # noqa: SLF001
+        # and the unused token of every other lease is given back
+        for key in keys:
+            assert math.isclose(float(self.conn.hget(key, "tokens")), 99, abs_tol=0.01)
+
+    def test_limit_of_workers_is_respected(self):
+        workers = [self._get_limiter(limit_count=50) for _ in range(4)]
+        admitted = sum(
+            not worker.is_limited(self.key) for _ in range(40) for worker in workers
+        )
+        assert admitted == 50  # noqa: PLR2004
+        # every leased token was used, none is given back
+        for worker in workers:
+            worker.release()
+        assert self._get_tokens() < 1
+
+    def _get_composite_limiter(self) -> LeasingRateLimiter:
+        return LeasingRateLimiter(
+            CompositeRateLimiter(
+                self.conn,
+                rules=[
+                    LimitRule(
+                        name="content",
+                        key="content_id:{content_id}",
+                        limit_count=1000,
+                        limit_period=timedelta(minutes=1),
+                    ),
+                    LimitRule(
+                        name="user",
+                        key="user_id:{user_id}",
+                        limit_count=3,
+                        limit_period=timedelta(minutes=1),
+                    ),
+                ],
+            ),
+            max_lease=10,
+            lease_ttl=1,
+            leased_rules={"content"},
+            clock=self.clock,
+        )
+
+    def test_hot_content_is_leased_for_all_users(self):
+        limiter = self._get_composite_limiter()
+        content_key = "like:rate-limiter:content_id:1"
+        with mock.patch.object(
+            limiter.limiter,
+            "_script",
+            wraps=limiter.limiter._script,  # noqa: SLF001
+        ) as script:
+            assert not any(
+                limiter.is_limited((("content_id", 1), ("user_id", user_id)))
+                for user_id in range(200)
+            )
+        content_calls = [
+            call for call in script.call_args_list if content_key in call.kwargs["keys"]
+        ]
+        # leases of 2, 4, 8 and then 10 tokens, the user rule is decided
+        # by one call per like
+        assert len(content_calls) == 22  # noqa: PLR2004
+        assert script.call_count == 200 + 22
+        assert float(self.conn.hget(content_key, "tokens")) < 800  # noqa: PLR2004
+
+    def test_rejected_request_takes_no_leased_tokens(self):
+        limiter = self._get_composite_limiter()
+        key = (("content_id", 1), ("user_id", 1))
+        decisions = [limiter.consume(key) for _ in range(4)]
+        assert [limit.rule for limit in decisions] == [None, None, None, "user"]
+        # 2 + 4 tokens are leased and 3 are used
+        (lease,) = limiter._leases.values()  # noqa: SLF001
+        assert lease.tokens == 3  # noqa: PLR2004
+
+
+class TestCompositeRateLimiter(TestCase):
+    def setUp(self):
+        redis.select(15)
+        self.conn = redis
+        self.conn.flushdb()
+
+    def _get_limiter(self, algorithm: str = "token_bucket") -> CompositeRateLimiter:
+        return CompositeRateLimiter(
+            self.conn,
+            rules=[
+                LimitRule(
+                    name="user",
+                    key="user_id:{user_id}",
+                    limit_count=3,
+                    limit_period=timedelta(minutes=1),
+                ),
+                LimitRule(
+                    name="ip",
+                    key="ip:{ip}",
+                    limit_count=5,
+                    limit_period=timedelta(minutes=1),
+                ),
+                LimitRule(
+                    name="global",
+                    key="global",
+                    limit_count=6,
+                    limit_period=timedelta(minutes=1),
+                ),
+            ],
+            algorithm=algorithm,
+        )
+
+    def test_every_rule_is_decided_in_one_call(self):
+        limiter = self._get_limiter()
+        with mock.patch.object(
+            limiter,
+            "_script",
+            wraps=limiter._script,  # noqa: SLF001
+        ) as script:
+            limit = limiter.consume((("user_id", 1), ("ip", "10.0.0.1")))
+        assert script.call_count == 1
+        assert not limit.limited
+        # the fewest tokens of the rules
+        assert math.isclose(limit.remaining, 2, abs_tol=0.01)
+
+    def test_rejecting_rule_is_reported(self):
+        limiter = self._get_limiter()
+        decisions = [
+            limiter.consume((("user_id", user_id), ("ip", "10.0.0.1")))
+            for user_id in (1, 1, 1, 1, 2, 2, 2)
+        ]
+        assert [limit.rule for limit in decisions] == [
+            None,
+            None,
+            None,
+            "user",
+            None,
+            None,
+            "ip",
+        ]
+        assert decisions[3].retry_after > 0
+
+    def test_rejected_request_takes_no_tokens(self):
+        limiter = self._get_limiter()
+        for _ in range(3):
+            limiter.consume((("user_id", 1), ("ip", "10.0.0.1")))
+        # requests limited by the user rule take no tokens of the ip rule
+        for _ in range(10):
+            assert limiter.is_limited((("user_id", 1), ("ip", "10.0.0.1")))
+        assert not limiter.is_limited((("user_id", 2), ("ip", "10.0.0.1")))
+        assert not limiter.is_limited((("user_id", 3), ("ip", "10.0.0.1")))
+        assert not limiter.is_limited((("user_id", 4), ("ip", "10.0.0.2")))
+        assert limiter.consume((("user_id", 4), ("ip", "10.0.0.2"))).rule == "global"
+
+    def test_many_keys_are_decided_in_one_round_trip(self):
+        limiter = self._get_limiter()
+        keys = [
+            (("user_id", user_id), ("ip", "10.0.0.1"))
+            for user_id in (1, 1, 1, 1, 2, 2, 2)
+        ]
+        with mock.patch.object(
+            self.conn,
+            "pipeline",
+            wraps=self.conn.pipeline,
+        ) as pipeline:
+            decisions = limiter.consume_many(keys)
+        assert pipeline.call_count == 1
+        # as decided one by one
+        assert [limit.rule for limit in decisions] == [
+            None,
+            None,
+            None,
+            "user",
+            None,
+            None,
+            "ip",
+        ]
+
+    def test_rule_without_values_is_skipped(self):
+        limiter = self._get_limiter()
+        for _ in range(6):
+            assert not limiter.is_limited((("user_id", None), ("ip", None)))
+        assert limiter.consume((("user_id", None), ("ip", None))).rule == "global"
+
+    def test_algorithms(self):
+        for algorithm in RATE_LIMITERS:
+            self.conn.flushdb()
+            limiter = self._get_limiter(algorithm)
+            admitted = [
+                not limiter.is_limited((("user_id", 1), ("ip", "10.0.0.1")))
+                for _ in range(4)
+            ]
+            assert admitted == [True, True, True, False], algorithm
+
+    def test_take_and_give_back(self):
+        limiter = self._get_limiter()
+        key = (("user_id", 1), ("ip", "10.0.0.1"))
+        # the user rule has the fewest tokens
+        assert limiter.take(key, 10) == 3  # noqa: PLR2004
+        limiter.give_back(key, 2)
+        assert limiter.take(key, 10) == 2  # noqa: PLR2004
+
+    def test_keys_share_a_hash_tag_in_a_cluster(self):
+        with mock.patch(
+            "content_management.rate_limiter.is_cluster",
+            return_value=True,
+        ):
+            limiter = self._get_limiter()
+        keys = [
+            key
+            for key, *_ in limiter._get_limits(  # noqa: SLF001
+                (("user_id", 1), ("ip", "10.0.0.1")),
+            )
+        ]
+        assert keys == [
+            "{like}:rate-limiter:user_id:1",
+            "{like}:rate-limiter:ip:10.0.0.1",
+            "{like}:rate-limiter:global",
+        ]
+
+
+@override_settings(
+    RATE_LIMITS={
+        "like": [
+            {
+                "name": "content",
+                "key": "content_id:{content_id}",
+                "limit_count": 100,
+                "limit_period": 60,
+            },
+            {
+                "name": "global",
+                "key": "global",
+                "limit_count": 1000,
+                "limit_period": 60,
+            },
+        ],
+    },
+)
+class TestRateLimitRules(TestCase):
+    def setUp(self):
+        # pub/sub takes its own connection, so the pool must be on the test db
+        self.conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": 15})
+        self.conn.flushdb()
+        self.clock = FakeClock()
+        self.rules = RateLimitRules(
+            self.conn,
+            "like",
+            defaults=settings.RATE_LIMITS["like"],
+            ttl=60,
+            clock=self.clock,
+        )
+
+    def tearDown(self):
+        self.rules.unsubscribe()
+
+    def _get_limits(self) -> dict[str, int]:
+        return {rule.name: rule.limit_count for rule in self.rules.get()}
+
+    def _save(self, rule: RateLimitRule):
+        with (
+            mock.patch.object(
+                RateLimitRule,
+                "publish",
+                side_effect=functools.partial(RateLimitRule.publish, conn=self.conn),
+            ),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            rule.save()
+
+    def _wait_for(self, limits: dict[str, int]):
+        deadline = time.monotonic() + 5
+        while self._get_limits() != limits:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    def test_defaults_of_settings(self):
+        assert self._get_limits() == {"content": 100, "global": 1000}
+        with mock.patch.object(self.conn, "hget") as hget:
+            for _ in range(10):
+                self.rules.get()
+        # lookups are served by the worker until the ttl
+        hget.assert_not_called()
+
+    def test_changes_are_applied_on_notification(self):
+        self._get_limits()
+        self._save(RateLimitRule(name="global", key="global", limit_count=10))
+        self._wait_for({"content": 100, "global": 10})
+        self._save(
+            RateLimitRule(
+                name="content 42",
+                key="throttled:content_id:{content_id}",
+                conditions={"content_id": 42},
+                limit_count=1,
+            ),
+        )
+        self._wait_for({"content": 100, "global": 10, "content 42": 1})
+        # a disabled rule removes the default of the same name
+        self._save(
+            RateLimitRule(
+                name="content",
+                key="content_id:{content_id}",
+                limit_count=100,
+                enabled=False,
+            ),
+        )
+        self._wait_for({"global": 10, "content 42": 1})
+
+    def test_rules_are_read_from_database_if_redis_lost_them(self):
+        with mock.patch.object(RateLimitRule, "publish"):
+            RateLimitRule.objects.create(name="global", key="global", limit_count=10)
+        assert self._get_limits() == {"content": 100, "global": 10}
+        assert self.conn.hexists("rate-limiter:rules", "like")
+
+    def test_bulk_delete_is_published_on_commit(self):
+        with mock.patch.object(RateLimitRule, "publish") as publish:
+            RateLimitRule.objects.create(name="global", key="global", limit_count=10)
+            with self.captureOnCommitCallbacks() as callbacks:
+                RateLimitRuleAdmin(RateLimitRule, admin.site).delete_queryset(
+                    None,
+                    RateLimitRule.objects.all(),
+                )
+            publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+        publish.assert_called_once_with("like")
+
+    def test_rules_are_read_again_after_ttl(self):
+        self._get_limits()
+        self.conn.hset(
+            "rate-limiter:rules",
+            "like",
+            json.dumps(
+                [
+                    {
+                        "name": "global",
+                        "key": "global",
+                        "limit_count": 5,
+                        "limit_period": 1,
+                    },
+                ],
+            ),
+        )
+        assert self._get_limits() == {"content": 100, "global": 1000}
+        self.clock.now = 60
+        assert self._get_limits() == {"content": 100, "global": 5}
+
+    def test_rule_applies_only_to_its_values(self):
+        self.conn.hset(
+            "rate-limiter:rules",
+            "like",
+            json.dumps(
+                [
+                    {
+                        "name": "content 42",
+                        "key": "throttled:content_id:{content_id}",
+                        "conditions": {"content_id": 42},
+                        "limit_count": 1,
+                        "limit_period": 60,
+                    },
+                ],
+            ),
+        )
+        limiter = CompositeRateLimiter(self.conn, rules=self.rules)
+        assert not limiter.is_limited((("content_id", 42),))
+        assert limiter.consume((("content_id", 42),)).rule == "content 42"
+        assert not limiter.is_limited((("content_id", 43),))
+        assert not limiter.is_limited((("content_id", 43),))
+
+
+class TestBenchmarkRateLimiters(TestCase):
+    def setUp(self):
+        self.conn = Redis(**{**redis.connection_pool.connection_kwargs, "db": 14})
+        self.conn.flushdb()
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "benchmark_rate_limiters",
+            "--keys=20",
+            "--db=14",
+            "--limit-count=10",
+            stdout=out,
+        )
+        lines = out.getvalue().splitlines()
+        assert [line.split(":")[0] for line in lines] == [
+            "token_bucket",
+            "gcra",
+            "sliding_window",
+        ]
+        for line in lines:
+            assert "commands per decision" in line
+            assert "10 of 20 burst requests admitted" in line
+        assert self.conn.dbsize() == 0
@@ -0,0 +1,111 @@
+from unittest import mock
+
+from django.test import TestCase
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import NoScriptError
+
+from config.settings.base import redis
+from content_management.caches import ContentCache
+from content_management.caches import LiveContentIds
+from content_management.codecs import get_codec
+from content_management.replicas import ReplicaRouter
+from content_management.tests.test_local_cache import FakeClock
+
+
+def _get_replica(offset: int, link: str = "up") -> mock.Mock:
+    replica = mock.Mock()
+    replica.info.return_value = {
+        "master_link_status": link,
+        "slave_repl_offset": offset,
+    }
+    return replica
+
+
+class TestReplicaRouter(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.primary = mock.Mock()
+        self._set_primary_offset(100)
+
+    def _set_primary_offset(self, offset: int):
+        self.primary.info.return_value = {"master_repl_offset": offset}
+
+    def _get_router(self, *replicas) -> ReplicaRouter:
+        return ReplicaRouter(
+            self.primary,
+            list(replicas),
+            max_lag=1,
+            check_interval=1,
+            clock=self.clock,
+        )
+
+    def test_without_replicas_primary_is_used(self):
+        router = self._get_router()
+        assert router.get_read_connection() is self.primary
+        self.primary.info.assert_not_called()
+
+    def test_replicas_are_used_in_round_robin(self):
+        first, second = _get_replica(100), _get_replica(120)
+        router = self._get_router(first, second)
+        assert [router.get_read_connection() for _ in range(4)] == [
+            first,
+            second,
+            first,
+            second,
+        ]
+        # health is checked once per interval
+        assert self.primary.info.call_count == 1
+
+    def test_lagging_replica_is_not_used(self):
+        replica = _get_replica(50)
+        router = self._get_router(replica)
+        assert router.get_read_connection() is self.primary
+        # it has every write made before the previous check
+        self.clock.now = 1
+        self._set_primary_offset(200)
+        replica.info.return_value["slave_repl_offset"] = 100
+        assert router.get_read_connection() is replica
+        # the previous check is older than max lag now
+        self.clock.now = 2
+        self._set_primary_offset(300)
+        assert router.get_read_connection() is self.primary
+
+    def test_replica_with_broken_link_is_not_used(self):
+        router = self._get_router(_get_replica(100, link="down"))
+        assert router.get_read_connection() is self.primary
+
+    def test_unreachable_replica_is_not_used(self):
+        replica = _get_replica(100)
+        replica.info.side_effect = RedisConnectionError
+        router = self._get_router(replica)
+        assert router.get_read_connection() is self.primary
+
+    def test_read_falls_back_to_primary(self):
+        replica = _get_replica(100)
+        replica.get.side_effect = RedisConnectionError
+        self.primary.get.return_value = "12"
+        router = self._get_router(replica)
+        assert router.read(lambda conn: conn.get("content:max_id")) == "12"
+        # it is skipped until the next check
+        assert router.get_read_connection() is self.primary
+        self.clock.now = 1
+        assert router.get_read_connection() is replica
+
+
+class TestReplicaReads(TestCase):
+    def test_multi_get_is_read_only_on_replicas(self):
+        replica = mock.Mock()
+        for read_conn, command in ((replica, "EVAL_RO"), (None, "EVAL")):
+            cache = ContentCache(redis, codec=get_codec("json"), read_conn=read_conn)
+            pipe = redis.pipeline(transaction=False)
+            cache._queue_multi_get(pipe, [1, 2])  # noqa: SLF001
+            (args, _), *_ = pipe.command_stack
+            assert args[0] == command
+
+    def test_live_ids_are_listed_read_only_on_replicas(self):
+        replica = mock.Mock()
+        replica.evalsha_ro.side_effect = NoScriptError
+        replica.eval_ro.return_value = [1, 3]
+        assert LiveContentIds(replica, read_only=True).list(1, 11, limit=10) == [1, 3]
+        replica.evalsha_ro.assert_called_once()
+        replica.eval_ro.assert_called_once()
@@ -1,6 +1,17 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from unittest import mock
 
+import pytest
+from django.conf import settings
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse_lazy
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -8,9 +19,13 @@ from rest_framework.test import APIClient
 from blog.users.models import User
 from config.settings.base import redis
 from content_management.caches import ContentCache
+from content_management.caches import LiveContentIds
+from content_management.like_stream import LikeStream
 from content_management.models import Content
 from content_management.models import Like
-from content_management.rate_limiter import TokenBucketRateLimiter
+from content_management.rate_limiter import CompositeRateLimiter
+from content_management.rate_limiter import LimitRule
+from content_management.rate_limiter import RateLimit
 
 
 class TestContentAPIView(TestCase):
@@ -29,7 +44,7 @@ class TestContentAPIView(TestCase):
                 "id": f"{i}",
                 "title": f"title {i}",
                 "likes_count": f"{2 * i}",
-                "likes_avg": f"{i}",
+                "likes_avg": f"{float(i)}",
             }
             for i in range(1, 6)
         ]
@@ -38,7 +53,13 @@ class TestContentAPIView(TestCase):
         for item in self._get_data():
             redis.hset(
                 f'content:{item["id"]}',
-                mapping=item,
+                mapping={
+                    "id": item["id"],
+                    "title": item["title"],
+                    "likes_count": item["likes_count"],
+                    "likes_sum": int(item["likes_count"])
+                    * int(float(item["likes_avg"])),
+                },
             )
 
     @staticmethod
@@ -64,6 +85,17 @@ class TestContentAPIView(TestCase):
             "items": self._get_data(),
         }
 
+    def test_created_content_is_on_the_default_page(self):
+        ContentCache(redis).build()
+        for i in range(1, 13):
+            with self.captureOnCommitCallbacks(execute=True):
+                Content.objects.create(id=i, title=f"title {i}", text="text")
+        response = self.client.get(self.url)
+        assert (response.json()["from"], response.json()["to"]) == (3, 13)
+        assert [item["id"] for item in response.json()["items"]] == [
+            f"{i}" for i in range(3, 13)
+        ]
+
     def test_pagination(self):
         self._build_cache()
         response = self.client.get(self.url + "?from=2&to=5")
@@ -74,6 +106,39 @@ class TestContentAPIView(TestCase):
             "items": self._get_data()[1:4],
         }
 
+    def test_ids_known_to_be_missing_are_skipped(self):
+        self._build_cache()
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text="text") for i in range(1, 6)],
+        )
+        Content.objects.create(id=10**6, title="title", text="text")
+        LiveContentIds(redis).build()
+        redis.delete("content:2")
+        fetch = ContentCache._fetch  # noqa: SLF001
+        with mock.patch.object(
+            ContentCache,
+            "_fetch",
+            autospec=True,
+            side_effect=fetch,
+        ) as m:
+            response = self.client.get(self.url + "?from=3&to=1000")
+        assert response.json() == {
+            "from": "3",
+            "to": "1000",
+            "items": self._get_data()[2:5],
+        }
+        assert m.call_args.args[1] == [3, 4, 5]
+
+    @override_settings(CONTENT_PAGE_MAX_SIZE=2)
+    def test_page_is_limited(self):
+        self._build_cache()
+        response = self.client.get(self.url + "?from=1&to=1000000000")
+        assert response.json() == {
+            "from": "1",
+            "to": 3,
+            "items": self._get_data()[:2],
+        }
+
     def test_user_like_value(self):
         content = Content.objects.create(id=1, title="title", text="text")
         Like.objects.create(user=self.user, content=content, value=5)
@@ -94,6 +159,23 @@ class TestContentAPIView(TestCase):
             ],
         }
 
+    def test_authenticated_user_makes_no_db_query(self):
+        self._build_cache()
+        redis.hset(f"user:{self.user.id}:likes", mapping={1: 4, 3: 0})
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        assert response.status_code == status.HTTP_200_OK
+        # only savepoints of the atomic request are executed
+        assert all("SAVEPOINT" in query["sql"] for query in context.captured_queries)
+        assert [item["your_like_value"] for item in response.json()["items"]] == [
+            4,
+            None,
+            0,
+            None,
+            None,
+        ]
+
     def test_anonymous_user_can_not_create_content(self):
         response = self.client.post(self.url, data=self._get_post_body())
         assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -158,12 +240,71 @@ class TestLikeContentAPIView(TestCase):
             },
         ]
 
-    @mock.patch.object(Like, "get_rate_limiter")
-    def test_rate_limited_likes(self, mocked_get_rate_limiter):
-        mocked_get_rate_limiter.return_value = TokenBucketRateLimiter(
+    def test_like_is_saved_by_one_statement(self):
+        self._login()
+        for value, status_code in (
+            (3, status.HTTP_201_CREATED),
+            (1, status.HTTP_200_OK),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    self.url,
+                    data={"content": 1, "value": value},
+                )
+            assert response.status_code == status_code
+            assert (
+                len(
+                    [
+                        query
+                        for query in queries
+                        if "content_management_like" in query["sql"]
+                    ],
+                )
+                == 1
+            )
+        like = Like.objects.get()
+        assert like.value == 1
+        assert self.cache.list([1])[0]["likes_avg"] == "1.0"
+
+    def test_one_active_like_per_user_and_content(self):
+        # rate limited likes are not unique
+        Like.objects.bulk_create(
+            [
+                Like(content=self.content, user=self.user, value=5, state=state)
+                for state in (
+                    Like.StateChoice.OK,
+                    Like.StateChoice.RATE_LIMITED,
+                    Like.StateChoice.RATE_LIMITED,
+                )
+            ],
+        )
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Like.objects.bulk_create(
+                [Like(content=self.content, user=self.user, value=3)],
+            )
+
+    def _get_rate_limiter(self, **limit_counts) -> CompositeRateLimiter:
+        return CompositeRateLimiter(
             self.conn,
-            limit_count=3,
+            rules=[
+                LimitRule(
+                    name=name,
+                    key=key,
+                    limit_count=limit_counts[name],
+                    limit_period=timedelta(minutes=1),
+                )
+                for name, key in (
+                    ("content", "content_id:{content_id}"),
+                    ("user", "user_id:{user_id}"),
+                    ("ip", "ip:{ip}"),
+                )
+                if name in limit_counts
+            ],
         )
+
+    @mock.patch.object(Like, "get_rate_limiter")
+    def test_rate_limited_likes(self, mocked_get_rate_limiter):
+        mocked_get_rate_limiter.return_value = self._get_rate_limiter(content=3)
         for i in range(1, 6):
             username = f"username {i}"
             password = f"password {i}"
@@ -183,3 +324,203 @@ class TestLikeContentAPIView(TestCase):
         ]
         assert Like.objects.filter(state=Like.StateChoice.OK).count() == 3  # noqa: PLR2004
         assert Like.objects.filter(state=Like.StateChoice.RATE_LIMITED).count() == 2  # noqa: PLR2004
+
+    @mock.patch.object(Like, "get_rate_limiter")
+    def test_rejecting_rule_is_reported(self, mocked_get_rate_limiter):
+        mocked_get_rate_limiter.return_value = self._get_rate_limiter(
+            content=10,
+            user=10,
+            ip=2,
+        )
+        for i in range(2, 5):
+            Content.objects.create(id=i, title="title", text="text")
+        self._login()
+        responses = [
+            self.client.post(self.url, data={"content": i, "value": 1})
+            for i in range(1, 5)
+        ]
+        assert "X-RateLimit-Rule" not in responses[1]
+        assert responses[2]["X-RateLimit-Rule"] == "ip"
+        assert int(responses[2]["Retry-After"]) > 0
+        assert Like.objects.filter(state=Like.StateChoice.OK).count() == 2  # noqa: PLR2004
+        # rejected likes took no tokens of the other limits
+        other_ip = self.client.post(
+            self.url,
+            data={"content": 4, "value": 1},
+            REMOTE_ADDR="10.0.0.1",
+        )
+        assert "X-RateLimit-Rule" not in other_ip
+
+    @mock.patch.object(Like, "get_rate_limiter")
+    def test_clients_behind_a_proxy_are_limited_apart(self, mocked_get_rate_limiter):
+        mocked_get_rate_limiter.return_value = self._get_rate_limiter(ip=1)
+        for i in range(2, 5):
+            Content.objects.create(id=i, title="title", text="text")
+        self._login()
+
+        def post(content_id: int, **headers) -> str | None:
+            response = self.client.post(
+                self.url,
+                data={"content": content_id, "value": 1},
+                REMOTE_ADDR="10.0.0.1",
+                **headers,
+            )
+            return response.get("X-RateLimit-Rule")
+
+        # the proxy appends the address of the client to the forged one
+        assert post(1, HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2") is None
+        assert post(2, HTTP_X_FORWARDED_FOR="3.3.3.3") is None
+        assert post(3, HTTP_X_FORWARDED_FOR="2.2.2.2") == "ip"
+        with override_settings(CLIENT_IP_HEADER="HTTP_X_REAL_IP"):
+            assert post(4, HTTP_X_REAL_IP="4.4.4.4") is None
+
+
+class TestBulkLikeContentAPIView(TestCase):
+    url = reverse_lazy("api:like-content-bulk")
+
+    def setUp(self):
+        self.user = User.objects.create_user("user 1", password="12345")  # noqa: S106
+        for i in range(1, 4):
+            Content.objects.create(id=i, title=f"title {i}", text="text")
+        redis.select(15)
+        redis.flushdb()
+        self.cache = ContentCache(redis)
+        self.cache.build()
+        self.client = APIClient()
+        self.client.login(username="user 1", password="12345")  # noqa: S106
+
+    def _post(self, likes: list[tuple[int, int]]):
+        return self.client.post(
+            self.url,
+            data={"likes": [{"content": c, "value": v} for c, v in likes]},
+            format="json",
+        )
+
+    def test_likes_are_saved_in_bulk(self):
+        like = Like.objects.create(content_id=1, user=self.user, value=5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post([(1, 3), (2, 4), (9, 1), (2, 2)])
+        # contents and one upsert
+        assert (
+            len(
+                [
+                    query
+                    for query in queries
+                    if "content_management_like" in query["sql"]
+                    or "content_management_content" in query["sql"]
+                ],
+            )
+            == 2  # noqa: PLR2004
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert [item["status"] for item in response.json()["items"]] == [
+            "updated",
+            "created",
+            "not-found",
+            "updated",
+        ]
+        like.refresh_from_db()
+        assert like.value == 3  # noqa: PLR2004
+        assert Like.objects.get(content_id=2).value == 2  # noqa: PLR2004
+        first, second = self.cache.list([1, 2])
+        assert (first["likes_count"], first["likes_avg"]) == ("1", "3.0")
+        assert (second["likes_count"], second["likes_avg"]) == ("1", "2.0")
+        assert self.cache.list([2], user_id=self.user.id)[0]["your_like_value"] == 2  # noqa: PLR2004
+
+    @mock.patch.object(Like, "get_rate_limiter")
+    def test_rate_limited_likes(self, mocked_get_rate_limiter):
+        mocked_get_rate_limiter.return_value = CompositeRateLimiter(
+            redis,
+            rules=[
+                LimitRule(
+                    name="user",
+                    key="user_id:{user_id}",
+                    limit_count=2,
+                    limit_period=timedelta(minutes=1),
+                ),
+            ],
+        )
+        response = self._post([(1, 1), (2, 2), (3, 3), (3, 4)])
+        assert [item["status"] for item in response.json()["items"]] == [
+            "created",
+            "created",
+            "rate-limited",
+            "rate-limited",
+        ]
+        assert Like.objects.filter(state=Like.StateChoice.OK).count() == 2  # noqa: PLR2004
+        assert Like.objects.get(state=Like.StateChoice.RATE_LIMITED).content_id == 3  # noqa: PLR2004
+        assert self.cache.list([3])[0]["likes_count"] == "0"
+
+    @override_settings(LIKE_WRITE_BEHIND=True)
+    def test_likes_are_written_behind(self):
+        assert [item["status"] for item in self._post([(1, 3)]).json()["items"]] == [
+            "created",
+        ]
+        # the like of content 1 is pending in the stream, it is not created again
+        response = self._post([(1, 4), (2, 1)])
+        assert [item["status"] for item in response.json()["items"]] == [
+            "updated",
+            "created",
+        ]
+        assert not Like.objects.exists()
+        assert redis.xlen(LikeStream.key) == 3  # noqa: PLR2004
+        first, second = self.cache.list([1, 2])
+        assert (first["likes_count"], first["likes_avg"]) == ("1", "4.0")
+        assert (second["likes_count"], second["likes_avg"]) == ("1", "1.0")
+
+    def test_bulk_replay_is_admitted_by_default_rules(self):
+        Content.objects.bulk_create(
+            [Content(id=i, title=f"title {i}", text="text") for i in range(4, 201)],
+        )
+        response = self._post([(i, 1) for i in range(1, 201)])
+        assert {item["status"] for item in response.json()["items"]} == {"created"}
+        assert not Like.objects.filter(state=Like.StateChoice.RATE_LIMITED).exists()
+
+    def test_invalid_items(self):
+        assert self._post([(1, 6)]).status_code == status.HTTP_400_BAD_REQUEST
+        assert self._post([]).status_code == status.HTTP_400_BAD_REQUEST
+        response = self._post([(1, 1)] * (settings.LIKE_BULK_MAX_SIZE + 1))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Like.objects.exists()
+
+
+@mock.patch.object(Like, "get_cache")
+@mock.patch.object(Like, "get_rate_limiter")
+class TestConcurrentBulkLikes(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(id=1, username="user 1")
+        for i in range(1, 3):
+            Content.objects.create(id=i, title=f"title {i}", text="text")
+
+    def test_like_committed_meanwhile_is_updated(
+        self,
+        mocked_get_rate_limiter,
+        mocked_get_cache,
+    ):
+        mocked_get_rate_limiter.return_value.consume_many.side_effect = lambda keys: [
+            RateLimit(limited=False, remaining=1, retry_after=0) for _ in keys
+        ]
+
+        def upsert():
+            try:
+                return Like.upsert_many(
+                    [
+                        Like(user_id=1, content_id=1, value=3),
+                        Like(user_id=1, content_id=2, value=4),
+                    ],
+                )
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(1) as executor, transaction.atomic():
+            Like.objects.bulk_create([Like(user_id=1, content_id=1, value=5)])
+            result = executor.submit(upsert)
+            # the upsert waits for the like, which is committed meanwhile
+            time.sleep(0.3)
+        assert result.result() == [False, True]
+        assert dict(
+            Like.objects.filter(state=Like.StateChoice.OK).values_list(
+                "content_id",
+                "value",
+            ),
+        ) == {1: 3, 2: 4}
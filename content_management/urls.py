@@ -1,5 +1,6 @@
 from django.urls import path
 
+from content_management.views import BulkLikeContentAPIView
 from content_management.views import ContentAPIView
 from content_management.views import LikeContentAPIView
 
@@ -7,4 +8,9 @@ app_name = "content_management"
 urlpatterns = [
     path("content/", view=ContentAPIView.as_view(), name="content"),
     path("like-content/", view=LikeContentAPIView.as_view(), name="like-content"),
+    path(
+        "like-content/bulk/",
+        view=BulkLikeContentAPIView.as_view(),
+        name="like-content-bulk",
+    ),
 ]
@@ -1,15 +1,31 @@
+import math
+
+from django.conf import settings
 from rest_framework import permissions
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from blog.users.models import User
 from config.settings.base import redis
-from content_management.caches import ContentCache
+from content_management.caches import LiveContentIds
+from content_management.caches import get_content_cache
+from content_management.caches import get_local_cache
 from content_management.models import Content
-from content_management.models import Like
+from content_management.replicas import get_replica_router
+from content_management.serializers import BulkLikeSerializer
 from content_management.serializers import ContentSerializer
 from content_management.serializers import LikeContentSerializer
+from content_management.serializers import LikeWriteBehindSerializer
+
+
+def get_client_ip(request) -> str | None:
+    """Address of the client, as told by the trusted proxy in front of the app"""
+    if settings.CLIENT_IP_HEADER:
+        return request.META.get(settings.CLIENT_IP_HEADER) or None
+    if forwarded_for := request.META.get("HTTP_X_FORWARDED_FOR"):
+        # the proxy appends the address it was connected from
+        return forwarded_for.rsplit(",", 1)[-1].strip() or None
+    return request.META.get("REMOTE_ADDR")
 
 
 class ContentAPIView(APIView):
@@ -24,27 +40,35 @@ class ContentAPIView(APIView):
         self.from_ = request.GET.get("from")
         self.to = request.GET.get("to")
         if self.from_ is None or self.to is None:
-            self.to = max(redis.get(Content.redis_max_id_key) or 11, 11)
+            max_id = get_replica_router().read(
+                lambda conn: conn.get(Content.redis_max_id_key),
+            )
+            # to is exclusive, so the newest content is on the page
+            self.to = max(int(max_id or 0) + 1, 11)
             self.from_ = max(self.to - 10, 1)
-        return range(int(self.from_), int(self.to))
-
-    @staticmethod
-    def _add_user_values(user: User, data: list[dict]):
-        # TODO: it can be moved to the cache layer for the performance sake!
-        ids = [content["id"] for content in data]
-        likes = Like.objects.filter(user_id=user.id, content_id__in=ids).values(
-            "content_id",
-            "value",
+        # ids known to be missing are skipped without a lookup
+        ids = get_replica_router().read(
+            lambda conn: LiveContentIds(conn, read_only=conn is not redis).list(
+                int(self.from_),
+                int(self.to),
+                limit=settings.CONTENT_PAGE_MAX_SIZE,
+            ),
         )
-        likes = {like["content_id"]: like["value"] for like in likes}
-        for content in data:
-            content["your_like_value"] = likes.get(int(content["id"]), None)
+        if len(ids) == settings.CONTENT_PAGE_MAX_SIZE and ids[-1] + 1 < int(self.to):
+            self.to = ids[-1] + 1
+        return ids
 
     def get(self, request):
-        cache = ContentCache(redis)
-        data = cache.list(ids=self.get_ids(request))
-        if request.user.is_authenticated:
-            self._add_user_values(request.user, data)
+        ids = self.get_ids(request)
+        # like values of the user are fetched in the same round trip
+        user_id = request.user.id if request.user.is_authenticated else None
+        data = get_replica_router().read(
+            lambda conn: get_content_cache(
+                redis,
+                local_cache=get_local_cache(),
+                read_conn=conn,
+            ).list(ids=ids, user_id=user_id),
+        )
         data = {
             "items": data,
             "from": self.from_,
@@ -62,11 +86,40 @@ class ContentAPIView(APIView):
 class LikeContentAPIView(APIView):
     serializer_class = LikeContentSerializer
 
+    def get_serializer_class(self):
+        if settings.LIKE_WRITE_BEHIND:
+            return LikeWriteBehindSerializer
+        return self.serializer_class
+
+    def post(self, request):
+        serializer = self.get_serializer_class()(
+            data=request.data,
+            context={
+                "user_id": request.user.id,
+                "client_ip": get_client_ip(request),
+            },
+        )
+        serializer.is_valid(raise_exception=True)
+        like, status_code = serializer.save()
+        headers = {}
+        if like.rate_limit is not None and like.rate_limit.limited:
+            # the like is stored as rate limited, the client is told why
+            headers["Retry-After"] = str(math.ceil(like.rate_limit.retry_after))
+            if like.rate_limit.rule is not None:
+                headers["X-RateLimit-Rule"] = like.rate_limit.rule
+        return Response(data=serializer.data, status=status_code, headers=headers)
+
+
+class BulkLikeContentAPIView(APIView):
+    serializer_class = BulkLikeSerializer
+
     def post(self, request):
         serializer = self.serializer_class(
             data=request.data,
-            context={"user_id": request.user.id},
+            context={
+                "user_id": request.user.id,
+                "client_ip": get_client_ip(request),
+            },
         )
         serializer.is_valid(raise_exception=True)
-        _, status_code = serializer.save()
-        return Response(data=serializer.data, status=status_code)
+        return Response(data={"items": serializer.save()}, status=status.HTTP_200_OK)